@@ -1,6 +1,14 @@
 import logging
-from .const import DOMAIN, CONF_GEMINI_API_KEY
+
+import voluptuous as vol
+
+from homeassistant.core import SupportsResponse
+
+from .backfill import DEFAULT_BACKFILL_DAYS, async_cancel_backfill, async_start_backfill
+from .batch import async_get_batch_manager
+from .const import DOMAIN, CONF_GEMINI_API_KEY, CONF_BATCH_MODE, DEFAULT_BATCH_MODE, CONF_WATCHDOG, DEFAULT_WATCHDOG
 from .coordinator import HAGenieCoordinator
+from .watchdog import Watchdog
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -14,12 +22,34 @@ async def async_setup_entry(hass, entry):
     
     api_key = entry.data.get(CONF_GEMINI_API_KEY)
     
-    coordinator = HAGenieCoordinator(hass, entry.data, api_key)
+    coordinator = HAGenieCoordinator(hass, entry.data, api_key, entry_id=entry.entry_id)
+    if entry.data.get(CONF_BATCH_MODE, DEFAULT_BATCH_MODE):
+        # Prompts are queued and submitted together with other entries' prompts
+        coordinator.batch = await async_get_batch_manager(hass)
+    if entry.data.get(CONF_WATCHDOG, DEFAULT_WATCHDOG):
+        # Set up before the first refresh so restored incidents reach the report
+        coordinator.watchdog = Watchdog(hass, coordinator)
+        await coordinator.watchdog.async_start()
+        entry.async_on_unload(coordinator.watchdog.async_stop)
     
-    # Fetch initial data
-    await coordinator.async_config_entry_first_refresh()
+    # Fetch initial data. With an aligned schedule the last stored report is
+    # restored instead, so restarts don't trigger a history query and LLM call.
+    if not coordinator.scheduled or not await coordinator.async_restore_report():
+        await coordinator.async_config_entry_first_refresh()
+    if coordinator.scheduled:
+        if coordinator.missed_run():
+            # HA was down at the last scheduled time: catch up once, spread out like scheduled runs
+            _LOGGER.info("Last scheduled HA Genie report was missed, running it now")
+            coordinator.async_schedule_next_run(delay=coordinator.jitter)
+        else:
+            coordinator.async_schedule_next_run()
+        entry.async_on_unload(coordinator.async_cancel_schedule)
+    if coordinator.batch is not None:
+        # Also delivers results of jobs that finished while we were offline
+        entry.async_on_unload(coordinator.batch.async_register(entry.entry_id, coordinator))
     
     hass.data[DOMAIN][entry.entry_id] = coordinator
+    entry.async_on_unload(lambda: async_cancel_backfill(hass, entry.entry_id))
 
     await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
     
@@ -33,6 +63,43 @@ async def async_setup_entry(hass, entry):
              await coord.async_request_refresh()
         
     hass.services.async_register(DOMAIN, "generate_report", handle_refresh)
+    
+    async def handle_get_report(call):
+        """Return the full latest report on demand, keyed by config entry."""
+        return {
+            entry_id: coord.data or {}
+            for entry_id, coord in hass.data[DOMAIN].items()
+        }
+    
+    hass.services.async_register(
+        DOMAIN, "get_report", handle_get_report, supports_response=SupportsResponse.ONLY
+    )
+    
+    async def handle_backfill(call):
+        """Rebuild the archive and baselines from recorder history in worker processes."""
+        days = call.data["days"]
+        # Runs in the background; progress is reported by ha_genie_backfill_progress events
+        return {
+            entry_id: async_start_backfill(hass, coord, days)
+            for entry_id, coord in hass.data[DOMAIN].items()
+        }
+    
+    async def handle_capture_refresh(call):
+        """Run a refresh and save its recorder output and LLM responses for replay."""
+        return {
+            entry_id: {"path": await coord.async_capture_refresh()}
+            for entry_id, coord in hass.data[DOMAIN].items()
+        }
+    
+    hass.services.async_register(
+        DOMAIN, "capture_refresh", handle_capture_refresh, supports_response=SupportsResponse.OPTIONAL
+    )
+    
+    hass.services.async_register(
+        DOMAIN, "backfill", handle_backfill,
+        schema=vol.Schema({vol.Optional("days", default=DEFAULT_BACKFILL_DAYS): vol.All(vol.Coerce(int), vol.Range(min=7, max=800))}),
+        supports_response=SupportsResponse.OPTIONAL,
+    )
         
     return True
 
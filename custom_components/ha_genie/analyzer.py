@@ -0,0 +1,235 @@
+"""Local rule-based analysis for HA Genie.
+
+Produces the same analysis schema as the Gemini response (status, good_points,
+bad_points, comparison, suggestions) directly from `sensor_aggregates`, so the
+sensors stay useful when the LLM is unavailable.
+"""
+import logging
+import statistics
+from typing import Any, Dict, List, Optional
+
+from .const import (
+    CONF_THRESHOLD_HUMIDITY,
+    CONF_THRESHOLD_CO2,
+    CONF_THRESHOLD_RADON,
+    CONF_THRESHOLD_VOC,
+    CONF_THRESHOLD_TEMP_LOW,
+    DEFAULT_THRESHOLD_HUMIDITY,
+    DEFAULT_THRESHOLD_CO2,
+    DEFAULT_THRESHOLD_RADON,
+    DEFAULT_THRESHOLD_VOC,
+    DEFAULT_THRESHOLD_TEMP_LOW,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+STATUS_GOOD = "Good"
+STATUS_FAIR = "Fair"
+STATUS_NEEDS_ATTENTION = "Needs Attention"
+
+# category -> (label, unit, threshold key, default, suggestion when exceeded)
+UPPER_LIMIT_RULES = {
+    "humidity_avg": (
+        "Humidity", "%", CONF_THRESHOLD_HUMIDITY, DEFAULT_THRESHOLD_HUMIDITY,
+        "Improve ventilation or use a dehumidifier where humidity is high to reduce mould risk.",
+    ),
+    "co2_avg_ppm": (
+        "CO2", "ppm", CONF_THRESHOLD_CO2, DEFAULT_THRESHOLD_CO2,
+        "Open windows or increase mechanical ventilation in rooms with high CO2.",
+    ),
+    "radon_avg_bq_m3": (
+        "Radon", "Bq/m3", CONF_THRESHOLD_RADON, DEFAULT_THRESHOLD_RADON,
+        "Radon is above the reference level: increase underfloor ventilation and consider a professional radon survey.",
+    ),
+    "voc_avg_ppb": (
+        "VOC", "ppb", CONF_THRESHOLD_VOC, DEFAULT_THRESHOLD_VOC,
+        "Ventilate after cooking, cleaning or using solvents to bring VOC levels down.",
+    ),
+}
+
+# Exceeding these is a health risk in its own right, not just a comfort issue
+CRITICAL_CATEGORIES = ("radon_avg_bq_m3", "co2_avg_ppm")
+
+ANALYSIS_LIST_KEYS = ("good_points", "bad_points", "suggestions")
+ANALYSIS_STATUSES = (STATUS_GOOD, STATUS_FAIR, STATUS_NEEDS_ATTENTION)
+
+
+STATUS_SEVERITY = {STATUS_GOOD: 0, STATUS_FAIR: 1, STATUS_NEEDS_ATTENTION: 2}
+
+# Independent analysis domains for split (parallel) LLM calls: domain -> (label, categories)
+ANALYSIS_DOMAINS = {
+    "energy": ("Energy and gas", ("electricity_usage_kwh", "gas_usage_kwh")),
+    "air_quality": ("Indoor air quality", ("humidity_avg", "co2_avg_ppm", "voc_avg_ppb", "radon_avg_bq_m3")),
+    "heating": ("Heating, contacts and valves", ("temperature_avg", "radiator_temps_avg", "contact_openings_count")),
+}
+
+
+def merge_analyses(results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge per-domain analyses deterministically into one analysis.
+
+    Domains are merged in ANALYSIS_DOMAINS order, the worst status wins and
+    duplicate points are dropped. Failed domains are reported in `llm_error`.
+    """
+    merged = {"status": STATUS_GOOD, "good_points": [], "bad_points": [], "comparison": "", "suggestions": []}
+    comparison = []
+    errors = []
+    escalations = []
+
+    for domain, (label, _categories) in ANALYSIS_DOMAINS.items():
+        result = results.get(domain)
+        if result is None:
+            continue
+        if result.get("status") == "Error":
+            errors.extend(f"{label}: {point}" for point in result.get("bad_points", []))
+            continue
+        if STATUS_SEVERITY.get(result.get("status"), 0) > STATUS_SEVERITY[merged["status"]]:
+            merged["status"] = result["status"]
+        for key in ANALYSIS_LIST_KEYS:
+            for point in result.get(key, []):
+                if point not in merged[key]:
+                    merged[key].append(point)
+        if result.get("comparison"):
+            comparison.append(f"{label}: {result['comparison']}")
+        if result.get("escalation_reason"):
+            escalations.append(f"{label}: {result['escalation_reason']}")
+
+    if errors and not comparison:
+        # Every domain failed
+        return {
+            "status": "Error",
+            "good_points": [],
+            "bad_points": errors,
+            "comparison": "Analysis failed.",
+            "suggestions": []
+        }
+    merged["comparison"] = "\n\n".join(comparison)
+    if errors:
+        merged["llm_error"] = errors
+    if escalations:
+        merged["escalation_reason"] = "; ".join(escalations)
+    return merged
+
+
+def validate_analysis(analysis: Any) -> List[str]:
+    """Return a list of schema problems with an analysis dict (empty if valid)."""
+    if not isinstance(analysis, dict):
+        return ["analysis is not an object"]
+    errors = []
+    if analysis.get("status") not in ANALYSIS_STATUSES:
+        errors.append(f"invalid status {analysis.get('status')!r}")
+    for key in ANALYSIS_LIST_KEYS:
+        value = analysis.get(key)
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            errors.append(f"{key} is not a list of strings")
+    if not isinstance(analysis.get("comparison"), str):
+        errors.append("comparison is not a string")
+    return errors
+
+
+def get_thresholds(config: Dict[str, Any]) -> Dict[str, float]:
+    """Return the configured thresholds keyed by config key."""
+    return {
+        CONF_THRESHOLD_HUMIDITY: config.get(CONF_THRESHOLD_HUMIDITY, DEFAULT_THRESHOLD_HUMIDITY),
+        CONF_THRESHOLD_CO2: config.get(CONF_THRESHOLD_CO2, DEFAULT_THRESHOLD_CO2),
+        CONF_THRESHOLD_RADON: config.get(CONF_THRESHOLD_RADON, DEFAULT_THRESHOLD_RADON),
+        CONF_THRESHOLD_VOC: config.get(CONF_THRESHOLD_VOC, DEFAULT_THRESHOLD_VOC),
+        CONF_THRESHOLD_TEMP_LOW: config.get(CONF_THRESHOLD_TEMP_LOW, DEFAULT_THRESHOLD_TEMP_LOW),
+    }
+
+
+def aggregate_values(value: Any) -> List[float]:
+    """Return the numeric values of an aggregate (single value or binned list)."""
+    if isinstance(value, (int, float)):
+        return [float(value)]
+    if isinstance(value, list):
+        return [float(b["value"]) for b in value if isinstance(b, dict) and b.get("value") is not None]
+    return []
+
+
+def _summarise(value: Any) -> Optional[Dict[str, float]]:
+    values = aggregate_values(value)
+    if not values:
+        return None
+    return {"mean": statistics.mean(values), "peak": max(values), "low": min(values), "bins": len(values)}
+
+
+def analyze_locally(aggregates: Dict[str, Any], thresholds: Dict[str, float]) -> Dict[str, Any]:
+    """Analyse sensor aggregates with fixed rules and return an analysis dict."""
+    good_points = []
+    bad_points = []
+    suggestions = []
+    comparison = []
+    critical = False
+
+    for category, (label, unit, key, default, suggestion) in UPPER_LIMIT_RULES.items():
+        entities = aggregates.get(category)
+        if not entities:
+            continue
+        limit = thresholds.get(key, default)
+        exceeded = False
+        for entity_id, value in entities.items():
+            stats = _summarise(value)
+            if stats is None:
+                continue
+            if stats["mean"] > limit:
+                exceeded = True
+                bad_points.append(
+                    f"{label} at {entity_id} averaged {stats['mean']:.0f} {unit}, above the {limit} {unit} threshold."
+                )
+            elif stats["bins"] > 1 and stats["peak"] > limit:
+                exceeded = True
+                bad_points.append(
+                    f"{label} at {entity_id} peaked at {stats['peak']:.0f} {unit}, above the {limit} {unit} threshold."
+                )
+        if exceeded:
+            suggestions.append(suggestion)
+            if category in CRITICAL_CATEGORIES:
+                critical = True
+        else:
+            good_points.append(f"{label} stayed below {limit} {unit} on all {len(entities)} sensor(s).")
+
+    temps = aggregates.get("temperature_avg")
+    if temps:
+        low_limit = thresholds.get(CONF_THRESHOLD_TEMP_LOW, DEFAULT_THRESHOLD_TEMP_LOW)
+        cold = []
+        for entity_id, value in temps.items():
+            stats = _summarise(value)
+            if stats is not None and stats["mean"] < low_limit:
+                cold.append(entity_id)
+                bad_points.append(
+                    f"Temperature at {entity_id} averaged {stats['mean']:.1f} C, below {low_limit} C."
+                )
+        if cold:
+            suggestions.append("Raise heating in cold rooms to reduce condensation and health risks.")
+        else:
+            good_points.append(f"All rooms averaged at least {low_limit} C.")
+
+    for category, label in (("electricity_usage_kwh", "Electricity"), ("gas_usage_kwh", "Gas")):
+        entities = aggregates.get(category)
+        if not entities:
+            continue
+        total = sum(sum(aggregate_values(v)) for v in entities.values())
+        comparison.append(f"{label} usage totalled {total:.1f} kWh over the period.")
+
+    contacts = aggregates.get("contact_openings_count")
+    if contacts:
+        total = sum(sum(aggregate_values(v)) for v in contacts.values())
+        comparison.append(f"Doors and windows were opened {total:.0f} times.")
+
+    if critical or len(bad_points) >= 3:
+        status = STATUS_NEEDS_ATTENTION
+    elif bad_points:
+        status = STATUS_FAIR
+    else:
+        status = STATUS_GOOD
+
+    comparison.insert(0, "Local rule-based analysis against configured thresholds (no seasonal benchmarking).")
+
+    return {
+        "status": status,
+        "good_points": good_points,
+        "bad_points": bad_points,
+        "comparison": " ".join(comparison),
+        "suggestions": suggestions,
+        "source": "local",
+    }
@@ -0,0 +1,207 @@
+"""Persistent aggregate archive for HA Genie.
+
+Every report appends its binned aggregates to fixed-width binary column files,
+one per averaging period, category and entity:
+
+    <config>/ha_genie_archive/<entry_id>/<period>/<category>/<entity_id>.bin
+
+Each record is two little-endian float64 values (bin start as a UTC epoch and
+the aggregate value). Records are only appended when they are newer than the
+last archived bin, which a later report may update, so files stay sorted and
+can be range-read by bisecting a memory map instead of querying the recorder.
+
+All methods do blocking file I/O and must run in the executor.
+"""
+import logging
+import mmap
+import os
+import struct
+import statistics
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .const import SUMMED_CATEGORIES
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<dd")
+ARCHIVE_DIR = "ha_genie_archive"
+
+COMPACT_BUCKET = 86400.0 # Compact old records into one per day
+
+
+def _parse_time(value: Any) -> Optional[float]:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+class AggregateArchive:
+    """Append-only columnar archive of binned aggregates."""
+
+    def __init__(self, base_path: str, retention_days: int, compact_after_days: int):
+        """Initialize."""
+        self.base_path = base_path
+        self.retention = timedelta(days=retention_days)
+        self.compact_after = timedelta(days=compact_after_days)
+        self._last_compaction: Optional[datetime] = None
+
+    def _column_path(self, period: str, category: str, entity_id: str) -> str:
+        return os.path.join(self.base_path, period, category, f"{entity_id}.bin")
+
+    def append(self, period: str, window_start: datetime, aggregates: Dict[str, Dict[str, Any]]) -> int:
+        """Append one report's aggregates. Returns the number of records written."""
+        written = 0
+        window_ts = window_start.timestamp()
+        for category, entities in aggregates.items():
+            for entity_id, value in entities.items():
+                if isinstance(value, list):
+                    # The bin in progress is archived by a later report, once complete
+                    records = [
+                        (_parse_time(b.get("start")), b.get("value"))
+                        for b in value if isinstance(b, dict) and not b.get("partial")
+                    ]
+                else:
+                    # Single aggregate for the whole window
+                    records = [(window_ts, value)]
+                records = [(t, float(v)) for t, v in records if t is not None and v is not None]
+                if records:
+                    written += self._append_column(self._column_path(period, category, entity_id), records)
+        return written
+
+    def _append_column(self, path: str, records: List[Tuple[float, float]]) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 0
+        last_start = None
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            size -= size % RECORD.size
+            if size:
+                with open(path, "rb") as f:
+                    f.seek(size - RECORD.size)
+                    last_start = RECORD.unpack(f.read(RECORD.size))[0]
+
+        # Overlapping report windows re-send old bins; only keep newer ones. A
+        # re-sent last bin replaces the archived record instead of being dropped.
+        new = [r for r in sorted(records) if last_start is None or r[0] >= last_start]
+        if not new:
+            return 0
+        offset = size - RECORD.size if new[0][0] == last_start else size
+        with open(path, "r+b" if size else "wb") as f:
+            f.seek(offset)
+            f.write(b"".join(RECORD.pack(*r) for r in new))
+            f.truncate()
+        return len(new)
+
+    def insert(self, period: str, records: Dict[str, Dict[str, List[Tuple[float, float]]]]) -> int:
+        """Merge backfilled (bin start, value) records into the columns.
+
+        Unlike append, records may be older than the archived ones. Days that
+        already have archived records are left untouched, so a compacted daily
+        value is never mixed with backfilled hourly ones.
+        """
+        written = 0
+        for category, entities in records.items():
+            for entity_id, column in entities.items():
+                written += self._merge_column(self._column_path(period, category, entity_id), column)
+        return written
+
+    def _merge_column(self, path: str, records: List[Tuple[float, float]]) -> int:
+        existing = []
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            existing = [RECORD.unpack_from(data, i) for i in range(0, len(data) - len(data) % RECORD.size, RECORD.size)]
+        archived_days = {ts - ts % COMPACT_BUCKET for ts, _value in existing}
+        new = {ts: value for ts, value in records if ts - ts % COMPACT_BUCKET not in archived_days}
+        if not new:
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(RECORD.pack(*r) for r in sorted(existing + list(new.items()))))
+        os.replace(tmp_path, path)
+        return len(new)
+
+    def read(self, period: str, category: str, entity_id: str, start: datetime, end: datetime) -> List[Tuple[datetime, float]]:
+        """Return archived (bin start, value) records with start <= bin start < end."""
+        path = self._column_path(period, category, entity_id)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            count = os.fstat(f.fileno()).st_size // RECORD.size
+            if not count:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                first = self._bisect(mm, count, start.timestamp())
+                last = self._bisect(mm, count, end.timestamp())
+                tz = start.tzinfo
+                return [
+                    (datetime.fromtimestamp(ts, tz), value)
+                    for ts, value in (RECORD.unpack_from(mm, i * RECORD.size) for i in range(first, last))
+                ]
+
+    @staticmethod
+    def _bisect(mm, count: int, ts: float) -> int:
+        """Index of the first record whose bin start is >= ts."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(mm, mid * RECORD.size)[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def compact(self, now: datetime, force: bool = False) -> None:
+        """Drop records beyond retention and merge old records into daily buckets."""
+        if not force and self._last_compaction and now - self._last_compaction < timedelta(days=1):
+            return
+        self._last_compaction = now
+
+        expire_ts = (now - self.retention).timestamp()
+        compact_ts = (now - self.compact_after).timestamp()
+        # Only compact whole days so a bucket is never merged twice
+        compact_ts -= compact_ts % COMPACT_BUCKET
+        if not os.path.isdir(self.base_path):
+            return
+
+        for root, _dirs, files in os.walk(self.base_path):
+            category = os.path.basename(root)
+            for name in files:
+                if name.endswith(".bin"):
+                    self._compact_column(os.path.join(root, name), category, expire_ts, compact_ts)
+
+    def _compact_column(self, path: str, category: str, expire_ts: float, compact_ts: float) -> None:
+        with open(path, "rb") as f:
+            data = f.read()
+        records = [RECORD.unpack_from(data, i) for i in range(0, len(data) - len(data) % RECORD.size, RECORD.size)]
+        kept = [r for r in records if r[0] >= expire_ts]
+
+        old: Dict[float, List[float]] = {}
+        recent = []
+        for ts, value in kept:
+            if ts < compact_ts:
+                old.setdefault(ts - ts % COMPACT_BUCKET, []).append(value)
+            else:
+                recent.append((ts, value))
+        merge = sum if category in SUMMED_CATEGORIES else statistics.mean
+        compacted = sorted((bucket, merge(values)) for bucket, values in old.items()) + recent
+
+        if len(compacted) == len(records):
+            return
+        if not compacted:
+            os.remove(path)
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(RECORD.pack(*r) for r in compacted))
+        os.replace(tmp_path, path)
+        _LOGGER.debug("Compacted archive column %s from %s to %s records", path, len(records), len(compacted))
@@ -0,0 +1,282 @@
+"""LLM backends for HA Genie.
+
+The coordinator talks to an `LLMBackend` instead of a specific SDK:
+
+- `GeminiBackend` uses the google-genai client (blocking calls run in the executor).
+- `HTTPJSONBackend` talks to any OpenAI-compatible `/chat/completions` endpoint
+  (self-hosted models, or the bundled `scripts/mock_llm_server.py` used for load
+  testing) through Home Assistant's shared, pooled aiohttp session.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+
+import aiohttp
+import google.genai as genai
+
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .const import (
+    CONF_LLM_BACKEND,
+    CONF_LLM_BASE_URL,
+    DEFAULT_LLM_BACKEND,
+    DEFAULT_LLM_BASE_URL,
+    LLM_BACKEND_OPENAI_COMPATIBLE,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=120)
+MAX_RATE_LIMIT_RETRIES = 2
+MAX_RETRY_AFTER = 30 # seconds
+
+# Gemini batch job states after which the job will not change any more
+BATCH_DONE_STATES = ("JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED")
+
+
+@dataclass
+class LLMUsage:
+    """Token usage reported by a backend."""
+
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+
+
+@dataclass
+class LLMResponse:
+    """A complete response, or one streamed chunk of it."""
+
+    text: str
+    usage: Optional[LLMUsage] = None
+    # Set on failed batch requests instead of raising
+    error: Optional[str] = None
+
+
+class LLMBackend(ABC):
+    """Interface for LLM backends."""
+
+    name = "base"
+
+    def __init__(self, hass):
+        """Initialize."""
+        self.hass = hass
+        # Background tasks of locally emulated batch jobs, by job name
+        self._local_batches = {}
+
+    @abstractmethod
+    async def async_generate(self, model: str, prompt: str) -> LLMResponse:
+        """Generate a complete response."""
+
+    async def async_generate_stream(self, model: str, prompt: str) -> AsyncIterator[LLMResponse]:
+        """Yield response chunks as they arrive. Usage, if any, is on the last chunks."""
+        # Backends without streaming yield the whole response as one chunk
+        yield await self.async_generate(model, prompt)
+
+    async def async_count_tokens(self, model: str, prompt: str) -> Optional[int]:
+        """Return the exact prompt token count, or None if the backend can't count."""
+        return None
+
+    async def async_submit_batch(self, model: str, prompts: List[str]) -> str:
+        """Submit prompts as one batch job and return the job name.
+
+        Backends without a batch API get a local stand-in that runs the
+        requests one after another in the background. Local jobs do not
+        survive a restart; polling them then raises KeyError.
+        """
+        name = f"local-{uuid.uuid4().hex}"
+        self._local_batches[name] = self.hass.async_create_background_task(
+            self._run_local_batch(model, prompts), f"ha_genie local batch {name}"
+        )
+        return name
+
+    async def async_get_batch(self, name: str) -> Optional[List[LLMResponse]]:
+        """Return the responses in prompt order, or None while the job is running."""
+        task = self._local_batches.get(name)
+        if task is None:
+            raise KeyError(name)
+        if not task.done():
+            return None
+        del self._local_batches[name]
+        return task.result()
+
+    async def _run_local_batch(self, model: str, prompts: List[str]) -> List[LLMResponse]:
+        results = []
+        for prompt in prompts:
+            try:
+                results.append(await self.async_generate(model, prompt))
+            except Exception as e:
+                results.append(LLMResponse("", error=str(e)))
+        return results
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini via the google-genai SDK."""
+
+    name = "gemini"
+
+    def __init__(self, hass, api_key: str):
+        """Initialize."""
+        super().__init__(hass)
+        # Configure the SDK (New Syntax)
+        self.client = genai.Client(api_key=api_key)
+
+    @staticmethod
+    def _usage(metadata) -> Optional[LLMUsage]:
+        if metadata is None:
+            return None
+        return LLMUsage(
+            prompt_tokens=getattr(metadata, "prompt_token_count", None),
+            output_tokens=getattr(metadata, "candidates_token_count", None),
+            total_tokens=getattr(metadata, "total_token_count", None),
+        )
+
+    async def async_generate(self, model: str, prompt: str) -> LLMResponse:
+        def _sync_call():
+            return self.client.models.generate_content(model=model, contents=prompt)
+
+        response = await self.hass.async_add_executor_job(_sync_call)
+        # SDK should return an object where .text is the response content
+        return LLMResponse(response.text, self._usage(getattr(response, "usage_metadata", None)))
+
+    async def async_generate_stream(self, model: str, prompt: str) -> AsyncIterator[LLMResponse]:
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def _sync_stream():
+            # The SDK iterator blocks, so it runs in the executor and hands chunks to the loop
+            try:
+                for chunk in self.client.models.generate_content_stream(model=model, contents=prompt):
+                    loop.call_soon_threadsafe(
+                        queue.put_nowait,
+                        LLMResponse(chunk.text or "", self._usage(getattr(chunk, "usage_metadata", None)))
+                    )
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        stream_job = self.hass.async_add_executor_job(_sync_stream)
+        while (chunk := await queue.get()) is not None:
+            yield chunk
+        # Re-raises any error from the stream
+        await stream_job
+
+    async def async_count_tokens(self, model: str, prompt: str) -> Optional[int]:
+        def _sync_count():
+            return self.client.models.count_tokens(model=model, contents=prompt)
+
+        response = await self.hass.async_add_executor_job(_sync_count)
+        return getattr(response, "total_tokens", None)
+
+    async def async_submit_batch(self, model: str, prompts: List[str]) -> str:
+        def _sync_submit():
+            return self.client.batches.create(
+                model=model,
+                src=[{"contents": [{"parts": [{"text": prompt}], "role": "user"}]} for prompt in prompts],
+                config={"display_name": "ha-genie"},
+            )
+
+        job = await self.hass.async_add_executor_job(_sync_submit)
+        return job.name
+
+    async def async_get_batch(self, name: str) -> Optional[List[LLMResponse]]:
+        job = await self.hass.async_add_executor_job(lambda: self.client.batches.get(name=name))
+        state = getattr(job.state, "name", str(job.state))
+        if state not in BATCH_DONE_STATES:
+            return None
+        if state != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"Batch job {name} ended in state {state}")
+        results = []
+        # Inline responses come back in request order
+        for item in job.dest.inlined_responses:
+            if getattr(item, "error", None):
+                results.append(LLMResponse("", error=str(item.error)))
+            else:
+                results.append(LLMResponse(item.response.text, self._usage(getattr(item.response, "usage_metadata", None))))
+        return results
+
+
+class HTTPJSONBackend(LLMBackend):
+    """OpenAI-compatible chat completions endpoint over HTTP/JSON."""
+
+    name = "openai_compatible"
+
+    def __init__(self, hass, api_key: str, base_url: str):
+        """Initialize."""
+        super().__init__(hass)
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        # Shared session: connections are pooled across calls and entries
+        self.session = async_get_clientsession(hass)
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    @staticmethod
+    def _usage(usage) -> Optional[LLMUsage]:
+        if not usage:
+            return None
+        return LLMUsage(
+            prompt_tokens=usage.get("prompt_tokens"),
+            output_tokens=usage.get("completion_tokens"),
+            total_tokens=usage.get("total_tokens"),
+        )
+
+    async def _post(self, body):
+        """POST with a bounded retry on 429 rate limits. Returns an open response."""
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            response = await self.session.post(self.url, json=body, headers=self._headers(), timeout=HTTP_TIMEOUT)
+            if response.status != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                if response.status >= 400:
+                    response.release()
+                    response.raise_for_status()
+                return response
+            try:
+                delay = min(float(response.headers.get("Retry-After", 1)), MAX_RETRY_AFTER)
+            except ValueError:
+                delay = 1
+            response.release()
+            _LOGGER.debug("Rate limited by %s, retrying in %ss", self.url, delay)
+            await asyncio.sleep(delay)
+
+    async def async_generate(self, model: str, prompt: str) -> LLMResponse:
+        body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        response = await self._post(body)
+        async with response:
+            result = await response.json(content_type=None)
+        return LLMResponse(result["choices"][0]["message"]["content"], self._usage(result.get("usage")))
+
+    async def async_generate_stream(self, model: str, prompt: str) -> AsyncIterator[LLMResponse]:
+        body = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        response = await self._post(body)
+        async with response:
+            # Server-sent events: one "data: {json}" line per chunk
+            async for raw_line in response.content:
+                line = raw_line.decode().strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                choices = event.get("choices") or [{}]
+                text = (choices[0].get("delta") or {}).get("content") or ""
+                yield LLMResponse(text, self._usage(event.get("usage")))
+
+
+def create_backend(hass, config, api_key) -> LLMBackend:
+    """Create the configured LLM backend."""
+    if config.get(CONF_LLM_BACKEND, DEFAULT_LLM_BACKEND) == LLM_BACKEND_OPENAI_COMPATIBLE:
+        return HTTPJSONBackend(hass, api_key, config.get(CONF_LLM_BASE_URL, DEFAULT_LLM_BASE_URL))
+    return GeminiBackend(hass, api_key)
@@ -0,0 +1,253 @@
+"""Backfill of the aggregate archive and baselines from recorder history.
+
+Rebuilding months of history for many entities is CPU-bound, so the window is
+split into partitions of one UTC day and one group of entities of the same
+category. Each partition is read from the recorder in the executor, reduced to
+hourly bins and a daily value by the `data.py` calculators in a worker process
+(outside the GIL and the shared executor), and merged into the archive. One
+pool serves the whole run, so the workers start only once. Finished
+partitions and the daily values are saved in `.storage` after every step, so
+an interrupted backfill resumes where it stopped. Complete weeks are folded
+into the baselines at the end, without replacing weeks the baselines already
+hold.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .baselines import report_value
+from .const import (
+    DOMAIN,
+    CONF_DATA_AVERAGING,
+    DEFAULT_DATA_AVERAGING,
+    DATA_AVERAGING_HOURLY,
+    DATA_AVERAGING_DAILY,
+)
+from .backfill_worker import DAY, reduce_partition
+from .data import CATEGORY_NODES, compact_states, history
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_BACKFILLS = f"{DOMAIN}_backfills"
+STORAGE_VERSION = 1
+
+DEFAULT_BACKFILL_DAYS = 90
+GROUP_SIZE = 25 # Entities per partition
+MAX_WORKERS = 4 # Worker processes, one core is always left to Home Assistant
+
+
+def read_partition(hass, entity_ids: List[str], start: datetime, end: datetime) -> Dict[str, list]:
+    """Read one partition from the recorder as compact rows (runs in the executor).
+
+    The state each entity had at `start` is included, clamped to `start`, so
+    a meter's first hour counts from the reading before the day began.
+    """
+    states = history.get_significant_states(hass, start, end, entity_ids, None, True, True, False)
+    return {
+        entity_id: compact_states(entity_states, start.timestamp())
+        for entity_id, entity_states in states.items()
+    }
+
+
+def backfill_plan(config: Dict[str, Any], days: int, now: datetime) -> Dict[str, Any]:
+    """Return the backfill window (whole UTC days up to today) and entity groups."""
+    end = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    groups = []
+    for category, (config_key, _calc) in CATEGORY_NODES.items():
+        entity_ids = sorted(config.get(config_key) or [])
+        for i in range(0, len(entity_ids), GROUP_SIZE):
+            groups.append([category, entity_ids[i:i + GROUP_SIZE]])
+    return {"days": days, "start": (end - days * DAY).isoformat(), "end": end.isoformat(), "groups": groups}
+
+
+def complete_weeks(daily: Dict[str, Dict[str, float]], start: datetime, end: datetime):
+    """Yield (mid-week time, aggregates) for every ISO week fully inside the window, oldest first."""
+    week = start + (-start.weekday() % 7) * DAY
+    while week + 7 * DAY <= end:
+        day_keys = {(week + i * DAY).date().isoformat() for i in range(7)}
+        aggregates = {}
+        for key, values in daily.items():
+            category, entity_id = key.split("|", 1)
+            bins = [{"value": v} for day, v in sorted(values.items()) if day in day_keys]
+            if bins:
+                aggregates.setdefault(category, {})[entity_id] = bins
+        if aggregates:
+            # Thursday decides the ISO week in every timezone
+            yield dt_util.as_local(week + timedelta(days=3, hours=12)), aggregates
+        week += 7 * DAY
+
+
+class Backfill:
+    """Resumable backfill for one config entry."""
+
+    def __init__(self, hass, coordinator):
+        """Initialize."""
+        self.hass = hass
+        self.coordinator = coordinator
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{coordinator.entry_id or 'default'}.backfill")
+        self.progress = {"status": "idle", "done": 0, "total": 0}
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        """Return True while a backfill task is running."""
+        return self._task is not None and not self._task.done()
+
+    def async_start(self, days: int) -> Dict[str, Any]:
+        """Start (or resume) a backfill unless one is running. Returns the progress."""
+        if not self.running:
+            self.progress = {"status": "starting", "done": 0, "total": 0}
+            self._task = self.hass.async_create_background_task(
+                self._async_run(days), f"ha_genie backfill {self.coordinator.entry_id}"
+            )
+        return dict(self.progress)
+
+    def async_cancel(self):
+        """Stop the backfill. Finished partitions are kept for the next run."""
+        if self.running:
+            self._task.cancel()
+
+    def _update_progress(self, status: str, done: int, total: int, state: Dict[str, Any]):
+        self.progress = {
+            "status": status,
+            "done": done,
+            "total": total,
+            "start": state["plan"]["start"],
+            "end": state["plan"]["end"],
+        }
+        self.hass.bus.async_fire(f"{DOMAIN}_backfill_progress", dict(self.progress, entry_id=self.coordinator.entry_id))
+
+    async def _async_load_state(self, days: int) -> Dict[str, Any]:
+        plan = backfill_plan(self.coordinator.config, days, dt_util.utcnow())
+        stored = await self._store.async_load()
+        if (
+            stored and not stored.get("finished")
+            and stored["plan"]["days"] == days and stored["plan"]["groups"] == plan["groups"]
+        ):
+            _LOGGER.info("Resuming backfill from %s with %s partitions done", stored["plan"]["start"], len(stored["done"]))
+            return stored
+        return {"plan": plan, "done": [], "daily": {}, "finished": False}
+
+    async def _async_run(self, days: int):
+        if history is None:
+            _LOGGER.error("Recorder history module not available.")
+            self.progress = {"status": "failed", "done": 0, "total": 0}
+            return
+
+        state = await self._async_load_state(days)
+        plan = state["plan"]
+        start = datetime.fromisoformat(plan["start"])
+        end = datetime.fromisoformat(plan["end"])
+        day_starts = [start + i * DAY for i in range(days)]
+        total = len(day_starts) * len(plan["groups"])
+        done = set(state["done"])
+        pending = [
+            (day, index)
+            for day in day_starts
+            for index in range(len(plan["groups"]))
+            if self._partition_key(day, index) not in done
+        ]
+        self._update_progress("running", len(done), total, state)
+
+        workers = max(1, min(MAX_WORKERS, (os.cpu_count() or 2) - 1))
+        # Fresh workers don't inherit the event loop's threads and locks
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        try:
+            for i in range(0, len(pending), workers):
+                step = pending[i:i + workers]
+                results = await self._async_run_step(pool, plan["groups"], step)
+                await self._async_store_results(state, plan["groups"], step, results)
+                done.update(self._partition_key(day, index) for day, index in step)
+                state["done"] = sorted(done)
+                await self._store.async_save(state)
+                self._update_progress("running", len(done), total, state)
+                _LOGGER.debug("Backfill: %s of %s partitions done", len(done), total)
+
+            await self._async_finish(state, start, end)
+            self._update_progress("completed", len(done), total, state)
+            _LOGGER.info("Backfill of %s days finished", days)
+        except asyncio.CancelledError:
+            self.progress["status"] = "interrupted"
+            raise
+        except Exception:
+            _LOGGER.exception("Backfill failed after %s of %s partitions, call the service again to resume", len(done), total)
+            self._update_progress("failed", len(done), total, state)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _partition_key(day: datetime, index: int) -> str:
+        return f"{day.date().isoformat()}|{index}"
+
+    async def _async_run_step(self, pool, groups, step):
+        """Read the partitions of one step in the executor and reduce them in the pool."""
+        return await asyncio.gather(*(self._async_run_partition(pool, groups[index], day) for day, index in step))
+
+    async def _async_run_partition(self, pool, group, day: datetime) -> Dict[str, Dict[str, Any]]:
+        category, entity_ids = group
+        samples = await self.hass.async_add_executor_job(read_partition, self.hass, entity_ids, day, day + DAY)
+        return await asyncio.get_running_loop().run_in_executor(pool, reduce_partition, category, day.timestamp(), samples)
+
+    async def _async_store_results(self, state, groups, step, results):
+        period = self.coordinator.config.get(CONF_DATA_AVERAGING, DEFAULT_DATA_AVERAGING)
+        records = {}
+        for (day, index), result in zip(step, results):
+            category = groups[index][0]
+            for entity_id, values in result.items():
+                if values["daily"] is not None:
+                    state["daily"].setdefault(f"{category}|{entity_id}", {})[day.date().isoformat()] = values["daily"]
+                if period == DATA_AVERAGING_HOURLY:
+                    column = values["hourly"]
+                elif period == DATA_AVERAGING_DAILY and values["daily"] is not None:
+                    column = [(day.timestamp(), values["daily"])]
+                else:
+                    # Weekly records are written from complete weeks at the end
+                    continue
+                records.setdefault(category, {}).setdefault(entity_id, []).extend(column)
+
+        archive = self.coordinator.archive
+        if archive is not None and records:
+            await self.hass.async_add_executor_job(archive.insert, period, records)
+
+    async def _async_finish(self, state, start: datetime, end: datetime):
+        weeks = list(complete_weeks(state["daily"], start, end))
+        archive = self.coordinator.archive
+        if archive is not None:
+            period = self.coordinator.config.get(CONF_DATA_AVERAGING, DEFAULT_DATA_AVERAGING)
+            if period not in (DATA_AVERAGING_HOURLY, DATA_AVERAGING_DAILY):
+                records = {}
+                for week_time, aggregates in weeks:
+                    week_start = dt_util.as_utc(week_time) - timedelta(days=3, hours=12)
+                    for category, entities in aggregates.items():
+                        for entity_id, bins in entities.items():
+                            records.setdefault(category, {}).setdefault(entity_id, []).append(
+                                (week_start.timestamp(), round(report_value(category, bins), 2))
+                            )
+                await self.hass.async_add_executor_job(archive.insert, period, records)
+            # Old hourly data is merged into daily values and data beyond retention dropped
+            await self.hass.async_add_executor_job(archive.compact, dt_util.utcnow(), True)
+        await self.coordinator.async_fold_baselines(weeks)
+        state["finished"] = True
+        await self._store.async_save(state)
+
+
+def async_start_backfill(hass, coordinator, days: int = DEFAULT_BACKFILL_DAYS) -> Dict[str, Any]:
+    """Start or resume the backfill of an entry and return its progress."""
+    backfills = hass.data.setdefault(DATA_BACKFILLS, {})
+    if (backfill := backfills.get(coordinator.entry_id)) is None or backfill.coordinator is not coordinator:
+        backfill = backfills[coordinator.entry_id] = Backfill(hass, coordinator)
+    return backfill.async_start(days)
+
+
+def async_cancel_backfill(hass, entry_id):
+    """Stop a running backfill when its entry unloads."""
+    if (backfill := hass.data.get(DATA_BACKFILLS, {}).pop(entry_id, None)) is not None:
+        backfill.async_cancel()
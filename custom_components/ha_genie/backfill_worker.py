@@ -0,0 +1,32 @@
+"""Backfill reduction, run in the backfill's worker processes.
+
+Only compact rows and plain values cross the process boundary, and nothing
+here touches Home Assistant. A worker imports the integration once, when the
+pool starts it, and then reduces partitions for the rest of the backfill.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from .data import CATEGORY_NODES, COUNTER_CATEGORIES, bin_history_data, expand_states
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def reduce_partition(category: str, day_start_ts: float, samples: Dict[str, list]) -> Dict[str, Dict[str, Any]]:
+    """Reduce one day of samples to hourly bins and a daily value."""
+    calc_func = CATEGORY_NODES[category][1]
+    start = datetime.fromtimestamp(day_start_ts, timezone.utc)
+    result = {}
+    for entity_id, rows in samples.items():
+        states = expand_states(rows)
+        if not states:
+            continue
+        hourly = []
+        for b in bin_history_data(states, start, start + DAY, HOUR, category in COUNTER_CATEGORIES):
+            value = calc_func(b["states"])
+            if value is not None:
+                hourly.append((datetime.fromisoformat(b["start"]).timestamp(), round(value, 2)))
+        daily = calc_func(states)
+        result[entity_id] = {"hourly": hourly, "daily": None if daily is None else round(daily, 2)}
+    return result
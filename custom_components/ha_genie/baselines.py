@@ -0,0 +1,172 @@
+"""Trend and seasonal baselines for HA Genie.
+
+Keeps a small per-entity history of report values (one per ISO week) so every
+report can be compared against the rolling 4-week mean and the same month last
+year without asking the LLM to estimate seasonal benchmarks. The state is
+updated incrementally after each report and persisted in `.storage`.
+
+When the aggregate archive is enabled, both baselines are derived from the
+archived bins instead. They also cover history from before the tracker was
+set up or rebuilt by a backfill.
+"""
+import logging
+import statistics
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from .analyzer import aggregate_values
+from .const import SUMMED_CATEGORIES, DATA_AVERAGING_HOURLY, DATA_AVERAGING_DAILY
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+ROLLING_WEEKS = 4
+MONTHS_KEPT = 14 # Enough to reach the same month last year
+
+WEEK = timedelta(days=7)
+
+
+def week_key(now: datetime) -> str:
+    year, week, _ = now.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def month_key(now: datetime, years_back: int = 0) -> str:
+    return f"{now.year - years_back}-{now.month:02d}"
+
+
+def report_value(category: str, value: Any) -> Optional[float]:
+    """Reduce an aggregate (single or binned) to one value for the report window."""
+    if isinstance(value, list):
+        # Whole bins only, so totals stay comparable between reports
+        value = [b for b in value if not (isinstance(b, dict) and b.get("partial"))]
+    values = aggregate_values(value)
+    if not values:
+        return None
+    if category in SUMMED_CATEGORIES:
+        return sum(values)
+    return statistics.mean(values)
+
+
+def _deviation_pct(current: float, baseline: float) -> Optional[float]:
+    if not baseline:
+        return None
+    return round((current - baseline) / abs(baseline) * 100, 1)
+
+
+def _baseline(current: float, weeks: List[float], seasonal: List[float]) -> Dict[str, Any]:
+    result = {"now": round(current, 2)}
+    if weeks:
+        rolling = statistics.mean(weeks)
+        result["4w"] = round(rolling, 2)
+        result["4w_pct"] = _deviation_pct(current, rolling)
+    if seasonal:
+        same_month = statistics.mean(seasonal)
+        result["ly"] = round(same_month, 2)
+        result["ly_pct"] = _deviation_pct(current, same_month)
+    return result
+
+
+def _month_start(year: int, month: int, tzinfo) -> datetime:
+    return datetime(year + (month - 1) // 12, (month - 1) % 12 + 1, 1, tzinfo=tzinfo)
+
+
+def archived_weeks(archive, period: str, category: str, entity_id: str, start: datetime, end: datetime) -> List[float]:
+    """Return the report value of every complete 7-day window in [start, end), oldest first.
+
+    Hourly and daily bins (also once compacted into days) only count for a
+    window with bins on each of its days. Weekly records already hold the
+    value of one report window.
+    """
+    records = archive.read(period, category, entity_id, start, end)
+    values = []
+    week = start
+    while week + WEEK <= end:
+        bins = [(ts, value) for ts, value in records if week <= ts < week + WEEK]
+        if period not in (DATA_AVERAGING_HOURLY, DATA_AVERAGING_DAILY):
+            if bins:
+                values.append(statistics.mean(value for _ts, value in bins))
+        elif len({ts.astimezone(timezone.utc).date() for ts, _value in bins}) >= 7:
+            values.append(report_value(category, [{"value": value} for _ts, value in bins]))
+        week += WEEK
+    return values
+
+
+def archive_baselines(archive, period: str, aggregates: Dict[str, Dict[str, Any]], window_start: datetime, now: datetime) -> Dict[str, Dict[str, Any]]:
+    """Return rolling and seasonal baselines from the aggregate archive (runs in the executor).
+
+    The rolling mean covers the 4 weeks before the report window starts.
+    """
+    last_year_start = _month_start(now.year - 1, now.month, now.tzinfo)
+    last_year_end = _month_start(now.year - 1, now.month + 1, now.tzinfo)
+    baselines = {}
+    for category, entities in aggregates.items():
+        for entity_id, value in entities.items():
+            current = report_value(category, value)
+            if current is None:
+                continue
+            weeks = archived_weeks(archive, period, category, entity_id, window_start - ROLLING_WEEKS * WEEK, window_start)
+            seasonal = archived_weeks(archive, period, category, entity_id, last_year_start, last_year_end)
+            result = _baseline(current, weeks, seasonal)
+            if len(result) > 1:
+                baselines.setdefault(category, {})[entity_id] = result
+    return baselines
+
+
+class BaselineTracker:
+    """Incrementally maintained rolling and seasonal baselines."""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        """Initialize from previously stored data."""
+        self.data = data or {"entities": {}}
+
+    def compute(self, aggregates: Dict[str, Dict[str, Any]], now: datetime) -> Dict[str, Dict[str, Any]]:
+        """Return compact baselines for the current aggregates, excluding this week's report."""
+        this_week = week_key(now)
+        last_year = month_key(now, years_back=1)
+        baselines = {}
+
+        for category, entities in aggregates.items():
+            for entity_id, value in entities.items():
+                current = report_value(category, value)
+                record = self.data["entities"].get(f"{category}|{entity_id}")
+                if current is None or record is None:
+                    continue
+
+                weeks = [v for k, v in sorted(record["weeks"].items()) if k != this_week][-ROLLING_WEEKS:]
+                seasonal = list(record["months"].get(last_year, {}).values())
+                result = _baseline(current, weeks, seasonal)
+                if len(result) > 1:
+                    baselines.setdefault(category, {})[entity_id] = result
+
+        return baselines
+
+    def update(self, aggregates: Dict[str, Dict[str, Any]], now: datetime, replace: bool = True) -> None:
+        """Fold the current report into the stored history.
+
+        With `replace=False` (backfilled weeks), weeks that already have a
+        value are left as they are.
+        """
+        this_week = week_key(now)
+        this_month = month_key(now)
+
+        for category, entities in aggregates.items():
+            for entity_id, value in entities.items():
+                current = report_value(category, value)
+                if current is None:
+                    continue
+                record = self.data["entities"].setdefault(f"{category}|{entity_id}", {"weeks": {}, "months": {}})
+                if not replace and (
+                    this_week in record["weeks"] or this_week in record["months"].get(this_month, {})
+                ):
+                    continue
+
+                # Re-running within the same week replaces that week's value
+                record["weeks"][this_week] = round(current, 3)
+                for key in sorted(record["weeks"])[:-(ROLLING_WEEKS + 1)]:
+                    del record["weeks"][key]
+
+                record["months"].setdefault(this_month, {})[this_week] = round(current, 3)
+                for key in sorted(record["months"])[:-MONTHS_KEPT]:
+                    del record["months"][key]
@@ -0,0 +1,211 @@
+"""Batch submission of report prompts for fleets of HA Genie entries.
+
+Due coordinators enqueue their prompt instead of calling the LLM directly.
+After a short collection window the queue is submitted as one batch job per
+backend and model, which is polled until it finishes. Results are then fanned
+back out to the coordinators. Queue, jobs and undelivered results are kept in
+`.storage`, so a restart resumes polling instead of losing reports.
+"""
+import asyncio
+import logging
+from dataclasses import asdict
+from datetime import timedelta
+
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_BATCH_MANAGER = f"{DOMAIN}_batch_manager"
+STORAGE_VERSION = 1
+
+# Wait for other entries that are due at about the same time (see schedule jitter)
+BATCH_COLLECT_DELAY = timedelta(minutes=15)
+BATCH_POLL_INTERVAL = timedelta(minutes=10)
+
+
+class BatchManager:
+    """Shared queue of pending prompts and the batch jobs submitted for them."""
+
+    def __init__(self, hass):
+        """Initialize."""
+        self.hass = hass
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.batch")
+        # queue: entry_id -> {model, prompt, queued_at}
+        # jobs: job name -> {model, entries, prompts, submitted_at}
+        # results: entry_id -> {text, usage, error, job}
+        self._state = {"queue": {}, "jobs": {}, "results": {}}
+        self._coordinators = {}
+        self._lock = asyncio.Lock()
+        self._unsub_flush = None
+        self._unsub_poll = None
+        self._load_task = None
+
+    async def async_load(self):
+        """Restore the queue, running jobs and undelivered results (once)."""
+        if self._load_task is None:
+            self._load_task = self.hass.async_create_task(self._async_load())
+        await self._load_task
+
+    async def _async_load(self):
+        stored = await self._store.async_load()
+        if stored:
+            self._state.update(stored)
+        _LOGGER.debug(
+            "Batch state restored: %s queued, %s jobs, %s results",
+            len(self._state["queue"]), len(self._state["jobs"]), len(self._state["results"])
+        )
+
+    def _save(self):
+        self._store.async_delay_save(lambda: self._state, 1)
+
+    def async_register(self, entry_id, coordinator):
+        """Register a coordinator to receive results. Returns an unregister callback."""
+        self._coordinators[entry_id] = coordinator
+        self._deliver()
+        self._schedule()
+
+        def _unregister():
+            self._coordinators.pop(entry_id, None)
+            if not self._coordinators:
+                self._cancel_timers()
+
+        return _unregister
+
+    async def async_enqueue(self, entry_id, model, prompt):
+        """Queue a prompt for the next batch, replacing any older one for the entry."""
+        async with self._lock:
+            self._state["queue"][entry_id] = {
+                "model": model,
+                "prompt": prompt,
+                "queued_at": dt_util.utcnow().isoformat(),
+            }
+            self._save()
+        self._schedule()
+
+    def _schedule(self):
+        if not self._coordinators:
+            return
+        if self._state["queue"] and self._unsub_flush is None:
+            self._unsub_flush = async_call_later(self.hass, BATCH_COLLECT_DELAY, self._async_flush)
+        if self._state["jobs"] and self._unsub_poll is None:
+            self._unsub_poll = async_call_later(self.hass, BATCH_POLL_INTERVAL, self._async_poll)
+
+    def _cancel_timers(self):
+        for unsub in (self._unsub_flush, self._unsub_poll):
+            if unsub:
+                unsub()
+        self._unsub_flush = None
+        self._unsub_poll = None
+
+    @staticmethod
+    def _group_key(coordinator, model):
+        # Entries can only share a job if they use the same backend and credentials
+        backend = coordinator.backend
+        return (backend.name, coordinator.api_key, getattr(backend, "url", None), model)
+
+    async def _async_flush(self, _now):
+        """Submit the queue as one batch job per backend and model."""
+        self._unsub_flush = None
+        async with self._lock:
+            groups = {}
+            for entry_id, item in self._state["queue"].items():
+                coordinator = self._coordinators.get(entry_id)
+                if coordinator is None:
+                    # Submitted once the entry is set up again
+                    continue
+                groups.setdefault(self._group_key(coordinator, item["model"]), []).append(entry_id)
+
+            for entry_ids in groups.values():
+                coordinator = self._coordinators[entry_ids[0]]
+                model = self._state["queue"][entry_ids[0]]["model"]
+                prompts = [self._state["queue"][entry_id]["prompt"] for entry_id in entry_ids]
+                try:
+                    name = await coordinator.backend.async_submit_batch(model, prompts)
+                except Exception as e:
+                    _LOGGER.warning("Could not submit batch of %s reports, retrying later: %s", len(entry_ids), e)
+                    continue
+                _LOGGER.info("Submitted batch job %s with %s reports", name, len(entry_ids))
+                self._state["jobs"][name] = {
+                    "model": model,
+                    "entries": entry_ids,
+                    "prompts": prompts,
+                    "submitted_at": dt_util.utcnow().isoformat(),
+                }
+                for entry_id in entry_ids:
+                    del self._state["queue"][entry_id]
+            self._save()
+        self._schedule()
+
+    async def _async_poll(self, _now):
+        """Poll running jobs and fan out finished results."""
+        self._unsub_poll = None
+        async with self._lock:
+            for name, job in list(self._state["jobs"].items()):
+                coordinator = next(
+                    (self._coordinators[e] for e in job["entries"] if e in self._coordinators), None
+                )
+                if coordinator is None:
+                    continue
+                try:
+                    responses = await coordinator.backend.async_get_batch(name)
+                except KeyError:
+                    # Local stand-in jobs are lost on restart: queue the prompts again
+                    _LOGGER.info("Batch job %s is unknown to the backend, resubmitting", name)
+                    for entry_id, prompt in zip(job["entries"], job["prompts"]):
+                        self._state["queue"].setdefault(entry_id, {
+                            "model": job["model"],
+                            "prompt": prompt,
+                            "queued_at": job["submitted_at"],
+                        })
+                    del self._state["jobs"][name]
+                    continue
+                except RuntimeError as e:
+                    responses = [None] * len(job["entries"])
+                    error = str(e)
+                except Exception as e:
+                    _LOGGER.debug("Polling batch job %s failed, retrying later: %s", name, e)
+                    continue
+                else:
+                    error = None
+                if responses is None:
+                    continue
+
+                _LOGGER.info("Batch job %s finished", name)
+                for entry_id, response in zip(job["entries"], responses):
+                    self._state["results"][entry_id] = {
+                        "job": name,
+                        "model": job["model"],
+                        "submitted_at": job["submitted_at"],
+                        "text": response.text if response else "",
+                        "usage": asdict(response.usage) if response and response.usage else None,
+                        "error": response.error if response else error,
+                    }
+                del self._state["jobs"][name]
+            self._save()
+        self._deliver()
+        self._schedule()
+
+    def _deliver(self):
+        """Hand finished results to their registered coordinators."""
+        delivered = False
+        for entry_id in list(self._state["results"]):
+            coordinator = self._coordinators.get(entry_id)
+            if coordinator is None:
+                continue
+            coordinator.async_apply_batch_result(self._state["results"].pop(entry_id))
+            delivered = True
+        if delivered:
+            self._save()
+
+
+async def async_get_batch_manager(hass) -> BatchManager:
+    """Return the shared batch manager, loading its state on first use."""
+    if (manager := hass.data.get(DATA_BATCH_MANAGER)) is None:
+        manager = hass.data[DATA_BATCH_MANAGER] = BatchManager(hass)
+    # Entries set up concurrently wait for the same load
+    await manager.async_load()
+    return manager
@@ -11,6 +11,8 @@ import homeassistant.helpers.config_validation as cv
 
 from .const import (
     DOMAIN,
+    CONF_AUTO_DISCOVER,
+    DEFAULT_AUTO_DISCOVER,
     CONF_GEMINI_API_KEY,
     CONF_HOUSE_BEDROOMS,
     CONF_HOUSE_SIZE,
@@ -41,10 +43,109 @@ from .const import (
     DATA_AVERAGING_DAILY,
     DATA_AVERAGING_WEEKLY,
     DEFAULT_DATA_AVERAGING,
+    CONF_THRESHOLD_HUMIDITY,
+    CONF_THRESHOLD_CO2,
+    CONF_THRESHOLD_RADON,
+    CONF_THRESHOLD_VOC,
+    CONF_THRESHOLD_TEMP_LOW,
+    DEFAULT_THRESHOLD_HUMIDITY,
+    DEFAULT_THRESHOLD_CO2,
+    DEFAULT_THRESHOLD_RADON,
+    DEFAULT_THRESHOLD_VOC,
+    DEFAULT_THRESHOLD_TEMP_LOW,
+    CONF_LOCAL_INTERIM_RESULTS,
+    DEFAULT_LOCAL_INTERIM_RESULTS,
+    CONF_ARCHIVE_ENABLED,
+    CONF_ARCHIVE_RETENTION_DAYS,
+    CONF_ARCHIVE_COMPACT_AFTER_DAYS,
+    DEFAULT_ARCHIVE_ENABLED,
+    DEFAULT_ARCHIVE_RETENTION_DAYS,
+    DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS,
+    CONF_MODEL_ROUTING,
+    DEFAULT_MODEL_ROUTING,
+    CONF_GEMINI_ESCALATION_MODEL,
+    DEFAULT_GEMINI_ESCALATION_MODEL,
+    CONF_ESCALATION_DEVIATION_PCT,
+    DEFAULT_ESCALATION_DEVIATION_PCT,
+    CONF_SPLIT_DOMAINS,
+    DEFAULT_SPLIT_DOMAINS,
+    CONF_MAX_CONCURRENCY,
+    DEFAULT_MAX_CONCURRENCY,
+    CONF_STREAMING,
+    DEFAULT_STREAMING,
+    CONF_SCHEDULE_TIME,
+    CONF_SCHEDULE_WEEKDAY,
+    CONF_SCHEDULE_JITTER_MINUTES,
+    DEFAULT_SCHEDULE_TIME,
+    DEFAULT_SCHEDULE_WEEKDAY,
+    DEFAULT_SCHEDULE_JITTER_MINUTES,
+    WEEKDAYS,
+    CONF_LLM_BACKEND,
+    CONF_LLM_BASE_URL,
+    DEFAULT_LLM_BACKEND,
+    DEFAULT_LLM_BASE_URL,
+    CONF_MAX_PROMPT_TOKENS,
+    DEFAULT_MAX_PROMPT_TOKENS,
+    CONF_DISTRIBUTION_STATS,
+    DEFAULT_DISTRIBUTION_STATS,
+    CONF_BATCH_MODE,
+    DEFAULT_BATCH_MODE,
+    CONF_WATCHDOG,
+    DEFAULT_WATCHDOG,
+    CONF_WATCHDOG_OPEN_MINUTES,
+    DEFAULT_WATCHDOG_OPEN_MINUTES,
+    LLM_BACKEND_GEMINI,
+    LLM_BACKEND_OPENAI_COMPATIBLE,
 )
+from .discovery import async_get_entity_index
 
 _LOGGER = logging.getLogger(__name__)
 
+
+def entity_selectors(defaults: Optional[Dict[str, Any]] = None) -> Dict[Any, Any]:
+    """Return the entity selector fields, optionally pre-filled.
+
+    Proposals are suggested values rather than defaults, so a list the user
+    clears stays empty instead of being filled in again on submit.
+    """
+    defaults = defaults or {}
+
+    def _optional(key):
+        if key in defaults:
+            return vol.Optional(key, description={"suggested_value": defaults[key]})
+        return vol.Optional(key)
+
+    return {
+        _optional(CONF_ENTITIES_TEMP): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="sensor", multiple=True)
+        ),
+        _optional(CONF_ENTITIES_HUMIDITY): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="sensor", device_class="humidity", multiple=True)
+        ),
+        _optional(CONF_ENTITIES_RADON): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="sensor", multiple=True)
+        ),
+        _optional(CONF_ENTITIES_CO2): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="sensor", device_class="carbon_dioxide", multiple=True)
+        ),
+        _optional(CONF_ENTITIES_VOC): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain=["sensor", "binary_sensor", "climate", "air_quality", "utility_meter"], multiple=True)
+        ),
+        _optional(CONF_ENTITIES_CONTACT): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="binary_sensor", device_class=["door", "window"], multiple=True)
+        ),
+        _optional(CONF_ENTITIES_VALVES): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="climate", multiple=True)
+        ),
+        _optional(CONF_ENTITIES_ENERGY): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain="sensor", device_class="energy", multiple=True)
+        ),
+        _optional(CONF_ENTITIES_GAS): selector.EntitySelector(
+            selector.EntitySelectorConfig(domain=["sensor", "binary_sensor", "climate", "air_quality", "utility_meter"], multiple=True)
+        ),
+    }
+
+
 class HAGenieConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for HA Genie."""
 
@@ -60,6 +161,9 @@ class HAGenieConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 errors["base"] = "missing_api_key"
             else:
                 _LOGGER.debug("Config flow user input: %s", user_input)
+                if user_input.pop(CONF_AUTO_DISCOVER, False):
+                    self._user_input = user_input
+                    return await self.async_step_entities()
                 return self.async_create_entry(title="HA Genie", data=user_input)
 
         # Schema for user input
@@ -88,40 +192,36 @@ class HAGenieConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 )
             ),
             
+            # Propose matching entities in a review step
+            vol.Optional(CONF_AUTO_DISCOVER, default=DEFAULT_AUTO_DISCOVER): bool,
+            
             # Entity Selectors
-            vol.Optional(CONF_ENTITIES_TEMP): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="sensor", multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_HUMIDITY): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="sensor", device_class="humidity", multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_RADON): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="sensor", multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_CO2): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="sensor", device_class="carbon_dioxide", multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_VOC): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain=["sensor", "binary_sensor", "climate", "air_quality", "utility_meter"], multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_CONTACT): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="binary_sensor", device_class=["door", "window"], multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_VALVES): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="climate", multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_ENERGY): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain="sensor", device_class="energy", multiple=True)
-            ),
-            vol.Optional(CONF_ENTITIES_GAS): selector.EntitySelector(
-                selector.EntitySelectorConfig(domain=["sensor", "binary_sensor", "climate", "air_quality", "utility_meter"], multiple=True)
-            ),
+            **entity_selectors(),
         })
 
         return self.async_show_form(
             step_id="user", data_schema=data_schema, errors=errors
         )
 
+    async def async_step_entities(self, user_input: Optional[Dict[str, Any]] = None):
+        """Review the auto-discovered entities."""
+        if user_input is not None:
+            # A list the user cleared is missing from user_input, so it must not fall back to the first step
+            cleared = {marker.schema: [] for marker in entity_selectors()}
+            return self.async_create_entry(title="HA Genie", data={**self._user_input, **cleared, **user_input})
+        
+        # Keep anything picked by hand and add every matching entity from the index
+        proposals = async_get_entity_index(self.hass).propose()
+        defaults = {
+            key: sorted(set(self._user_input.get(key) or []) | set(entity_ids))
+            for key, entity_ids in proposals.items()
+        }
+        return self.async_show_form(
+            step_id="entities",
+            data_schema=vol.Schema(entity_selectors(defaults)),
+            description_placeholders={"count": str(sum(len(v) for v in defaults.values()))}
+        )
+
     @staticmethod
     @callback
     def async_get_options_flow(config_entry):
@@ -145,10 +245,14 @@ class HAGenieOptionsFlowHandler(config_entries.OptionsFlow):
         """Manage the options."""
         if user_input is not None:
              _LOGGER.debug("Options flow user input: %s", user_input)
+             # Apply model, entity, house and threshold changes in place (no history query or LLM rerun)
+             coordinator = self.hass.data.get(DOMAIN, {}).get(self.config_entry.entry_id)
+             applied = coordinator is not None and await coordinator.async_apply_options(user_input)
              # Update the main config entry with the new data
              self.hass.config_entries.async_update_entry(self.config_entry, data=user_input)
-             # Reload the integration to pick up changes immediately
-             await self.hass.config_entries.async_reload(self.config_entry.entry_id)
+             if not applied:
+                 # Reload the integration to pick up changes immediately
+                 await self.hass.config_entries.async_reload(self.config_entry.entry_id)
              return self.async_create_entry(title="", data={})
 
         # Allow updating the configuration
@@ -210,6 +314,57 @@ class HAGenieOptionsFlowHandler(config_entries.OptionsFlow):
             vol.Optional(CONF_ENTITIES_GAS, default=get_default(CONF_ENTITIES_GAS, [])): selector.EntitySelector(
                 selector.EntitySelectorConfig(domain=["sensor", "binary_sensor", "climate", "air_quality", "utility_meter"], multiple=True)
             ),
+            
+            # Local rule-based analysis (used as fallback when Gemini fails)
+            vol.Optional(CONF_THRESHOLD_HUMIDITY, default=get_default(CONF_THRESHOLD_HUMIDITY, DEFAULT_THRESHOLD_HUMIDITY)): int,
+            vol.Optional(CONF_THRESHOLD_CO2, default=get_default(CONF_THRESHOLD_CO2, DEFAULT_THRESHOLD_CO2)): int,
+            vol.Optional(CONF_THRESHOLD_RADON, default=get_default(CONF_THRESHOLD_RADON, DEFAULT_THRESHOLD_RADON)): int,
+            vol.Optional(CONF_THRESHOLD_VOC, default=get_default(CONF_THRESHOLD_VOC, DEFAULT_THRESHOLD_VOC)): int,
+            vol.Optional(CONF_THRESHOLD_TEMP_LOW, default=get_default(CONF_THRESHOLD_TEMP_LOW, DEFAULT_THRESHOLD_TEMP_LOW)): int,
+            vol.Optional(CONF_DISTRIBUTION_STATS, default=get_default(CONF_DISTRIBUTION_STATS, DEFAULT_DISTRIBUTION_STATS)): bool,
+            vol.Optional(CONF_LOCAL_INTERIM_RESULTS, default=get_default(CONF_LOCAL_INTERIM_RESULTS, DEFAULT_LOCAL_INTERIM_RESULTS)): bool,
+            # Alert on threshold breaches and open windows while heating, between reports
+            vol.Optional(CONF_WATCHDOG, default=get_default(CONF_WATCHDOG, DEFAULT_WATCHDOG)): bool,
+            vol.Optional(CONF_WATCHDOG_OPEN_MINUTES, default=get_default(CONF_WATCHDOG_OPEN_MINUTES, DEFAULT_WATCHDOG_OPEN_MINUTES)): vol.All(int, vol.Range(min=1, max=240)),
+            
+            # Aggregate archive for week-over-week / year-over-year comparisons
+            vol.Optional(CONF_ARCHIVE_ENABLED, default=get_default(CONF_ARCHIVE_ENABLED, DEFAULT_ARCHIVE_ENABLED)): bool,
+            vol.Optional(CONF_ARCHIVE_RETENTION_DAYS, default=get_default(CONF_ARCHIVE_RETENTION_DAYS, DEFAULT_ARCHIVE_RETENTION_DAYS)): int,
+            vol.Optional(CONF_ARCHIVE_COMPACT_AFTER_DAYS, default=get_default(CONF_ARCHIVE_COMPACT_AFTER_DAYS, DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS)): int,
+            
+            # Tiered routing: run the configured model first, escalate only when needed
+            vol.Optional(CONF_MODEL_ROUTING, default=get_default(CONF_MODEL_ROUTING, DEFAULT_MODEL_ROUTING)): bool,
+            vol.Optional(CONF_GEMINI_ESCALATION_MODEL, default=get_default(CONF_GEMINI_ESCALATION_MODEL, DEFAULT_GEMINI_ESCALATION_MODEL)): cv.string,
+            vol.Optional(CONF_ESCALATION_DEVIATION_PCT, default=get_default(CONF_ESCALATION_DEVIATION_PCT, DEFAULT_ESCALATION_DEVIATION_PCT)): int,
+            
+            # Split the analysis into concurrent per-domain calls
+            vol.Optional(CONF_SPLIT_DOMAINS, default=get_default(CONF_SPLIT_DOMAINS, DEFAULT_SPLIT_DOMAINS)): bool,
+            vol.Optional(CONF_MAX_CONCURRENCY, default=get_default(CONF_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)): vol.All(int, vol.Range(min=1, max=3)),
+            vol.Optional(CONF_STREAMING, default=get_default(CONF_STREAMING, DEFAULT_STREAMING)): bool,
+            # Queue reports and submit them as one (cheaper, slower) batch job with other entries
+            vol.Optional(CONF_BATCH_MODE, default=get_default(CONF_BATCH_MODE, DEFAULT_BATCH_MODE)): bool,
+            
+            # Aligned scheduling: local time (HH:MM, empty = every 24h/7d from startup)
+            vol.Optional(CONF_SCHEDULE_TIME, default=get_default(CONF_SCHEDULE_TIME, DEFAULT_SCHEDULE_TIME)): cv.string,
+            vol.Optional(CONF_SCHEDULE_WEEKDAY, default=get_default(CONF_SCHEDULE_WEEKDAY, DEFAULT_SCHEDULE_WEEKDAY)): selector.SelectSelector(
+                selector.SelectSelectorConfig(
+                    options=WEEKDAYS,
+                    mode=selector.SelectSelectorMode.DROPDOWN
+                )
+            ),
+            vol.Optional(CONF_SCHEDULE_JITTER_MINUTES, default=get_default(CONF_SCHEDULE_JITTER_MINUTES, DEFAULT_SCHEDULE_JITTER_MINUTES)): int,
+            
+            # LLM backend: Gemini SDK or an OpenAI-compatible HTTP endpoint (model names above apply)
+            vol.Optional(CONF_LLM_BACKEND, default=get_default(CONF_LLM_BACKEND, DEFAULT_LLM_BACKEND)): selector.SelectSelector(
+                selector.SelectSelectorConfig(
+                    options=[LLM_BACKEND_GEMINI, LLM_BACKEND_OPENAI_COMPATIBLE],
+                    mode=selector.SelectSelectorMode.DROPDOWN
+                )
+            ),
+            vol.Optional(CONF_LLM_BASE_URL, default=get_default(CONF_LLM_BASE_URL, DEFAULT_LLM_BASE_URL)): cv.string,
+            
+            # Prompt size guardrail (0 = no limit)
+            vol.Optional(CONF_MAX_PROMPT_TOKENS, default=get_default(CONF_MAX_PROMPT_TOKENS, DEFAULT_MAX_PROMPT_TOKENS)): vol.All(int, vol.Range(min=0)),
         })
 
         return self.async_show_form(
@@ -36,3 +36,86 @@ DATA_AVERAGING_HOURLY = "Hourly"
 DATA_AVERAGING_DAILY = "Daily"
 DATA_AVERAGING_WEEKLY = "Weekly"
 DEFAULT_DATA_AVERAGING = DATA_AVERAGING_WEEKLY
+
+# Aggregate categories whose values are totals rather than averages
+SUMMED_CATEGORIES = ("electricity_usage_kwh", "gas_usage_kwh", "contact_openings_count")
+
+# Local rule-based analysis thresholds
+CONF_THRESHOLD_HUMIDITY = "threshold_humidity"
+CONF_THRESHOLD_CO2 = "threshold_co2"
+CONF_THRESHOLD_RADON = "threshold_radon"
+CONF_THRESHOLD_VOC = "threshold_voc"
+CONF_THRESHOLD_TEMP_LOW = "threshold_temp_low"
+DEFAULT_THRESHOLD_HUMIDITY = 65 # % RH, above this mould risk rises
+DEFAULT_THRESHOLD_CO2 = 1400 # ppm, poor ventilation
+DEFAULT_THRESHOLD_RADON = 100 # Bq/m3, WHO reference level
+DEFAULT_THRESHOLD_VOC = 500 # ppb
+DEFAULT_THRESHOLD_TEMP_LOW = 18 # C, WHO minimum for healthy homes
+
+CONF_LOCAL_INTERIM_RESULTS = "local_interim_results"
+DEFAULT_LOCAL_INTERIM_RESULTS = False
+
+# Longitudinal aggregate archive
+CONF_ARCHIVE_ENABLED = "archive_enabled"
+CONF_ARCHIVE_RETENTION_DAYS = "archive_retention_days"
+CONF_ARCHIVE_COMPACT_AFTER_DAYS = "archive_compact_after_days"
+DEFAULT_ARCHIVE_ENABLED = True
+DEFAULT_ARCHIVE_RETENTION_DAYS = 800 # Enough for year-over-year comparisons
+DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS = 90
+
+# Tiered model routing
+CONF_MODEL_ROUTING = "model_routing"
+CONF_GEMINI_ESCALATION_MODEL = "gemini_escalation_model"
+CONF_ESCALATION_DEVIATION_PCT = "escalation_deviation_pct"
+DEFAULT_MODEL_ROUTING = False
+DEFAULT_GEMINI_ESCALATION_MODEL = "gemini-3-pro"
+DEFAULT_ESCALATION_DEVIATION_PCT = 50
+
+# Split analysis into concurrent per-domain LLM calls
+CONF_SPLIT_DOMAINS = "split_domains"
+CONF_MAX_CONCURRENCY = "max_concurrency"
+DEFAULT_SPLIT_DOMAINS = False
+DEFAULT_MAX_CONCURRENCY = 3
+
+# Stream Gemini responses and update sensors field by field
+CONF_STREAMING = "streaming"
+DEFAULT_STREAMING = False
+
+# Aligned report scheduling (empty time keeps the plain update interval)
+CONF_SCHEDULE_TIME = "schedule_time"
+CONF_SCHEDULE_WEEKDAY = "schedule_weekday"
+CONF_SCHEDULE_JITTER_MINUTES = "schedule_jitter_minutes"
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DEFAULT_SCHEDULE_TIME = ""
+DEFAULT_SCHEDULE_WEEKDAY = "Monday"
+DEFAULT_SCHEDULE_JITTER_MINUTES = 15
+
+# LLM backend
+CONF_LLM_BACKEND = "llm_backend"
+CONF_LLM_BASE_URL = "llm_base_url"
+LLM_BACKEND_GEMINI = "gemini"
+LLM_BACKEND_OPENAI_COMPATIBLE = "openai_compatible"
+DEFAULT_LLM_BACKEND = LLM_BACKEND_GEMINI
+DEFAULT_LLM_BASE_URL = "http://localhost:8080/v1"
+
+# Prompt size guardrail: coarsen the noisiest categories above this many tokens (0 = off)
+CONF_MAX_PROMPT_TOKENS = "max_prompt_tokens"
+DEFAULT_MAX_PROMPT_TOKENS = 30000
+
+# Propose matching entities from the entity registry during setup
+CONF_AUTO_DISCOVER = "auto_discover"
+DEFAULT_AUTO_DISCOVER = False
+
+# Per-bin min/max/p50/p95 and hours past the health thresholds
+CONF_DISTRIBUTION_STATS = "distribution_stats"
+DEFAULT_DISTRIBUTION_STATS = False
+
+# Submit reports of all entries as one batch job instead of one call each
+CONF_BATCH_MODE = "batch_mode"
+DEFAULT_BATCH_MODE = False
+
+# Real-time watchdog: alert on sustained threshold breaches between reports
+CONF_WATCHDOG = "watchdog"
+CONF_WATCHDOG_OPEN_MINUTES = "watchdog_open_minutes"
+DEFAULT_WATCHDOG = False
+DEFAULT_WATCHDOG_OPEN_MINUTES = 10 # Door/window open while heating
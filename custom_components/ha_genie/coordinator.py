@@ -2,14 +2,15 @@
 import logging
 import json
 import asyncio
+import time
+from dataclasses import asdict
 from datetime import datetime, timedelta
 
-import google.genai as genai
-from google.genai import types
-
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 from homeassistant.util import dt as dt_util
 from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers.event import async_track_point_in_time
+from homeassistant.helpers.storage import Store
 
 from .const import (
     DOMAIN, 
@@ -32,18 +33,74 @@ from .const import (
     DATA_AVERAGING_HOURLY,
     DATA_AVERAGING_DAILY,
     DATA_AVERAGING_WEEKLY,
-    DEFAULT_DATA_AVERAGING
+    DEFAULT_DATA_AVERAGING,
+    CONF_LOCAL_INTERIM_RESULTS,
+    DEFAULT_LOCAL_INTERIM_RESULTS,
+    CONF_ARCHIVE_ENABLED,
+    CONF_ARCHIVE_RETENTION_DAYS,
+    CONF_ARCHIVE_COMPACT_AFTER_DAYS,
+    DEFAULT_ARCHIVE_ENABLED,
+    DEFAULT_ARCHIVE_RETENTION_DAYS,
+    DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS,
+    CONF_MODEL_ROUTING,
+    DEFAULT_MODEL_ROUTING,
+    CONF_GEMINI_ESCALATION_MODEL,
+    DEFAULT_GEMINI_ESCALATION_MODEL,
+    CONF_ESCALATION_DEVIATION_PCT,
+    DEFAULT_ESCALATION_DEVIATION_PCT,
+    CONF_SPLIT_DOMAINS,
+    DEFAULT_SPLIT_DOMAINS,
+    CONF_MAX_CONCURRENCY,
+    DEFAULT_MAX_CONCURRENCY,
+    CONF_STREAMING,
+    DEFAULT_STREAMING,
+    CONF_SCHEDULE_TIME,
+    CONF_SCHEDULE_WEEKDAY,
+    CONF_SCHEDULE_JITTER_MINUTES,
+    DEFAULT_SCHEDULE_TIME,
+    DEFAULT_SCHEDULE_WEEKDAY,
+    DEFAULT_SCHEDULE_JITTER_MINUTES,
+    CONF_MAX_PROMPT_TOKENS,
+    DEFAULT_MAX_PROMPT_TOKENS,
+    CONF_BATCH_MODE,
+    DEFAULT_BATCH_MODE,
+)
+from .analyzer import (
+    ANALYSIS_DOMAINS,
+    STATUS_NEEDS_ATTENTION,
+    analyze_locally,
+    get_thresholds,
+    merge_analyses,
+    validate_analysis,
 )
-from .data import aggregate_data, get_history_data
+from .archive import ARCHIVE_DIR, AggregateArchive
+from .backends import LLMUsage, create_backend
+from .replay import CAPTURE_DIR, RecordingBackend, build_capture, write_capture
+from .baselines import STORAGE_VERSION as BASELINES_STORAGE_VERSION, BaselineTracker, archive_baselines
+from .scheduler import (
+    BUSY_RETRY_DELAY,
+    MAX_POSTPONEMENTS,
+    entry_jitter,
+    next_run,
+    previous_run,
+    recorder_busy,
+)
+from .streaming import StreamingJSONParser
+from .tokens import estimate_tokens, needs_exact_count, next_degradation
+from .data import ENTITY_CATEGORIES, AggregationGraph, aggregate_data, build_house_details, build_raw_sample_debug, get_history_data, history_start
+from .options import CHANGE_ENTITIES, CHANGE_HOUSE, CHANGE_NEXT_CALL, CHANGE_RELOAD, CHANGE_THRESHOLDS, classify_changes
 
 _LOGGER = logging.getLogger(__name__)
 
+# Analysis fields pushed to the sensors as soon as they are streamed
+PROGRESSIVE_FIELDS = ("status", "good_points", "bad_points", "suggestions")
+
 SCAN_INTERVAL = timedelta(hours=24)
 
 class HAGenieCoordinator(DataUpdateCoordinator):
     """Coordinator to manage fetching data from history and Gemini."""
 
-    def __init__(self, hass, config, api_key):
+    def __init__(self, hass, config, api_key, entry_id=None):
         """Initialize."""
         # Determine update interval
         frequency = config.get(CONF_UPDATE_FREQUENCY, DEFAULT_UPDATE_FREQUENCY)
@@ -52,6 +109,12 @@ class HAGenieCoordinator(DataUpdateCoordinator):
         else:
             # Default to Weekly
             interval = timedelta(days=7)
+        
+        # Aligned scheduling replaces the interval counted from startup
+        schedule_time = config.get(CONF_SCHEDULE_TIME, DEFAULT_SCHEDULE_TIME)
+        self.schedule_time = dt_util.parse_time(schedule_time) if schedule_time else None
+        if self.schedule_time is not None:
+            interval = None
             
         super().__init__(
             hass,
@@ -61,12 +124,119 @@ class HAGenieCoordinator(DataUpdateCoordinator):
         )
         self.config = config
         self.api_key = api_key
+        self.entry_id = entry_id
+        
+        # Gemini SDK or a generic OpenAI-compatible HTTP endpoint
+        self.backend = create_backend(hass, config, api_key)
+        
+        self.archive = None
+        # Without a config directory (e.g. a stand-in hass) there is nowhere to keep it
+        if config.get(CONF_ARCHIVE_ENABLED, DEFAULT_ARCHIVE_ENABLED) and isinstance(hass.config.config_dir, str):
+            self.archive = AggregateArchive(
+                hass.config.path(ARCHIVE_DIR, entry_id or "default"),
+                config.get(CONF_ARCHIVE_RETENTION_DAYS, DEFAULT_ARCHIVE_RETENTION_DAYS),
+                config.get(CONF_ARCHIVE_COMPACT_AFTER_DAYS, DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS),
+            )
+        
+        # Latency and token usage of the LLM calls made by the last refresh
+        self.llm_calls = []
+        # Pre-send prompt size of the last refresh and any granularity degradations
+        self.token_budget = {}
+        # Wall time in ms per pipeline stage of the last refresh
+        self.stage_timings = {}
+        # History of the last refresh, reused when entity options change
+        self._history = {}
+        # Memoized per-category aggregates, recomputed only when their inputs change
+        self._aggregation = AggregationGraph()
+        # Shared BatchManager, set up by __init__.py when batch mode is enabled
+        self.batch = None
+        # Real-time Watchdog, set up by __init__.py when enabled
+        self.watchdog = None
+        
+        self._baselines_store = Store(hass, BASELINES_STORAGE_VERSION, f"{DOMAIN}.{entry_id or 'default'}.baselines")
+        self.baselines = None
+        
+        # Last report, restored at startup in scheduled mode instead of re-running it
+        self._report_store = Store(hass, 1, f"{DOMAIN}.{entry_id or 'default'}.report")
+        self._unsub_schedule = None
+        self._postponements = 0
+
+    @property
+    def scheduled(self):
+        """Return True if reports run at an aligned local time."""
+        return self.schedule_time is not None
+
+    @property
+    def jitter(self):
+        """Return this entry's offset from the aligned schedule time."""
+        return entry_jitter(self.entry_id, self.config.get(CONF_SCHEDULE_JITTER_MINUTES, DEFAULT_SCHEDULE_JITTER_MINUTES))
+
+    def _schedule_args(self):
+        return (
+            self.config.get(CONF_UPDATE_FREQUENCY, DEFAULT_UPDATE_FREQUENCY),
+            self.schedule_time,
+            self.config.get(CONF_SCHEDULE_WEEKDAY, DEFAULT_SCHEDULE_WEEKDAY),
+            self.jitter,
+        )
+
+    async def async_restore_report(self):
+        """Restore the last stored report. Returns True if one was found."""
+        stored = await self._report_store.async_load()
+        if not stored:
+            return False
+        self.async_set_updated_data(stored)
+        return True
+
+    def missed_run(self):
+        """Return True if the last scheduled run is newer than the report, e.g. HA was down then."""
+        generated_at = (self.data or {}).get("generated_at")
+        if generated_at is None:
+            # Reports stored before generated_at was recorded have an unknown age
+            return True
+        return datetime.fromisoformat(generated_at) < previous_run(dt_util.now(), *self._schedule_args())
+
+    def async_schedule_next_run(self, delay=None):
+        """Schedule the next aligned report run (or a postponed or catch-up run after `delay`)."""
+        self.async_cancel_schedule()
+        now = dt_util.now()
+        if delay is not None:
+            when = now + delay
+        else:
+            when = next_run(now, *self._schedule_args())
+        _LOGGER.debug("Next HA Genie report scheduled for %s", when)
+        self._unsub_schedule = async_track_point_in_time(self.hass, self._async_scheduled_run, when)
+
+    def async_cancel_schedule(self):
+        """Cancel the pending scheduled run."""
+        if self._unsub_schedule:
+            self._unsub_schedule()
+            self._unsub_schedule = None
+
+    async def _async_scheduled_run(self, _now):
+        """Run a scheduled report unless the recorder is busy."""
+        self._unsub_schedule = None
+        reason = recorder_busy(self.hass)
+        if reason and self._postponements < MAX_POSTPONEMENTS:
+            self._postponements += 1
+            _LOGGER.info("Postponing HA Genie report: %s", reason)
+            self.async_schedule_next_run(delay=BUSY_RETRY_DELAY)
+            return
         
-        # Configure the SDK (New Syntax)
-        self.client = genai.Client(api_key=self.api_key)
+        self._postponements = 0
+        await self.async_refresh()
+        self.async_schedule_next_run()
 
     async def _async_update_data(self):
         """Fetch data and call Gemini."""
+        # Wall time per pipeline stage, compared across engines by scripts/replay_refresh.py
+        timings = {}
+        lap_started = time.monotonic()
+        
+        def _lap(stage):
+            nonlocal lap_started
+            now = time.monotonic()
+            timings[stage] = round(timings.get(stage, 0) + (now - lap_started) * 1000, 1)
+            lap_started = now
         
         all_entities = []
         for key in [
@@ -89,46 +259,354 @@ class HAGenieCoordinator(DataUpdateCoordinator):
         _LOGGER.info("Sensor data averaging set to %s. Fetching 7 days history.", averaging_inv)
         
         # Always fetch 7 days of history, but bin it differently
-        history_window = timedelta(days=7)
-        history_data = await get_history_data(self.hass, all_entities, duration=history_window)
-        aggregated_data = aggregate_data(self.hass, self.config, history_data, averaging_period=averaging_inv)
+        now = dt_util.utcnow()
+        window_start = history_start(now, averaging_inv)
+        history_data = await get_history_data(self.hass, all_entities, duration=now - window_start)
+        self._history = history_data
+        _lap("history")
+        payload_data = aggregate_data(self.hass, self.config, history_data, averaging_period=averaging_inv, graph=self._aggregation)
+        _lap("aggregate")
+        _LOGGER.debug("Recomputed aggregate categories: %s", self._aggregation.recomputed)
+        
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Raw sample debug: %s", build_raw_sample_debug(history_data))
+        
+        if self.archive is not None:
+            await self.hass.async_add_executor_job(
+                self._archive_aggregates, averaging_inv, window_start, payload_data["sensor_aggregates"]
+            )
+            _lap("archive")
+        
+        # Compare against our own history instead of LLM-estimated seasonal benchmarks
+        if self.baselines is None:
+            self.baselines = BaselineTracker(await self._baselines_store.async_load())
+        now_local = dt_util.now()
+        baselines = self.baselines.compute(payload_data["sensor_aggregates"], now_local)
+        if self.archive is not None:
+            # The archive reaches back further than the tracker, e.g. after a backfill
+            archived = await self.hass.async_add_executor_job(
+                archive_baselines, self.archive, averaging_inv, payload_data["sensor_aggregates"], window_start, now_local
+            )
+            for category, entities in archived.items():
+                for entity_id, result in entities.items():
+                    baselines.setdefault(category, {}).setdefault(entity_id, {}).update(result)
+        if baselines:
+            payload_data["baselines"] = baselines
+        _lap("baselines")
+        
+        # Incidents the watchdog caught between reports
+        if self.watchdog is not None:
+            incidents = self.watchdog.async_take_incidents()
+            if incidents:
+                payload_data["incidents"] = incidents
+        
+        # Local rule-based analysis is cheap, so always run it as the fallback
+        local_analysis = analyze_locally(payload_data.get("sensor_aggregates", {}), get_thresholds(self.config))
+        _lap("local_analysis")
+        
+        if self.config.get(CONF_LOCAL_INTERIM_RESULTS, DEFAULT_LOCAL_INTERIM_RESULTS):
+            # Publish instant interim results while the LLM call is in flight
+            self.async_set_updated_data({
+                "analysis": local_analysis,
+                "data": payload_data,
+                "local_analysis": local_analysis
+            })
+        
+        # Fine-grained aggregates feed the baselines even if the prompt gets coarsened
+        aggregates = payload_data["sensor_aggregates"]
+        payload_data = await self._fit_token_budget(history_data, payload_data)
+        _lap("token_budget")
         
-        payload_data = {k: v for k, v in aggregated_data.items() if k != "raw_sample_debug"}
+        if self.batch is not None and self.config.get(CONF_BATCH_MODE, DEFAULT_BATCH_MODE):
+            # The LLM result arrives later through async_apply_batch_result
+            self.llm_calls = []
+            await self.batch.async_enqueue(self.entry_id, self._model_name(), self.build_prompt(payload_data))
+            analysis_json = dict(local_analysis, batch_pending=True)
+        else:
+            analysis_json = await self.analyse(payload_data)
+        _lap("llm")
+        
+        if analysis_json.get("status") == "Error":
+            _LOGGER.warning("Gemini analysis failed, using local rule-based analysis instead")
+            analysis_json = dict(local_analysis, llm_error=analysis_json.get("bad_points", []))
         
-        analysis_json = await self.call_gemini(payload_data)
+        self.baselines.update(aggregates, now_local)
+        await self._baselines_store.async_save(self.baselines.data)
+        _lap("baselines")
+        timings["total"] = round(sum(timings.values()), 1)
+        self.stage_timings = timings
         
-        # Get Device ID for this config entry
+        if not analysis_json.get("batch_pending"):
+            self._fire_report_ready(analysis_json)
+        
+        result = {
+            "analysis": analysis_json,
+            "data": payload_data,
+            "local_analysis": local_analysis,
+            "llm_calls": self.llm_calls,
+            "token_budget": self.token_budget,
+            "stage_timings": timings,
+            "generated_at": dt_util.utcnow().isoformat(),
+        }
+        if self.scheduled:
+            self._report_store.async_delay_save(lambda: result, 10)
+        return result
+
+    async def async_capture_refresh(self):
+        """Run a refresh while recording its inputs and LLM responses. Returns the capture path."""
+        captured_at = dt_util.utcnow()
+        backend = self.backend
+        self.backend = recording = RecordingBackend(backend)
         try:
-            device_registry = dr.async_get(self.hass)
-            device_entry = device_registry.async_get_device(identifiers={(DOMAIN, self.config.entry_id)})
-            device_id = device_entry.id if device_entry else None
+            await self.async_refresh()
+        finally:
+            self.backend = backend
+        
+        path = self.hass.config.path(CAPTURE_DIR, f"{self.entry_id or 'default'}-{captured_at:%Y%m%dT%H%M%S}.json.gz")
+        history_data, stage_timings = self._history, self.stage_timings
+        # Compacting and compressing a week of history is too slow for the event loop
+        await self.hass.async_add_executor_job(
+            lambda: write_capture(path, build_capture(captured_at, self.config, history_data, recording, stage_timings))
+        )
+        _LOGGER.info("Captured refresh to %s", path)
+        return path
+
+    async def async_fold_baselines(self, weekly_aggregates):
+        """Fold backfilled (week time, aggregates) pairs, oldest first, into the baselines.
+
+        Weeks that already came from a report are kept.
+        """
+        if self.baselines is None:
+            self.baselines = BaselineTracker(await self._baselines_store.async_load())
+        for now, aggregates in weekly_aggregates:
+            self.baselines.update(aggregates, now, replace=False)
+        await self._baselines_store.async_save(self.baselines.data)
+
+    async def async_apply_options(self, new_config):
+        """Apply changed options in place. Returns False if the entry must be reloaded instead."""
+        changes = classify_changes(self.config, new_config)
+        _LOGGER.debug("Option changes: %s", changes)
+        if CHANGE_RELOAD in changes:
+            return False
+        
+        # Model, routing and prompt options are read when the next call is made
+        self.config = new_config
+        if CHANGE_ENTITIES in changes and self.watchdog is not None:
+            self.watchdog.async_subscribe()
+        if not self.data or not changes.keys() - {CHANGE_NEXT_CALL}:
+            return True
+        
+        payload = dict(self.data.get("data", {}))
+        if CHANGE_HOUSE in changes:
+            payload["house_details"] = build_house_details(new_config)
+        if CHANGE_ENTITIES in changes or (CHANGE_THRESHOLDS in changes and "sensor_distributions" in payload):
+            payload.update(await self._reaggregate(payload))
+        
+        # The local analysis is cheap, so thresholds and entity changes just re-run it
+        local_analysis = analyze_locally(payload.get("sensor_aggregates", {}), get_thresholds(new_config))
+        analysis = self.data.get("analysis")
+        if isinstance(analysis, dict) and analysis.get("source") == "local":
+            analysis = dict(local_analysis, llm_error=analysis.get("llm_error", []))
+        
+        # Set the data directly: async_set_updated_data would push back the next refresh
+        self.data = dict(self.data, data=payload, analysis=analysis, local_analysis=local_analysis)
+        self.async_update_listeners()
+        if self.scheduled:
+            result = self.data
+            self._report_store.async_delay_save(lambda: result, 10)
+        return True
+
+    async def _reaggregate(self, payload):
+        """Re-aggregate from cached history after entity or threshold changes."""
+        entity_ids = [entity_id for key in ENTITY_CATEGORIES for entity_id in (self.config.get(key) or [])]
+        # Only newly added entities need a history query
+        missing = [entity_id for entity_id in entity_ids if entity_id not in self._history]
+        if missing:
+            self._history = dict(self._history)
+            now = dt_util.utcnow()
+            averaging_period = self.config.get(CONF_DATA_AVERAGING, DEFAULT_DATA_AVERAGING)
+            self._history.update(await get_history_data(self.hass, missing, duration=now - history_start(now, averaging_period)))
+        
+        # Only categories whose entities or thresholds changed are dirty in the aggregation graph
+        updated = aggregate_data(
+            self.hass,
+            self.config,
+            self._history,
+            averaging_period=payload.get("averaging_period", self.config.get(CONF_DATA_AVERAGING, DEFAULT_DATA_AVERAGING)),
+            category_periods=payload.get("category_averaging"),
+            graph=self._aggregation,
+        )
+        _LOGGER.debug("Recomputed aggregate categories: %s", self._aggregation.recomputed)
+        return {key: updated[key] for key in ("sensor_aggregates", "sensor_distributions") if key in updated}
+
+    def _model_name(self):
+        """Return the configured primary model name."""
+        # Ensure model name is bare (strip 'models/' prefix if user added it)
+        return self.config.get(CONF_GEMINI_MODEL, DEFAULT_GEMINI_MODEL).replace("models/", "")
+
+    async def _count_prompt_tokens(self, data, limit):
+        """Count the prompt tokens for `data`.
+        
+        The local estimate is used unless it is near the ceiling or the backend can't count.
+        """
+        prompt = self.build_prompt(data)
+        estimate = estimate_tokens(prompt)
+        if not needs_exact_count(estimate, limit):
+            return estimate, "estimate"
+        model_name = self._model_name()
+        try:
+            tokens = await self.backend.async_count_tokens(model_name, prompt)
         except Exception as e:
-            _LOGGER.warning("Could not find device for report event: %s", e)
-            device_id = None
+            _LOGGER.debug("Token count failed, estimating locally: %s", e)
+            tokens = None
+        if tokens is None:
+            return estimate, "estimate"
+        return tokens, "api"
+
+    async def _fit_token_budget(self, history_data, payload_data):
+        """Coarsen the noisiest categories until the prompt fits the token ceiling."""
+        limit = self.config.get(CONF_MAX_PROMPT_TOKENS, DEFAULT_MAX_PROMPT_TOKENS)
+        tokens, source = await self._count_prompt_tokens(payload_data, limit)
+        original_tokens = tokens
+        degraded = {}
+        
+        while limit and tokens > limit:
+            step = next_degradation(payload_data["sensor_aggregates"], payload_data["averaging_period"], degraded)
+            if step is None:
+                _LOGGER.warning(
+                    "Prompt is %s tokens even at Weekly granularity, above the %s token limit", tokens, limit
+                )
+                break
+            category, period = step
+            degraded[category] = period
+            _LOGGER.info("Prompt is %s tokens (limit %s), reducing %s to %s averaging", tokens, limit, category, period)
+            
+            coarser = aggregate_data(
+                self.hass, self.config, history_data,
+                averaging_period=payload_data["averaging_period"], category_periods=degraded, graph=self._aggregation
+            )
+            for key in ("baselines", "incidents"):
+                if key in payload_data:
+                    coarser[key] = payload_data[key]
+            payload_data = coarser
+            tokens, source = await self._count_prompt_tokens(payload_data, limit)
         
+        self.token_budget = {
+            "prompt_tokens": tokens,
+            "count_source": source,
+            "max_prompt_tokens": limit,
+        }
+        if degraded:
+            self.token_budget["original_prompt_tokens"] = original_tokens
+            self.token_budget["degraded_categories"] = degraded
+        return payload_data
+
+    def device_id(self):
+        """Return the device registry ID of this entry's device, if any."""
+        try:
+            device_registry = dr.async_get(self.hass)
+            device_entry = device_registry.async_get_device(identifiers={(DOMAIN, self.entry_id)})
+            return device_entry.id if device_entry else None
+        except Exception as e:
+            _LOGGER.warning("Could not find device for event: %s", e)
+            return None
+
+    def _fire_report_ready(self, analysis_json):
+        """Fire the report ready event for automations."""
         # Fire an event that automations can listen to for notifications
         # Including device_id allows device triggers to filter correct events
         self.hass.bus.async_fire(f"{DOMAIN}_report_ready", {
             "summary": analysis_json.get("comparison", "Report Ready"),
             "status": analysis_json.get("status"),
             "alerts": len(analysis_json.get("bad_points", [])),
-            "device_id": device_id
+            "device_id": self.device_id()
         })
-        
-        return {
-            "analysis": analysis_json,
-            "data": payload_data
-        }
 
-    async def call_gemini(self, data):
-        """Call Google Gemini API using new SDK."""
+    def async_apply_batch_result(self, result):
+        """Publish the LLM analysis of a finished batch job."""
+        local_analysis = (self.data or {}).get("local_analysis") or {}
+        call = {
+            "tier": "batch",
+            "model": result.get("model"),
+            "job": result.get("job"),
+            "latency_ms": round((dt_util.utcnow() - dt_util.parse_datetime(result["submitted_at"])).total_seconds() * 1000)
+            if result.get("submitted_at") else None,
+        }
+        call.update(asdict(LLMUsage(**(result.get("usage") or {}))))
+        
+        try:
+            if result.get("error"):
+                raise ValueError(result["error"])
+            analysis_json = self._parse_analysis(result.get("text", ""))
+        except Exception as e:
+            _LOGGER.warning("Batch analysis failed, keeping local rule-based analysis: %s", e)
+            call["error"] = str(e)
+            analysis_json = dict(local_analysis, llm_error=[f"API Error: {e}"])
         
+        # Set the data directly: async_set_updated_data would push back the next refresh
+        self.data = dict(self.data or {}, analysis=analysis_json, llm_calls=[call])
+        self.async_update_listeners()
+        self._fire_report_ready(analysis_json)
+        if self.scheduled:
+            result_data = self.data
+            self._report_store.async_delay_save(lambda: result_data, 10)
+
+    def _archive_aggregates(self, averaging_period, window_start, aggregates):
+        """Append aggregates to the archive and compact it (runs in executor)."""
+        try:
+            written = self.archive.append(averaging_period, window_start, aggregates)
+            self.archive.compact(dt_util.utcnow())
+            _LOGGER.debug("Archived %s aggregate records", written)
+        except OSError as e:
+            _LOGGER.warning("Could not write aggregate archive: %s", e)
+
+    def build_prompt(self, data):
+        """Build the analysis prompt for the aggregated data."""
         house_details = data.get('house_details', {})
         country = house_details.get('country', 'User Location')
         current_month = datetime.now().strftime("%B")
         
         # Get averaging period for context
-        averaging_period = self.config.get(CONF_DATA_AVERAGING, DEFAULT_DATA_AVERAGING)
+        averaging_period = data.get('averaging_period') or self.config.get(CONF_DATA_AVERAGING, DEFAULT_DATA_AVERAGING)
+        if data.get('category_averaging'):
+            # Some categories were coarsened to keep the prompt within the token limit
+            overrides = ", ".join(f"{k}: {v}" for k, v in data['category_averaging'].items())
+            averaging_period = f"{averaging_period} ({overrides})"
+        
+        baselines = data.get('baselines')
+        if baselines:
+            # Local baselines turn benchmark estimation into a comparison task
+            baseline_text = f"""
+        Baselines (from this home's own history): {json.dumps(baselines, separators=(',', ':'))}
+        Keys: "now" = this period, "4w" = rolling 4-week mean, "ly" = same month last year, "*_pct" = % deviation of "now".
+        """
+            seasonal_instruction = """1. Compare each value against the provided baselines. Only estimate seasonal benchmarks for entities without a baseline."""
+        else:
+            baseline_text = ""
+            seasonal_instruction = f"""1. You MUST heavily adjust benchmarks for the current month (currently {current_month}). 
+           - For example, January gas consumption in the UK is typically 2.5-3.5x higher than summer levels.
+           - Do NOT use a flat annual average broken down to weekly unless no seasonal data is available."""
+        
+        distributions = data.get('sensor_distributions')
+        distribution_text = ""
+        if distributions:
+            distribution_text = f"""
+        Distributions (per bin: min, max, median p50, 95th percentile p95, hours above/below the health threshold): {json.dumps(distributions, separators=(',', ':'))}
+        Use these to judge how long and how often thresholds were exceeded, not just the averages.
+        """
+        
+        incidents = data.get('incidents')
+        incident_text = ""
+        if incidents:
+            incident_text = f"""
+        Incidents detected in real time since the last report (sustained threshold breaches, doors/windows open while heating; "ended": null = ongoing): {json.dumps(incidents, separators=(',', ':'))}
+        Mention each incident in "bad_points" and take them into account for "status".
+        """
+        
+        # Split (per-domain) calls only see part of the data
+        scope_text = ""
+        if data.get('analysis_domain'):
+            scope_text = f"Scope: analyse ONLY {data['analysis_domain']}; other areas are covered separately.\n"
         
         prompt = f"""
         You are an expert home energy and health analyst.
@@ -139,14 +617,12 @@ class HAGenieCoordinator(DataUpdateCoordinator):
         
         House Details: {house_details}
         Data Period: Last 7 Days
-        Data Granularity: {averaging_period} Averaging
-        
+        Data Granularity: {averaging_period} Averaging (bins start at local time; a bin with "partial": true is still in progress and only covers data up to now)
+        {scope_text}
         Data: {json.dumps(data.get('sensor_aggregates', {}), indent=2)}
-        
+        {distribution_text}{baseline_text}{incident_text}
         IMPORTANT INSTRUCTIONS:
-        1. You MUST heavily adjust benchmarks for the current month (currently {current_month}). 
-           - For example, January gas consumption in the UK is typically 2.5-3.5x higher than summer levels.
-           - Do NOT use a flat annual average broken down to weekly unless no seasonal data is available.
+        {seasonal_instruction}
         2. Treat the following house information as authoritative and mandatory: {house_details.get('info', 'None')}.
            - If features like "electric underfloor heating" are present, explicitly cite them as reasons for higher consumption.
         
@@ -163,10 +639,86 @@ class HAGenieCoordinator(DataUpdateCoordinator):
         
         Do not include markdown code blocks.
         """
+        return prompt
+
+    async def analyse(self, data):
+        """Run the analysis, split into concurrent per-domain calls if enabled."""
+        self.llm_calls = []
+        
+        if not self.config.get(CONF_SPLIT_DOMAINS, DEFAULT_SPLIT_DOMAINS):
+            return await self._analyse_single(data)
+        
+        aggregates = data.get("sensor_aggregates", {})
+        baselines = data.get("baselines", {})
+        distributions = data.get("sensor_distributions")
+        semaphore = asyncio.Semaphore(self.config.get(CONF_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY))
+        
+        async def _run_domain(domain, categories):
+            sub_data = dict(data, analysis_domain=ANALYSIS_DOMAINS[domain][0])
+            sub_data["sensor_aggregates"] = {k: v for k, v in aggregates.items() if k in categories}
+            sub_data["baselines"] = {k: v for k, v in baselines.items() if k in categories}
+            if distributions is not None:
+                sub_data["sensor_distributions"] = {k: v for k, v in distributions.items() if k in categories}
+            if "incidents" in data:
+                sub_data["incidents"] = [i for i in data["incidents"] if i["category"] in categories]
+            async with semaphore:
+                return domain, await self._analyse_single(sub_data, domain=domain)
+        
+        tasks = [
+            _run_domain(domain, categories)
+            for domain, (_label, categories) in ANALYSIS_DOMAINS.items()
+            if any(category in aggregates for category in categories)
+        ]
+        if not tasks:
+            return await self._analyse_single(data)
+        
+        results = await asyncio.gather(*tasks)
+        return merge_analyses(dict(results))
+
+    async def _analyse_single(self, data, domain=None):
+        """Run one analysis, escalating to the larger model when routing is enabled."""
+        if not self.config.get(CONF_MODEL_ROUTING, DEFAULT_MODEL_ROUTING):
+            return await self.call_gemini(data, domain=domain)
+        
+        analysis = await self.call_gemini(data, tier="fast", domain=domain)
+        reason = self._escalation_reason(analysis, data)
+        if not reason:
+            return analysis
+        
+        _LOGGER.info("Escalating analysis to larger model: %s", reason)
+        model_name = self.config.get(CONF_GEMINI_ESCALATION_MODEL, DEFAULT_GEMINI_ESCALATION_MODEL)
+        escalated = await self.call_gemini(data, model_name=model_name, tier="escalated", domain=domain)
+        if escalated.get("status") == "Error":
+            # Keep whatever the fast tier produced rather than losing the report
+            return analysis
+        escalated["escalation_reason"] = reason
+        return escalated
+
+    def _escalation_reason(self, analysis, data):
+        """Return why the fast tier result should be escalated, or None."""
+        if analysis.get("status") == "Error":
+            return "fast model failed or returned invalid output"
+        if analysis.get("status") == STATUS_NEEDS_ATTENTION:
+            return "fast model reported Needs Attention"
+        
+        limit = self.config.get(CONF_ESCALATION_DEVIATION_PCT, DEFAULT_ESCALATION_DEVIATION_PCT)
+        for category, entities in data.get("baselines", {}).items():
+            for entity_id, baseline in entities.items():
+                for key in ("4w_pct", "ly_pct"):
+                    deviation = baseline.get(key)
+                    if deviation is not None and abs(deviation) > limit:
+                        return f"{entity_id} deviates {deviation}% from its {key[:-4]} baseline"
+        return None
+
+    async def call_gemini(self, data, model_name=None, tier="primary", domain=None):
+        """Call the configured LLM backend (Gemini by default) and parse the analysis."""
+        prompt = self.build_prompt(data)
+        started = time.monotonic()
+        call = None
         
         try:
-            # new SDK call structure
-            model_name = self.config.get(CONF_GEMINI_MODEL, DEFAULT_GEMINI_MODEL)
+            if model_name is None:
+                model_name = self.config.get(CONF_GEMINI_MODEL, DEFAULT_GEMINI_MODEL)
             
             # Ensure model name is bare (strip 'models/' prefix if user added it)
             if model_name.startswith("models/"):
@@ -175,30 +727,22 @@ class HAGenieCoordinator(DataUpdateCoordinator):
             _LOGGER.debug("Generated Prompt for Gemini: %s", prompt)
             _LOGGER.debug("Calling Gemini with model: %s", model_name)
 
-            def _sync_call():
-                return self.client.models.generate_content(
-                    model=model_name,
-                    contents=prompt
-                )
-
-            response = await self.hass.async_add_executor_job(_sync_call)
-            
-            if hasattr(response, 'text'):
-                 _LOGGER.debug("Gemini response received: %s", response.text[:200])
+            # Per-domain results are merged later, so only whole-report calls stream
+            if self.config.get(CONF_STREAMING, DEFAULT_STREAMING) and domain is None:
+                text, usage = await self._stream_gemini(model_name, prompt, tier)
+            else:
+                response = await self.backend.async_generate(model_name, prompt)
+                text, usage = response.text, response.usage
+            call = self._record_call(tier, model_name, started, usage, domain)
             
-            # SDK should return an object where .text is the response content
-            text = response.text.strip()
-            
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-                
-            return json.loads(text)
+            _LOGGER.debug("Gemini response received: %s", text[:200])
+            return self._parse_analysis(text)
             
         except Exception as e:
+            if call is None:
+                self._record_call(tier, model_name, started, None, domain, error=str(e))
+            else:
+                call["error"] = str(e)
             _LOGGER.error(f"Gemini API Error: {e}")
             # Return a valid fallback structure so sensors don't crash hard
             return {
@@ -208,3 +752,70 @@ class HAGenieCoordinator(DataUpdateCoordinator):
                 "comparison": "Analysis failed.",
                 "suggestions": []
             }
+
+
+    @staticmethod
+    def _parse_analysis(text):
+        """Parse and validate the JSON analysis in a response text."""
+        text = text.strip()
+        
+        if text.startswith("```json"):
+            text = text[7:]
+        if text.startswith("```"):
+            text = text[3:]
+        if text.endswith("```"):
+            text = text[:-3]
+            
+        analysis = json.loads(text)
+        errors = validate_analysis(analysis)
+        if errors:
+            raise ValueError(f"Response failed schema validation: {', '.join(errors)}")
+        return analysis
+
+    async def _stream_gemini(self, model_name, prompt, tier):
+        """Stream a response, publishing each top-level field as it completes."""
+        started = time.monotonic()
+        first_field_ms = None
+        usage = None
+
+        parser = StreamingJSONParser()
+        chunks = []
+        # Start empty so the previous report's points are never shown as part of this one
+        partial = {}
+
+        async for chunk in self.backend.async_generate_stream(model_name, prompt):
+            if chunk.usage is not None:
+                usage = chunk.usage
+            chunks.append(chunk.text)
+            for key, value in parser.feed(chunk.text):
+                if key not in PROGRESSIVE_FIELDS:
+                    continue
+                if first_field_ms is None:
+                    first_field_ms = round((time.monotonic() - started) * 1000)
+                partial[key] = value
+                self.async_set_updated_data(dict(self.data or {}, analysis=dict(partial), streaming=True))
+
+        self.hass.bus.async_fire(f"{DOMAIN}_stream_completed", {
+            "model": model_name,
+            "tier": tier,
+            "time_to_first_field_ms": first_field_ms,
+            "duration_ms": round((time.monotonic() - started) * 1000),
+        })
+        return "".join(chunks), usage
+
+    def _record_call(self, tier, model_name, started, usage, domain=None, error=None):
+        """Record latency and token usage of one LLM call for the summary sensor."""
+        call = {
+            "tier": tier,
+            "model": model_name,
+            "latency_ms": round((time.monotonic() - started) * 1000),
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "output_tokens": getattr(usage, "output_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+        if domain:
+            call["domain"] = domain
+        if error:
+            call["error"] = error
+        self.llm_calls.append(call)
+        return call
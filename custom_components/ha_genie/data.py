@@ -1,6 +1,6 @@
 """Data aggregation helpers for HA Genie."""
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import statistics
 from typing import Any, Dict, List, Optional
 
@@ -32,8 +32,21 @@ from .const import (
     CONF_HOUSE_INFO,
     DATA_AVERAGING_HOURLY,
     DATA_AVERAGING_DAILY,
-    DATA_AVERAGING_WEEKLY
+    DATA_AVERAGING_WEEKLY,
+    CONF_DISTRIBUTION_STATS,
+    DEFAULT_DISTRIBUTION_STATS,
+    CONF_THRESHOLD_HUMIDITY,
+    CONF_THRESHOLD_CO2,
+    CONF_THRESHOLD_RADON,
+    CONF_THRESHOLD_VOC,
+    CONF_THRESHOLD_TEMP_LOW,
+    DEFAULT_THRESHOLD_HUMIDITY,
+    DEFAULT_THRESHOLD_CO2,
+    DEFAULT_THRESHOLD_RADON,
+    DEFAULT_THRESHOLD_VOC,
+    DEFAULT_THRESHOLD_TEMP_LOW,
 )
+from .sketches import KLLSketch
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -123,19 +136,22 @@ def calculate_attribute_mean(states: List[State], attribute: str) -> Optional[fl
         return None
     return statistics.mean(values)
 
-def bin_history_data(states: List[State], start_time: datetime, end_time: datetime, interval: timedelta) -> List[Dict[str, Any]]:
-    """Slice history states into time intervals and return the list of states for each bin."""
+def bin_history_data(states: List[State], start_time: datetime, end_time: datetime, interval: timedelta, carry: bool = False) -> List[Dict[str, Any]]:
+    """Slice history states into time intervals and return the list of states for each bin.
+    
+    With `carry`, each bin also starts with the last state before it, so the
+    usage of a counter includes the increase since the previous bin's reading.
+    """
     bins = []
-    current_start = start_time
-    while current_start < end_time:
-        current_end = current_start + interval
-        if current_end > end_time:
-            current_end = end_time
-            
+    for current_start, current_end in bin_edges(start_time, end_time, interval):
         bin_states = [
             s for s in states 
             if current_start <= s.last_updated < current_end
         ]
+        if carry:
+            previous = [s for s in states if s.last_updated < current_start]
+            if previous:
+                bin_states.insert(0, previous[-1])
         
         bins.append({
             "start": current_start.isoformat(),
@@ -143,128 +159,382 @@ def bin_history_data(states: List[State], start_time: datetime, end_time: dateti
             "states": bin_states
         })
         
-        current_start = current_end
-        
     return bins
-def aggregate_data(hass: HomeAssistant, config: Dict[str, Any], history_data: Dict[str, List[State]], averaging_period: str = DATA_AVERAGING_WEEKLY) -> Dict[str, Any]:
-    """Aggregate raw history data into a summary JSON structure."""
+
+def bin_edges(start_time: datetime, end_time: datetime, interval: timedelta):
+    """Yield the (start, end) edges of consecutive bins, in the timezone of `start_time`.
+    
+    Day-long bins step in wall-clock time, so local days stay aligned to
+    midnight across DST changes. Shorter bins step in absolute time.
+    """
+    tz = start_time.tzinfo
+    current_start = start_time if interval >= timedelta(days=1) else start_time.astimezone(timezone.utc)
+    while current_start < end_time:
+        current_end = min(current_start + interval, end_time)
+        yield current_start.astimezone(tz), current_end.astimezone(tz)
+        current_start = current_end
+
+def averaging_interval(averaging_period: str) -> Optional[timedelta]:
+    """Return the bin interval for an averaging period (None = one value per window)."""
+    if averaging_period == DATA_AVERAGING_HOURLY:
+        return timedelta(hours=1)
+    if averaging_period == DATA_AVERAGING_DAILY:
+        return timedelta(days=1)
+    return None
+
+def build_raw_sample_debug(history_data: Dict[str, List[State]], limit: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+    """Build a debug sample of the first raw states of each entity.
+
+    Only built on demand (diagnostics download or debug logging); it is never
+    part of the payload sent to the API.
+    """
+    return {
+        entity_id: [
+            {"state": s.state, "time": s.last_updated.isoformat()}
+            for s in states[:limit]
+        ]
+        for entity_id, states in history_data.items()
+        if states
+    }
+
+class CompactState:
+    """Lightweight stand-in for a State with only what the calculators read.
+
+    Built from compact rows, which are picklable and JSON-serializable, so
+    history can be handed to worker processes or written to capture files.
+    """
+
+    __slots__ = ("state", "attributes", "last_updated")
+
+    def __init__(self, state, attributes, last_updated):
+        """Initialize."""
+        self.state = state
+        self.attributes = attributes
+        self.last_updated = last_updated
+
+def compact_states(states: List[State], start_ts: Optional[float] = None) -> List[list]:
+    """Return [timestamp, state, current_temperature] rows for a list of states.
+
+    With `start_ts`, earlier timestamps (the carried-in start state) are
+    clamped to it so they count towards the first bin.
+    """
+    rows = []
+    for s in states:
+        ts = s.last_updated.timestamp()
+        if start_ts is not None:
+            ts = max(ts, start_ts)
+        rows.append([ts, s.state, s.attributes.get("current_temperature")])
+    return rows
+
+def expand_states(rows: List[list]) -> List[CompactState]:
+    """Turn compact rows back into state objects for the calculators."""
+    return [
+        CompactState(state, {} if temp is None else {"current_temperature": temp}, datetime.fromtimestamp(ts, timezone.utc))
+        for ts, state, temp in rows
+    ]
+
+def build_house_details(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the house details sent with every prompt."""
+    return {
+        "bedrooms": config.get(CONF_HOUSE_BEDROOMS),
+        "size_sqm": config.get(CONF_HOUSE_SIZE),
+        "residents": config.get(CONF_HOUSE_RESIDENTS),
+        "info": config.get(CONF_HOUSE_INFO),
+        "country": config.get(CONF_HOUSE_COUNTRY),
+    }
+
+def aggregate_data(hass: HomeAssistant, config: Dict[str, Any], history_data: Dict[str, List[State]], averaging_period: str = DATA_AVERAGING_WEEKLY, category_periods: Optional[Dict[str, str]] = None, graph: Optional["AggregationGraph"] = None) -> Dict[str, Any]:
+    """Aggregate raw history data into a summary JSON structure.
+    
+    `category_periods` overrides the averaging period of individual categories
+    (used to coarsen the noisiest categories when the prompt is too large).
+    Pass a persistent `graph` to reuse categories whose inputs did not change.
+    """
+    category_periods = category_periods or {}
     
     summary = {
         "period_days": 7, # This remains the fetch window
         "averaging_period": averaging_period,
-        "house_details": {
-            "bedrooms": config.get(CONF_HOUSE_BEDROOMS),
-            "size_sqm": config.get(CONF_HOUSE_SIZE),
-            "residents": config.get(CONF_HOUSE_RESIDENTS),
-            "info": config.get(CONF_HOUSE_INFO),
-            "country": config.get(CONF_HOUSE_COUNTRY),
-        },
+        "house_details": build_house_details(config),
         "sensor_aggregates": {},
-        "raw_sample_debug": {} # Kept for user request "Output sample JSON structure", normally wouldn't send to API if GDPR strict
     }
+    if category_periods:
+        summary["category_averaging"] = dict(category_periods)
     
-    # Determine binning interval
-    bin_interval = None
-    if averaging_period == DATA_AVERAGING_HOURLY:
-        bin_interval = timedelta(hours=1)
-    elif averaging_period == DATA_AVERAGING_DAILY:
-        bin_interval = timedelta(days=1)
-    
-    # Calculate global start/end for binning (approximate based on data or now)
-    end_time = dt_util.utcnow()
-    start_time = end_time - timedelta(days=7) # Fixed 7 days window for now
-    
-    # Helper to process a category
-    def process_category(category_key: str, entity_ids: List[str], calc_func):
-        if not entity_ids:
-            return
-        
-        category_data = {}
-        for entity_id in entity_ids:
-            states = history_data.get(entity_id, [])
-            
-            # Fallback to current state if no history
-            if not states:
-                state = hass.states.get(entity_id)
-                if state:
-                    states = [state]
-            
-            if states:
-                # 1. Store debug sample
-                summary["raw_sample_debug"][entity_id] = [
-                    {"state": s.state, "time": s.last_updated.isoformat()} 
-                    for s in states[:5]
-                ]
-
-                # 2. Calculate values
-                if bin_interval:
-                    # Granular Output (List of values)
-                    bins = bin_history_data(states, start_time, end_time, bin_interval)
-                    binned_values = []
-                    for b in bins:
-                        val = calc_func(b["states"])
-                        if val is not None:
-                            # Clean timestamp for JSON (remove +00:00 for brevity if needed, but ISO is safer)
-                            binned_values.append({
-                                "start": b["start"], 
-                                "value": round(val, 2)
-                            })
-                    if binned_values:
-                         category_data[entity_id] = binned_values
-                else:
-                    # Single Aggregate Output (Backward compatible / Weekly)
-                    val = calc_func(states)
-                    if val is not None:
-                        category_data[entity_id] = round(val, 2)
-                    
+    if graph is None:
+        graph = AggregationGraph()
+    summary["sensor_aggregates"] = graph.aggregate(hass, config, history_data, averaging_period, category_periods)
+    if config.get(CONF_DISTRIBUTION_STATS, DEFAULT_DISTRIBUTION_STATS):
+        summary["sensor_distributions"] = graph.distributions(hass, config, history_data, averaging_period, category_periods)
+    return summary
 
-        if category_data:
-            summary["sensor_aggregates"][category_key] = category_data
+def calculate_radiator_temp(states: List[State]) -> Optional[float]:
+    """Calculate the mean current temperature reported by climate entities."""
+    return calculate_attribute_mean(states, "current_temperature")
 
+# Aggregation graph: category -> (entity option, calculation), in payload order
+CATEGORY_NODES = {
     # 1. Averages (Temp, Humidity, Radon, CO2, VOC)
-    process_category("temperature_avg", config.get(CONF_ENTITIES_TEMP, []), calculate_mean)
-    process_category("humidity_avg", config.get(CONF_ENTITIES_HUMIDITY, []), calculate_mean)
-    process_category("radon_avg_bq_m3", config.get(CONF_ENTITIES_RADON, []), calculate_mean)
-    process_category("co2_avg_ppm", config.get(CONF_ENTITIES_CO2, []), calculate_mean)
-    process_category("voc_avg_ppb", config.get(CONF_ENTITIES_VOC, []), calculate_mean)
-
+    "temperature_avg": (CONF_ENTITIES_TEMP, calculate_mean),
+    "humidity_avg": (CONF_ENTITIES_HUMIDITY, calculate_mean),
+    "radon_avg_bq_m3": (CONF_ENTITIES_RADON, calculate_mean),
+    "co2_avg_ppm": (CONF_ENTITIES_CO2, calculate_mean),
+    "voc_avg_ppb": (CONF_ENTITIES_VOC, calculate_mean),
     # 2. Usage (Energy, Gas)
-    process_category("electricity_usage_kwh", config.get(CONF_ENTITIES_ENERGY, []), calculate_usage)
-    process_category("gas_usage_kwh", config.get(CONF_ENTITIES_GAS, []), calculate_usage)
-    
+    "electricity_usage_kwh": (CONF_ENTITIES_ENERGY, calculate_usage),
+    "gas_usage_kwh": (CONF_ENTITIES_GAS, calculate_usage),
     # 3. Contact Sensors (Count openings)
-    process_category("contact_openings_count", config.get(CONF_ENTITIES_CONTACT, []), calculate_on_count)
-    
+    "contact_openings_count": (CONF_ENTITIES_CONTACT, calculate_on_count),
     # 4. Radiator Valves (Average Current Temp)
-    climate_entities = config.get(CONF_ENTITIES_VALVES, [])
-    if climate_entities:
-        c_data = {}
-        for entity_id in climate_entities:
-            states = history_data.get(entity_id, [])
+    "radiator_temps_avg": (CONF_ENTITIES_VALVES, calculate_radiator_temp),
+}
+
+# Entity option -> aggregate category it feeds
+ENTITY_CATEGORIES = {config_key: category for category, (config_key, _calc) in CATEGORY_NODES.items()}
+
+# Counters are binned with the reading before each bin, so the bins add up to the window's usage
+COUNTER_CATEGORIES = ("electricity_usage_kwh", "gas_usage_kwh")
+
+def _state_value(state: State) -> Optional[float]:
+    try:
+        return float(state.state)
+    except (ValueError, TypeError):
+        return None
+
+def _radiator_value(state: State) -> Optional[float]:
+    try:
+        return float(state.attributes.get("current_temperature"))
+    except (ValueError, TypeError):
+        return None
+
+# Distribution statistics: category -> (sample value, threshold key, default, time key)
+DISTRIBUTION_NODES = {
+    "temperature_avg": (_state_value, CONF_THRESHOLD_TEMP_LOW, DEFAULT_THRESHOLD_TEMP_LOW, "hours_below"),
+    "humidity_avg": (_state_value, CONF_THRESHOLD_HUMIDITY, DEFAULT_THRESHOLD_HUMIDITY, "hours_above"),
+    "radon_avg_bq_m3": (_state_value, CONF_THRESHOLD_RADON, DEFAULT_THRESHOLD_RADON, "hours_above"),
+    "co2_avg_ppm": (_state_value, CONF_THRESHOLD_CO2, DEFAULT_THRESHOLD_CO2, "hours_above"),
+    "voc_avg_ppb": (_state_value, CONF_THRESHOLD_VOC, DEFAULT_THRESHOLD_VOC, "hours_above"),
+    "radiator_temps_avg": (_radiator_value, None, None, None),
+}
+
+# Distributions are built from hourly sketches on a grid starting at local
+# midnight, so they merge cleanly into the hourly, daily and weekly windows
+BASE_INTERVAL = timedelta(hours=1)
+
+def hourly_distribution(states: List[State], grid_start: datetime, hours: int, now: datetime, value_func, limit=None, below=False):
+    """Return a (sketch, seconds past the limit) pair for each hour of the grid.
+    
+    Every state is a segment lasting until the next state. Each hour gets the
+    value of every segment overlapping it, so a value that held for ten hours
+    weighs ten times as much as a brief spike.
+    """
+    sketches = [KLLSketch() for _ in range(hours)]
+    seconds = [0.0] * hours
+    grid_end = min(grid_start + hours * BASE_INTERVAL, now)
+    for i, state in enumerate(states):
+        value = value_func(state)
+        if value is None:
+            continue
+        start = max(state.last_updated, grid_start)
+        end = min(states[i + 1].last_updated if i + 1 < len(states) else now, grid_end)
+        past_limit = limit is not None and (value < limit if below else value > limit)
+        while start < end:
+            index = int((start - grid_start) / BASE_INTERVAL)
+            chunk_end = min(grid_start + (index + 1) * BASE_INTERVAL, end)
+            sketches[index].update(value)
+            if past_limit:
+                seconds[index] += (chunk_end - start).total_seconds()
+            start = chunk_end
+    return list(zip(sketches, seconds))
+
+def _distribution_entry(base_bins, time_key):
+    """Merge hourly bins into one distribution entry, or None if there were no samples."""
+    merged = KLLSketch()
+    for sketch, _seconds in base_bins:
+        merged.merge(sketch)
+    if not len(merged):
+        return None
+    entry = {
+        "min": round(merged.min, 2),
+        "max": round(merged.max, 2),
+        "p50": round(merged.quantile(0.5), 2),
+        "p95": round(merged.quantile(0.95), 2),
+    }
+    if time_key:
+        entry[time_key] = round(sum(seconds for _sketch, seconds in base_bins) / 3600, 1)
+    return entry
+
+def _history_fingerprint(states: List[State]):
+    """Cheap change marker for an entity's history: sample count and newest sample."""
+    if not states:
+        return None
+    last = states[-1]
+    return (len(states), last.last_updated, last.state)
+
+def _bin_window(now: datetime, interval: timedelta):
+    """Return the 7 day (start, end) window ending at the last local bin edge before now.
+    
+    Daily bins are the user's days, from local midnight, and hourly bins
+    start on the local hour. Aligned edges stay the same for every refresh
+    within one interval, so unchanged categories can be reused instead of
+    re-binned. The bin in progress after `end` is reported flagged as partial.
+    """
+    local = dt_util.as_local(now)
+    if interval >= timedelta(days=1):
+        return dt_util.start_of_local_day(local.date() - timedelta(days=7)), dt_util.start_of_local_day(local)
+    end = local.replace(minute=0, second=0, microsecond=0)
+    return end - timedelta(days=7), end
+
+def history_start(now: datetime, averaging_period: str) -> datetime:
+    """Return where the history has to start to fill the bins of an averaging period.
+    
+    Binned periods can be coarsened to daily bins to fit the token budget, so
+    they fetch from the start of the daily window, which also covers the hourly one.
+    """
+    if averaging_interval(averaging_period) is None:
+        return now - timedelta(days=7)
+    return _bin_window(now, timedelta(days=1))[0]
+
+def _entity_states(hass: HomeAssistant, entity_ids: List[str], history_data: Dict[str, List[State]]) -> Dict[str, List[State]]:
+    entity_states = {}
+    for entity_id in entity_ids:
+        states = history_data.get(entity_id, [])
+        # Fallback to current state if no history
+        if not states:
+            state = hass.states.get(entity_id)
+            if state:
+                states = [state]
+        entity_states[entity_id] = states
+    return entity_states
+
+class AggregationGraph:
+    """Memoized per-category aggregation.
+    
+    Each category in CATEGORY_NODES is a node. Its inputs are the entity list,
+    the averaging period, the bin edges and a fingerprint of each entity's
+    history. A node is only recomputed when one of its inputs changed since
+    it was last evaluated.
+    """
+
+    def __init__(self):
+        """Initialize."""
+        # (category, averaging period) -> (inputs, output)
+        self._memo = {}
+        # Categories recomputed by the last aggregate() call
+        self.recomputed = []
+        # (category, entity_id) -> (inputs, hourly (sketch, seconds) bins)
+        self._base_distributions = {}
+
+    def aggregate(self, hass: HomeAssistant, config: Dict[str, Any], history_data: Dict[str, List[State]], averaging_period: str, category_periods: Dict[str, str]) -> Dict[str, Any]:
+        """Return sensor_aggregates, recomputing only dirty categories."""
+        self.recomputed = []
+        now = dt_util.utcnow()
+        aggregates = {}
+        for category, (config_key, calc_func) in CATEGORY_NODES.items():
+            entity_ids = config.get(config_key) or []
+            if not entity_ids:
+                continue
+            period = category_periods.get(category, averaging_period)
+            category_data = self._evaluate(hass, category, entity_ids, calc_func, history_data, period, now)
+            if category_data:
+                aggregates[category] = category_data
+        return aggregates
+
+    def _evaluate(self, hass, category, entity_ids, calc_func, history_data, period, now):
+        bin_interval = averaging_interval(period)
+        window = _bin_window(now, bin_interval) if bin_interval else None
+        
+        entity_states = _entity_states(hass, entity_ids, history_data)
+        inputs = (tuple(entity_ids), window, tuple(_history_fingerprint(s) for s in entity_states.values()))
+        memo = self._memo.get((category, period))
+        if memo is not None and memo[0] == inputs:
+            return memo[1]
+        
+        category_data = {}
+        for entity_id, states in entity_states.items():
             if not states:
-                 state = hass.states.get(entity_id)
-                 if state: states = [state]
-            if states:
-                 # Logic for climate binning is the same structure, just different extraction func
-                 pass # TODO: Refactor process_category to handle custom calc_func better or CP logic.
-                 # For now, let's keep it simple and just do Weekly/Single average for climate
-                 # OR duplicate the logic... duplicating is safer for strict instruction compliance now.
-                 
-                 if bin_interval:
-                    bins = bin_history_data(states, start_time, end_time, bin_interval)
-                    binned_values = []
-                    for b in bins:
-                        val = calculate_attribute_mean(b["states"], "current_temperature")
-                        if val is not None:
-                            binned_values.append({"start": b["start"], "value": round(val, 2)})
-                    if binned_values:
-                        c_data[entity_id] = binned_values
-                 else:
-                    val = calculate_attribute_mean(states, "current_temperature")
+                continue
+            if window:
+                # Granular Output (List of values)
+                binned_values = []
+                # Up to the end of the bin in progress, which only holds samples up to now
+                partial_start = window[1].isoformat()
+                for b in bin_history_data(states, window[0], window[1] + bin_interval, bin_interval, category in COUNTER_CATEGORIES):
+                    val = calc_func(b["states"])
                     if val is not None:
-                       c_data[entity_id] = round(val, 2)
-
-        if c_data:
-            summary["sensor_aggregates"]["radiator_temps_avg"] = c_data
+                        binned_values.append({"start": b["start"], "value": round(val, 2)})
+                        if b["start"] == partial_start:
+                            binned_values[-1]["partial"] = True
+                if binned_values:
+                    category_data[entity_id] = binned_values
+            else:
+                # Single Aggregate Output (Backward compatible / Weekly)
+                val = calc_func(states)
+                if val is not None:
+                    category_data[entity_id] = round(val, 2)
+        
+        self._memo[(category, period)] = (inputs, category_data)
+        self.recomputed.append(category)
+        return category_data
 
-    return summary
+    def distributions(self, hass: HomeAssistant, config: Dict[str, Any], history_data: Dict[str, List[State]], averaging_period: str, category_periods: Dict[str, str]) -> Dict[str, Any]:
+        """Return min/max/p50/p95 and time past the health threshold per bin.
+        
+        Hourly sketches are kept per entity and only rebuilt when the entity's
+        history or threshold changed. Daily and weekly figures are merged from
+        them without touching the raw history again.
+        """
+        now = dt_util.utcnow()
+        hour_end = _bin_window(now, BASE_INTERVAL)[1]
+        day_start, day_end = _bin_window(now, timedelta(days=1))
+        # Hours are counted in UTC, so a local day has 23 or 25 of them across DST changes
+        grid_start = dt_util.as_utc(day_start)
+        hours = int((dt_util.as_utc(day_end + timedelta(days=1)) - grid_start) / BASE_INTERVAL)
+        
+        base_distributions = {}
+        distributions = {}
+        for category, (value_func, threshold_key, default, time_key) in DISTRIBUTION_NODES.items():
+            entity_ids = config.get(CATEGORY_NODES[category][0]) or []
+            if not entity_ids:
+                continue
+            limit = config.get(threshold_key, default) if threshold_key else None
+            period = category_periods.get(category, averaging_period)
+            bin_interval = averaging_interval(period)
+            
+            category_data = {}
+            for entity_id, states in _entity_states(hass, entity_ids, history_data).items():
+                if not states:
+                    continue
+                inputs = (_history_fingerprint(states), grid_start, hour_end, limit)
+                memo = self._base_distributions.get((category, entity_id))
+                if memo is None or memo[0] != inputs:
+                    memo = (inputs, hourly_distribution(states, grid_start, hours, now, value_func, limit, time_key == "hours_below"))
+                base_distributions[(category, entity_id)] = memo
+                base_bins = memo[1]
+                
+                if bin_interval is None:
+                    # One figure for the rolling week
+                    first = int((hour_end - timedelta(days=7) - grid_start) / BASE_INTERVAL)
+                    entry = _distribution_entry(base_bins[first:first + 7 * 24], time_key)
+                    if entry:
+                        category_data[entity_id] = entry
+                    continue
+                
+                window_start, window_end = _bin_window(now, bin_interval)
+                entries = []
+                for bin_start, bin_end in bin_edges(window_start, window_end + bin_interval, bin_interval):
+                    first = int((bin_start - grid_start) / BASE_INTERVAL)
+                    last = int((bin_end - grid_start) / BASE_INTERVAL)
+                    entry = _distribution_entry(base_bins[first:last], time_key)
+                    if entry:
+                        entries.append({"start": bin_start.isoformat(), **entry})
+                        if bin_start == window_end:
+                            entries[-1]["partial"] = True
+                if entries:
+                    category_data[entity_id] = entries
+            if category_data:
+                distributions[category] = category_data
+        
+        # Drop sketches of entities that are no longer configured
+        self._base_distributions = base_distributions
+        return distributions
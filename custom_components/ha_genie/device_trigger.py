@@ -13,10 +13,18 @@ from .const import DOMAIN
 _LOGGER = logging.getLogger(__name__)
 
 TRIGGER_TYPE_REPORT_COMPLETED = "report_completed"
+TRIGGER_TYPE_ALERT = "alert"
+
+# Trigger type -> (subtype, event fired by the integration)
+TRIGGER_EVENTS = {
+    TRIGGER_TYPE_REPORT_COMPLETED: ("weekly_report", f"{DOMAIN}_report_ready"),
+    # Fired by the real-time watchdog between reports
+    TRIGGER_TYPE_ALERT: ("threshold_alert", f"{DOMAIN}_alert"),
+}
 
 TRIGGER_SCHEMA = DEVICE_TRIGGER_BASE_SCHEMA.extend(
     {
-        vol.Required("type"): TRIGGER_TYPE_REPORT_COMPLETED,
+        vol.Required("type"): vol.In(TRIGGER_EVENTS),
     }
 )
 
@@ -27,9 +35,10 @@ async def async_get_triggers(hass: HomeAssistant, device_id: str):
             "platform": "device",
             "domain": DOMAIN,
             "device_id": device_id,
-            "type": TRIGGER_TYPE_REPORT_COMPLETED,
-            "subtype": "weekly_report",
+            "type": trigger_type,
+            "subtype": subtype,
         }
+        for trigger_type, (subtype, _event_type) in TRIGGER_EVENTS.items()
     ]
 
 async def async_attach_trigger(
@@ -42,7 +51,7 @@ async def async_attach_trigger(
     event_config = event_trigger.TRIGGER_SCHEMA(
         {
             event_trigger.CONF_PLATFORM: "event",
-            event_trigger.CONF_EVENT_TYPE: f"{DOMAIN}_report_ready",
+            event_trigger.CONF_EVENT_TYPE: TRIGGER_EVENTS[config["type"]][1],
             # This ensures the trigger filters by device_id matching the config
             event_trigger.CONF_EVENT_DATA: {
                 "device_id": config["device_id"]
@@ -0,0 +1,36 @@
+"""Diagnostics support for HA Genie."""
+import logging
+from datetime import timedelta
+
+from homeassistant.components.diagnostics import async_redact_data
+
+from .const import DOMAIN, CONF_GEMINI_API_KEY
+from .data import build_raw_sample_debug, get_history_data
+
+_LOGGER = logging.getLogger(__name__)
+
+TO_REDACT = {CONF_GEMINI_API_KEY}
+
+# Raw samples are only needed to check what the recorder returns, so a short
+# window is enough and keeps the download cheap
+SAMPLE_WINDOW = timedelta(days=1)
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return diagnostics for a config entry."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    
+    entity_ids = [
+        entity_id
+        for value in entry.data.values()
+        if isinstance(value, list)
+        for entity_id in value
+    ]
+    # Built lazily here rather than on every refresh
+    history_data = await get_history_data(hass, entity_ids, duration=SAMPLE_WINDOW)
+    
+    return {
+        "config": async_redact_data(dict(entry.data), TO_REDACT),
+        "report": coordinator.data,
+        "raw_sample_debug": build_raw_sample_debug(history_data),
+    }
@@ -0,0 +1,184 @@
+"""Entity auto-discovery for HA Genie.
+
+An index over the entity registry and state machine is built once, keyed by
+domain, device_class and unit. Registry update events, and state changes that
+change one of those attributes (e.g. a unit set by the integration without a
+registry update), then update it entry by entry, so proposals stay cheap even
+with thousands of entities.
+"""
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set
+
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import callback
+from homeassistant.helpers import entity_registry as er
+
+from .const import (
+    DOMAIN,
+    CONF_ENTITIES_TEMP,
+    CONF_ENTITIES_HUMIDITY,
+    CONF_ENTITIES_RADON,
+    CONF_ENTITIES_CO2,
+    CONF_ENTITIES_VOC,
+    CONF_ENTITIES_CONTACT,
+    CONF_ENTITIES_VALVES,
+    CONF_ENTITIES_ENERGY,
+    CONF_ENTITIES_GAS,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_ENTITY_INDEX = f"{DOMAIN}_entity_index"
+
+METER_STATE_CLASSES = ("total", "total_increasing")
+# State attributes the index is built from
+INDEXED_ATTRIBUTES = ("device_class", "unit_of_measurement", "state_class")
+
+# Entity option -> (domain, device classes, units, required state classes).
+# An entity matches if it is in the domain and has one of the device classes
+# or units; None device classes means every entity of the domain.
+DISCOVERY_RULES = {
+    CONF_ENTITIES_TEMP: ("sensor", ("temperature",), (), ()),
+    CONF_ENTITIES_HUMIDITY: ("sensor", ("humidity",), (), ()),
+    CONF_ENTITIES_CO2: ("sensor", ("carbon_dioxide",), (), ()),
+    # The VOC threshold is in ppb, so mass concentration sensors are left out
+    CONF_ENTITIES_VOC: ("sensor", ("volatile_organic_compounds_parts",), ("ppb",), ()),
+    # Radon has no device class in Home Assistant
+    CONF_ENTITIES_RADON: ("sensor", (), ("Bq/m³", "Bq/m3", "pCi/L"), ()),
+    CONF_ENTITIES_ENERGY: ("sensor", ("energy",), (), METER_STATE_CLASSES),
+    CONF_ENTITIES_GAS: ("sensor", ("gas",), (), METER_STATE_CLASSES),
+    # Matches the device classes allowed by the contact selector
+    CONF_ENTITIES_CONTACT: ("binary_sensor", ("door", "window"), (), ()),
+    CONF_ENTITIES_VALVES: ("climate", None, (), ()),
+}
+
+
+class EntityIndex:
+    """Lookup index of candidate entities by domain, device class and unit."""
+
+    def __init__(self):
+        """Initialize."""
+        # entity_id -> {"domain", "device_class", "unit", "state_class"}
+        self._entities: Dict[str, Dict[str, Any]] = {}
+        # ("domain" | "device_class" | "unit", value) -> entity_ids
+        self._by_key: Dict[tuple, Set[str]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self._entities)
+
+    def add(self, entity_id: str, info: Dict[str, Any]) -> None:
+        """Add or replace an entity."""
+        self.remove(entity_id)
+        self._entities[entity_id] = info
+        for key in ("domain", "device_class", "unit"):
+            if info.get(key):
+                self._by_key[(key, info[key])].add(entity_id)
+
+    def remove(self, entity_id: str) -> None:
+        """Remove an entity if indexed."""
+        info = self._entities.pop(entity_id, None)
+        if info is None:
+            return
+        for key in ("domain", "device_class", "unit"):
+            if info.get(key):
+                self._by_key[(key, info[key])].discard(entity_id)
+
+    def match(self, domain: str, device_classes, units, state_classes) -> List[str]:
+        """Return the sorted entity_ids matching one discovery rule."""
+        if device_classes is None:
+            candidates = self._by_key.get(("domain", domain), set())
+        else:
+            candidates = set()
+            for device_class in device_classes:
+                candidates |= self._by_key.get(("device_class", device_class), set())
+            for unit in units:
+                candidates |= self._by_key.get(("unit", unit), set())
+        return sorted(
+            entity_id for entity_id in candidates
+            if self._entities[entity_id]["domain"] == domain
+            and (not state_classes or self._entities[entity_id].get("state_class") in state_classes)
+        )
+
+    def propose(self) -> Dict[str, List[str]]:
+        """Return proposed entities for every entity option."""
+        return {key: self.match(*rule) for key, rule in DISCOVERY_RULES.items()}
+
+
+def _state_info(state) -> Dict[str, Any]:
+    """Return index info for an entity that only exists in the state machine."""
+    return {
+        "domain": state.domain,
+        "device_class": state.attributes.get("device_class"),
+        "unit": state.attributes.get("unit_of_measurement"),
+        "state_class": state.attributes.get("state_class"),
+    }
+
+
+def _registry_info(entry, state) -> Optional[Dict[str, Any]]:
+    """Return index info for a registry entry, or None if it should not be proposed."""
+    if entry.disabled_by or entry.entity_category or entry.platform == DOMAIN:
+        # Disabled, config/diagnostic entities and our own aggregate sensors
+        return None
+    attributes = state.attributes if state else {}
+    return {
+        "domain": entry.domain,
+        "device_class": entry.device_class or entry.original_device_class or attributes.get("device_class"),
+        "unit": entry.unit_of_measurement or attributes.get("unit_of_measurement"),
+        "state_class": (entry.capabilities or {}).get("state_class") or attributes.get("state_class"),
+    }
+
+
+@callback
+def async_get_entity_index(hass) -> EntityIndex:
+    """Return the shared entity index, building it on first use."""
+    if (index := hass.data.get(DATA_ENTITY_INDEX)) is not None:
+        return index
+
+    index = EntityIndex()
+    registry = er.async_get(hass)
+    for entry in registry.entities.values():
+        if (info := _registry_info(entry, hass.states.get(entry.entity_id))) is not None:
+            index.add(entry.entity_id, info)
+    # Entities without a unique ID only exist in the state machine
+    for state in hass.states.async_all():
+        if state.entity_id in registry.entities:
+            continue
+        index.add(state.entity_id, _state_info(state))
+
+    @callback
+    def _async_registry_updated(event):
+        """Update only the changed entry instead of rescanning."""
+        data = event.data
+        if data.get("old_entity_id"):
+            index.remove(data["old_entity_id"])
+        index.remove(data["entity_id"])
+        if data["action"] == "remove":
+            return
+        entry = registry.async_get(data["entity_id"])
+        if entry and (info := _registry_info(entry, hass.states.get(entry.entity_id))) is not None:
+            index.add(entry.entity_id, info)
+
+    @callback
+    def _async_state_changed(event):
+        """Update an entry whose indexed attributes changed, ignoring plain value updates."""
+        old_state, new_state = event.data.get("old_state"), event.data.get("new_state")
+        if old_state is not None and new_state is not None and all(
+            old_state.attributes.get(attr) == new_state.attributes.get(attr) for attr in INDEXED_ATTRIBUTES
+        ):
+            return
+        entity_id = event.data["entity_id"]
+        index.remove(entity_id)
+        if (entry := registry.async_get(entity_id)) is not None:
+            info = _registry_info(entry, new_state)
+        else:
+            info = _state_info(new_state) if new_state is not None else None
+        if info is not None:
+            index.add(entity_id, info)
+
+    # Live as long as Home Assistant, like the index itself
+    hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED, _async_registry_updated)
+    hass.bus.async_listen(EVENT_STATE_CHANGED, _async_state_changed)
+    hass.data[DATA_ENTITY_INDEX] = index
+    _LOGGER.debug("Built entity discovery index with %s entities", len(index))
+    return index
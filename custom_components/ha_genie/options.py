@@ -0,0 +1,155 @@
+"""Classify option changes so they can be applied without a reload."""
+from typing import Any, Dict, List, Mapping
+
+from .const import (
+    CONF_GEMINI_MODEL,
+    CONF_GEMINI_ESCALATION_MODEL,
+    CONF_MODEL_ROUTING,
+    CONF_ESCALATION_DEVIATION_PCT,
+    CONF_SPLIT_DOMAINS,
+    CONF_MAX_CONCURRENCY,
+    CONF_STREAMING,
+    CONF_MAX_PROMPT_TOKENS,
+    CONF_LOCAL_INTERIM_RESULTS,
+    CONF_HOUSE_BEDROOMS,
+    CONF_HOUSE_SIZE,
+    CONF_HOUSE_COUNTRY,
+    CONF_HOUSE_RESIDENTS,
+    CONF_HOUSE_INFO,
+    CONF_THRESHOLD_HUMIDITY,
+    CONF_THRESHOLD_CO2,
+    CONF_THRESHOLD_RADON,
+    CONF_THRESHOLD_VOC,
+    CONF_THRESHOLD_TEMP_LOW,
+    CONF_WATCHDOG_OPEN_MINUTES,
+    CONF_ARCHIVE_ENABLED,
+    CONF_ARCHIVE_RETENTION_DAYS,
+    CONF_ARCHIVE_COMPACT_AFTER_DAYS,
+    CONF_SCHEDULE_TIME,
+    CONF_SCHEDULE_WEEKDAY,
+    CONF_SCHEDULE_JITTER_MINUTES,
+    CONF_LLM_BACKEND,
+    CONF_LLM_BASE_URL,
+    CONF_AUTO_DISCOVER,
+    CONF_DISTRIBUTION_STATS,
+    CONF_BATCH_MODE,
+    CONF_WATCHDOG,
+    DEFAULT_GEMINI_ESCALATION_MODEL,
+    DEFAULT_MODEL_ROUTING,
+    DEFAULT_ESCALATION_DEVIATION_PCT,
+    DEFAULT_SPLIT_DOMAINS,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_STREAMING,
+    DEFAULT_MAX_PROMPT_TOKENS,
+    DEFAULT_LOCAL_INTERIM_RESULTS,
+    DEFAULT_THRESHOLD_HUMIDITY,
+    DEFAULT_THRESHOLD_CO2,
+    DEFAULT_THRESHOLD_RADON,
+    DEFAULT_THRESHOLD_VOC,
+    DEFAULT_THRESHOLD_TEMP_LOW,
+    DEFAULT_WATCHDOG_OPEN_MINUTES,
+    DEFAULT_ARCHIVE_ENABLED,
+    DEFAULT_ARCHIVE_RETENTION_DAYS,
+    DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS,
+    DEFAULT_SCHEDULE_TIME,
+    DEFAULT_SCHEDULE_WEEKDAY,
+    DEFAULT_SCHEDULE_JITTER_MINUTES,
+    DEFAULT_LLM_BACKEND,
+    DEFAULT_LLM_BASE_URL,
+    DEFAULT_AUTO_DISCOVER,
+    DEFAULT_DISTRIBUTION_STATS,
+    DEFAULT_BATCH_MODE,
+    DEFAULT_WATCHDOG,
+)
+from .data import ENTITY_CATEGORIES
+
+# Only read when the next LLM call is made
+CHANGE_NEXT_CALL = "next_call"
+# Recompute the affected categories from cached history
+CHANGE_ENTITIES = "entities"
+# Update the house details used by the next prompt
+CHANGE_HOUSE = "house"
+# Re-run the local analysis
+CHANGE_THRESHOLDS = "thresholds"
+# Anything else (API key, backend, schedule, averaging, archive) rebuilds the coordinator
+CHANGE_RELOAD = "reload"
+
+OPTION_CHANGES = {
+    **dict.fromkeys((
+        CONF_GEMINI_MODEL,
+        CONF_GEMINI_ESCALATION_MODEL,
+        CONF_MODEL_ROUTING,
+        CONF_ESCALATION_DEVIATION_PCT,
+        CONF_SPLIT_DOMAINS,
+        CONF_MAX_CONCURRENCY,
+        CONF_STREAMING,
+        CONF_MAX_PROMPT_TOKENS,
+        CONF_LOCAL_INTERIM_RESULTS,
+    ), CHANGE_NEXT_CALL),
+    **dict.fromkeys(ENTITY_CATEGORIES, CHANGE_ENTITIES),
+    **dict.fromkeys((
+        CONF_HOUSE_BEDROOMS,
+        CONF_HOUSE_SIZE,
+        CONF_HOUSE_COUNTRY,
+        CONF_HOUSE_RESIDENTS,
+        CONF_HOUSE_INFO,
+    ), CHANGE_HOUSE),
+    **dict.fromkeys((
+        CONF_THRESHOLD_HUMIDITY,
+        CONF_THRESHOLD_CO2,
+        CONF_THRESHOLD_RADON,
+        CONF_THRESHOLD_VOC,
+        CONF_THRESHOLD_TEMP_LOW,
+        # Read live by the watchdog
+        CONF_WATCHDOG_OPEN_MINUTES,
+    ), CHANGE_THRESHOLDS),
+}
+
+# Entries set up before an option existed don't store it; the code uses these
+OPTION_DEFAULTS = {
+    CONF_GEMINI_ESCALATION_MODEL: DEFAULT_GEMINI_ESCALATION_MODEL,
+    CONF_MODEL_ROUTING: DEFAULT_MODEL_ROUTING,
+    CONF_ESCALATION_DEVIATION_PCT: DEFAULT_ESCALATION_DEVIATION_PCT,
+    CONF_SPLIT_DOMAINS: DEFAULT_SPLIT_DOMAINS,
+    CONF_MAX_CONCURRENCY: DEFAULT_MAX_CONCURRENCY,
+    CONF_STREAMING: DEFAULT_STREAMING,
+    CONF_MAX_PROMPT_TOKENS: DEFAULT_MAX_PROMPT_TOKENS,
+    CONF_LOCAL_INTERIM_RESULTS: DEFAULT_LOCAL_INTERIM_RESULTS,
+    CONF_THRESHOLD_HUMIDITY: DEFAULT_THRESHOLD_HUMIDITY,
+    CONF_THRESHOLD_CO2: DEFAULT_THRESHOLD_CO2,
+    CONF_THRESHOLD_RADON: DEFAULT_THRESHOLD_RADON,
+    CONF_THRESHOLD_VOC: DEFAULT_THRESHOLD_VOC,
+    CONF_THRESHOLD_TEMP_LOW: DEFAULT_THRESHOLD_TEMP_LOW,
+    CONF_WATCHDOG_OPEN_MINUTES: DEFAULT_WATCHDOG_OPEN_MINUTES,
+    CONF_ARCHIVE_ENABLED: DEFAULT_ARCHIVE_ENABLED,
+    CONF_ARCHIVE_RETENTION_DAYS: DEFAULT_ARCHIVE_RETENTION_DAYS,
+    CONF_ARCHIVE_COMPACT_AFTER_DAYS: DEFAULT_ARCHIVE_COMPACT_AFTER_DAYS,
+    CONF_SCHEDULE_TIME: DEFAULT_SCHEDULE_TIME,
+    CONF_SCHEDULE_WEEKDAY: DEFAULT_SCHEDULE_WEEKDAY,
+    CONF_SCHEDULE_JITTER_MINUTES: DEFAULT_SCHEDULE_JITTER_MINUTES,
+    CONF_LLM_BACKEND: DEFAULT_LLM_BACKEND,
+    CONF_LLM_BASE_URL: DEFAULT_LLM_BASE_URL,
+    CONF_AUTO_DISCOVER: DEFAULT_AUTO_DISCOVER,
+    CONF_DISTRIBUTION_STATS: DEFAULT_DISTRIBUTION_STATS,
+    CONF_BATCH_MODE: DEFAULT_BATCH_MODE,
+    CONF_WATCHDOG: DEFAULT_WATCHDOG,
+}
+
+
+def classify_changes(old: Mapping[str, Any], new: Mapping[str, Any]) -> Dict[str, List[str]]:
+    """Return the changed option keys grouped by how they can be applied."""
+    changes = {}
+    for key in sorted(set(old) | set(new)):
+        kind = OPTION_CHANGES.get(key, CHANGE_RELOAD)
+        before, after = old.get(key), new.get(key)
+        if key in OPTION_DEFAULTS:
+            # The first save stores the default the entry was already using
+            default = OPTION_DEFAULTS[key]
+            before = default if before is None else before
+            after = default if after is None else after
+        if kind == CHANGE_ENTITIES:
+            # An unset entity list and an empty one are the same
+            before, after = before or [], after or []
+        if before != after:
+            changes.setdefault(kind, []).append(key)
+    return changes
@@ -0,0 +1,137 @@
+"""Record/replay of single refreshes for HA Genie.
+
+A capture holds everything one refresh depended on: the recorder output (in
+compact row form), the refresh time, the options without the API key, every
+LLM response and the stage timings measured in the live system. It is
+written as gzip-compressed JSON to `<config>/ha_genie_captures/`.
+
+`scripts/replay_refresh.py` drives the coordinator pipeline from a capture
+with a `ReplayBackend` and no recorder or network, so engine changes can be
+timed against real houses.
+"""
+import gzip
+import json
+import logging
+import os
+from dataclasses import asdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .backends import LLMBackend, LLMResponse, LLMUsage
+from .const import CONF_GEMINI_API_KEY
+from .data import compact_states, expand_states
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_DIR = "ha_genie_captures"
+CAPTURE_VERSION = 1
+
+
+class RecordingBackend(LLMBackend):
+    """Wraps a backend and records every response it returns."""
+
+    def __init__(self, backend: LLMBackend):
+        """Initialize."""
+        super().__init__(backend.hass)
+        self.backend = backend
+        self.name = backend.name
+        self.calls: List[Dict[str, Any]] = []
+        self.token_counts: List[Dict[str, Any]] = []
+
+    def _record(self, model, prompt, text, usage):
+        self.calls.append({
+            "model": model,
+            "prompt": prompt,
+            "text": text,
+            "usage": None if usage is None else asdict(usage),
+        })
+
+    async def async_generate(self, model: str, prompt: str) -> LLMResponse:
+        response = await self.backend.async_generate(model, prompt)
+        self._record(model, prompt, response.text, response.usage)
+        return response
+
+    async def async_generate_stream(self, model: str, prompt: str) -> AsyncIterator[LLMResponse]:
+        text = []
+        usage = None
+        async for chunk in self.backend.async_generate_stream(model, prompt):
+            text.append(chunk.text)
+            usage = chunk.usage or usage
+            yield chunk
+        self._record(model, prompt, "".join(text), usage)
+
+    async def async_count_tokens(self, model: str, prompt: str) -> Optional[int]:
+        count = await self.backend.async_count_tokens(model, prompt)
+        self.token_counts.append({"model": model, "prompt": prompt, "tokens": count})
+        return count
+
+
+class ReplayBackend(LLMBackend):
+    """Answers from recorded responses instead of a model.
+
+    A call gets the response recorded for the identical prompt. If the engine
+    under test changed the prompt, it gets the next unused response for the
+    same model instead, in recording order.
+    """
+
+    name = "replay"
+
+    def __init__(self, hass, calls: List[Dict[str, Any]], token_counts: Optional[List[Dict[str, Any]]] = None):
+        """Initialize."""
+        super().__init__(hass)
+        self._calls = list(calls)
+        self._token_counts = {(c["model"], c["prompt"]): c["tokens"] for c in token_counts or []}
+        self.misses = 0
+
+    def _take(self, model, prompt) -> Dict[str, Any]:
+        for matches in (
+            lambda c: c["model"] == model and c["prompt"] == prompt,
+            lambda c: c["model"] == model,
+            lambda c: True,
+        ):
+            for index, call in enumerate(self._calls):
+                if matches(call):
+                    if call["prompt"] != prompt:
+                        self.misses += 1
+                    return self._calls.pop(index)
+        raise RuntimeError(f"No recorded response left for model {model}")
+
+    async def async_generate(self, model: str, prompt: str) -> LLMResponse:
+        call = self._take(model, prompt)
+        return LLMResponse(call["text"], LLMUsage(**call["usage"]) if call["usage"] else None)
+
+    async def async_count_tokens(self, model: str, prompt: str) -> Optional[int]:
+        return self._token_counts.get((model, prompt))
+
+
+def build_capture(captured_at, config, history_data, recording: RecordingBackend, stage_timings) -> Dict[str, Any]:
+    """Return the capture of one refresh."""
+    return {
+        "version": CAPTURE_VERSION,
+        "captured_at": captured_at.isoformat(),
+        "config": {k: v for k, v in config.items() if k != CONF_GEMINI_API_KEY},
+        "history": {entity_id: compact_states(states) for entity_id, states in history_data.items()},
+        "llm_calls": recording.calls,
+        "token_counts": recording.token_counts,
+        "stage_timings": stage_timings,
+    }
+
+
+def write_capture(path: str, capture: Dict[str, Any]) -> None:
+    """Write a capture as gzip-compressed JSON (blocking)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(capture, f, separators=(",", ":"))
+
+
+def read_capture(path: str) -> Dict[str, Any]:
+    """Read a capture written by write_capture (blocking)."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        capture = json.load(f)
+    if capture.get("version") != CAPTURE_VERSION:
+        raise ValueError(f"Unsupported capture version {capture.get('version')}")
+    return capture
+
+
+def replay_history(capture: Dict[str, Any]) -> Dict[str, list]:
+    """Return the captured recorder output as state lists for the calculators."""
+    return {entity_id: expand_states(rows) for entity_id, rows in capture["history"].items()}
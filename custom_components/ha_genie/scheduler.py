@@ -0,0 +1,66 @@
+"""Report scheduling helpers for HA Genie."""
+import hashlib
+import logging
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+try:
+    from homeassistant.components.recorder import get_instance
+except ImportError:
+    get_instance = None
+
+from .const import FREQUENCY_DAILY, WEEKDAYS
+
+_LOGGER = logging.getLogger(__name__)
+
+# Recorder queue length above which we consider it busy (purge, repack, import)
+RECORDER_BACKLOG_BUSY = 100
+BUSY_RETRY_DELAY = timedelta(minutes=15)
+MAX_POSTPONEMENTS = 8 # Give up waiting after 2 hours and run anyway
+
+
+def entry_jitter(entry_id: str, max_minutes: int) -> timedelta:
+    """Return a deterministic per-entry offset so entries don't all run at once."""
+    if not max_minutes or not entry_id:
+        return timedelta()
+    digest = hashlib.sha256(entry_id.encode()).hexdigest()
+    return timedelta(seconds=int(digest, 16) % (max_minutes * 60))
+
+
+def next_run(now: datetime, frequency: str, at: time, weekday: str, jitter: timedelta) -> datetime:
+    """Return the next aligned run time strictly after `now` (local, tz-aware)."""
+    candidate = now.replace(hour=at.hour, minute=at.minute, second=0, microsecond=0) + jitter
+    if frequency == FREQUENCY_DAILY:
+        step = timedelta(days=1)
+    else:
+        step = timedelta(days=7)
+        target = WEEKDAYS.index(weekday) if weekday in WEEKDAYS else 0
+        candidate += timedelta(days=(target - candidate.weekday()) % 7)
+    # Stepping back first lets a run that is still due later this week be picked
+    candidate -= step
+    while candidate <= now:
+        candidate += step
+    return candidate
+
+
+def previous_run(now: datetime, frequency: str, at: time, weekday: str, jitter: timedelta) -> datetime:
+    """Return the last aligned run time at or before `now` (local, tz-aware)."""
+    step = timedelta(days=1) if frequency == FREQUENCY_DAILY else timedelta(days=7)
+    return next_run(now - step, frequency, at, weekday, jitter)
+
+
+def recorder_busy(hass) -> Optional[str]:
+    """Return why the recorder is busy, or None if a history query is fine now."""
+    if get_instance is None:
+        return None
+    try:
+        instance = get_instance(hass)
+    except KeyError:
+        # Recorder not set up
+        return None
+    if getattr(instance, "migration_in_progress", False):
+        return "database migration in progress"
+    backlog = getattr(instance, "backlog", 0) or 0
+    if backlog > RECORDER_BACKLOG_BUSY:
+        return f"recorder backlog of {backlog} tasks (purge or repack running)"
+    return None
@@ -1,126 +1,285 @@
 """Sensor platform for HA Genie."""
 import logging
+from abc import ABC, abstractmethod
+from functools import partial
 
-from homeassistant.components.sensor import SensorEntity
+from homeassistant.components.sensor import SensorDeviceClass, SensorEntity, SensorStateClass
+from homeassistant.const import CONCENTRATION_PARTS_PER_BILLION, CONCENTRATION_PARTS_PER_MILLION, PERCENTAGE, EntityCategory
 from homeassistant.core import callback
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.device_registry import DeviceEntryType, DeviceInfo
 
+from .baselines import report_value
 from .const import DOMAIN
+from .tokens import usage_totals
 
 _LOGGER = logging.getLogger(__name__)
 
+# category -> (name, fallback unit, device class)
+# Usage categories are totals over the report window, which is not a monotonic
+# meter reading, so they get no energy device class and use MEASUREMENT.
+AGGREGATE_SENSORS = {
+    "temperature_avg": ("Average temperature", "°C", SensorDeviceClass.TEMPERATURE),
+    "humidity_avg": ("Average humidity", PERCENTAGE, SensorDeviceClass.HUMIDITY),
+    "radon_avg_bq_m3": ("Average radon", "Bq/m³", None),
+    "co2_avg_ppm": ("Average CO2", CONCENTRATION_PARTS_PER_MILLION, SensorDeviceClass.CO2),
+    "voc_avg_ppb": ("Average VOC", CONCENTRATION_PARTS_PER_BILLION, None),
+    "electricity_usage_kwh": ("Electricity usage", "kWh", None),
+    "gas_usage_kwh": ("Gas usage", "kWh", None),
+    "contact_openings_count": ("Openings", "openings", None),
+    "radiator_temps_avg": ("Average radiator temperature", "°C", SensorDeviceClass.TEMPERATURE),
+}
+
+# Unique IDs used before they were scoped to the entry -> entity key
+LEGACY_UNIQUE_IDS = {
+    "ha_genie_summary": "summary",
+    "ha_genie_insights": "insights",
+    "ha_genie_alerts": "alerts",
+}
+
+@callback
+def migrate_unique_id(entry_id, registry_entry):
+    """Return the registry update moving a legacy unique ID to the entry-scoped one."""
+    if (key := LEGACY_UNIQUE_IDS.get(registry_entry.unique_id)) is None:
+        return None
+    return {"new_unique_id": f"{entry_id}_{key}"}
+
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up the HA Genie sensors."""
     # Coordinator is now initialized in __init__.py
     coordinator = hass.data[DOMAIN][config_entry.entry_id]
+    # Keep the entity ids and history of installs from before entry-scoped unique IDs
+    await er.async_migrate_entries(hass, config_entry.entry_id, partial(migrate_unique_id, config_entry.entry_id))
     
     async_add_entities([
         HAGenieSummarySensor(coordinator),
         HAGenieInsightsSensor(coordinator),
-        HAGenieAlertsSensor(coordinator)
-    ], True)
+        HAGenieAlertsSensor(coordinator),
+        HAGenieTokenUsageSensor(coordinator)
+    ])
+    
+    # One numeric sensor per category/entity aggregate, created as aggregates appear
+    known = set()
+    
+    @callback
+    def _add_aggregate_sensors():
+        if not coordinator.data:
+            return
+        aggregates = coordinator.data.get("data", {}).get("sensor_aggregates", {})
+        new_entities = []
+        for category, entities in aggregates.items():
+            if category not in AGGREGATE_SENSORS:
+                continue
+            for entity_id in entities:
+                if (category, entity_id) not in known:
+                    known.add((category, entity_id))
+                    new_entities.append(HAGenieAggregateSensor(coordinator, category, entity_id))
+        if new_entities:
+            async_add_entities(new_entities)
+    
+    _add_aggregate_sensors()
+    config_entry.async_on_unload(coordinator.async_add_listener(_add_aggregate_sensors))
 
 
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-class HAGenieBaseSensor(CoordinatorEntity, SensorEntity):
+class HAGenieBaseSensor(CoordinatorEntity, SensorEntity, ABC):
     """Base class for HA Genie sensors."""
     
+    # Unique ID suffix, scoped to the entry so several entries don't collide
+    _key = None
+    
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self._attr_has_entity_name = True
+        if self._key is not None:
+            self._attr_unique_id = f"{coordinator.entry_id}_{self._key}"
+        # One device per entry, so device triggers can match its events.
+        # Named "Genie" so the entity names (and ids) stay "Genie Summary" etc.
+        self._attr_device_info = DeviceInfo(
+            identifiers={(DOMAIN, coordinator.entry_id)},
+            name="Genie",
+            manufacturer="HA Genie",
+            entry_type=DeviceEntryType.SERVICE,
+        )
+        self._update_from_data(coordinator.data)
 
     # CoordinatorEntity handles available, async_added_to_hass, and should_poll=False automatically
     # We do NOT implement async_update, as that would cause polling loops.
 
+    @callback
+    def _handle_coordinator_update(self):
+        """Recompute state and attributes once per coordinator update."""
+        self._update_from_data(self.coordinator.data)
+        super()._handle_coordinator_update()
+
+    @abstractmethod
+    def _update_from_data(self, data):
+        """Set _attr_native_value and _attr_extra_state_attributes from coordinator data."""
+
 
 class HAGenieSummarySensor(HAGenieBaseSensor):
     """Main summary sensor."""
     
-    _attr_name = "Genie Summary"
-    _attr_unique_id = "ha_genie_summary"
+    _attr_name = "Summary"
+    _key = "summary"
     _attr_icon = "mdi:creation"
+    # Bulky report fields stay on the state but are not written to the recorder.
+    # The full report is available through the ha_genie.get_report service.
+    _unrecorded_attributes = frozenset({
+        "comparison",
+        "good_points",
+        "bad_points",
+        "suggestions",
+        "llm_calls",
+        "llm_error",
+    })
 
-    @property
-    def native_value(self):
-        if self.coordinator.data:
-            return self.coordinator.data["analysis"].get("status", "Unknown")
-        return "Initializing"
-
-    @property
-    def extra_state_attributes(self):
-        if self.coordinator.data:
-            data = self.coordinator.data.get("data", {})
-            house = data.get("house_details", {})
-            
-            attrs = {
-                "house_bedrooms": house.get("bedrooms"),
-                "house_sqm": house.get("size_sqm"),
-                "house_residents": house.get("residents"),
-                "house_location": house.get("country"),
-                "house_details": house.get("info"),
-            }
-            
-            # Merge with analysis (which might be a string or dict, handle carefully)
-            # Based on previous code: return self.coordinator.data["analysis"]
-            # But analysis is likely the JSON payload from Gemini?
-            # Actually, standard usage is that 'analysis' is the dict of attributes derived from Gemini response?
-            # Let's check coordinator.py again if I need to be sure, but assuming it is a dict:
-            # Merge with analysis (which might be a string or dict, handle carefully)
-            # Based on previous code: return self.coordinator.data["analysis"]
-            # But analysis is likely the JSON payload from Gemini?
-            # Actually, standard usage is that 'analysis' is the dict of attributes derived from Gemini response?
-            # Let's check coordinator.py again if I need to be sure, but assuming it is a dict:
-            analysis = self.coordinator.data.get("analysis")
-            if isinstance(analysis, dict):
-                attrs.update(analysis)
-            
-            _LOGGER.debug("Setting genie_summary attributes: %s", attrs)
-            return attrs
-        return {}
+    def _update_from_data(self, data):
+        if not data:
+            self._attr_native_value = "Initializing"
+            self._attr_extra_state_attributes = {}
+            return
+        
+        analysis = data.get("analysis")
+        house = data.get("data", {}).get("house_details", {})
+        
+        attrs = {
+            "house_bedrooms": house.get("bedrooms"),
+            "house_sqm": house.get("size_sqm"),
+            "house_residents": house.get("residents"),
+            "house_location": house.get("country"),
+            "house_details": house.get("info"),
+        }
+        
+        # Merge with analysis (the JSON payload from Gemini or the local analyzer)
+        if isinstance(analysis, dict):
+            attrs.update(analysis)
+        
+        # Per-tier latency and token usage of the LLM calls behind this report
+        attrs["llm_calls"] = data.get("llm_calls", [])
+        # True while a streamed report is still arriving
+        attrs["streaming"] = data.get("streaming", False)
+        
+        self._attr_native_value = analysis.get("status", "Unknown") if isinstance(analysis, dict) else "Unknown"
+        self._attr_extra_state_attributes = attrs
 
 
 class HAGenieInsightsSensor(HAGenieBaseSensor):
     """Sensor for positive insights/trends."""
     
-    _attr_name = "Genie Insights"
-    _attr_unique_id = "ha_genie_insights"
+    _attr_name = "Insights"
+    _key = "insights"
     _attr_icon = "mdi:thumb-up-outline"
+    _unrecorded_attributes = frozenset({"suggestions"})
 
-    @property
-    def native_value(self):
-        if self.coordinator.data:
-            count = len(self.coordinator.data["analysis"].get("good_points", []))
-            return f"{count} Trends"
-        return "0 Trends"
-
-    @property
-    def extra_state_attributes(self):
-        if self.coordinator.data:
-            return {
-                "insights": self.coordinator.data["analysis"].get("good_points", []),
-                "suggestions": self.coordinator.data["analysis"].get("suggestions", [])
-            }
-        return {}
+    def _update_from_data(self, data):
+        if not data:
+            self._attr_native_value = "0 Trends"
+            self._attr_extra_state_attributes = {}
+            return
+        
+        analysis = data["analysis"]
+        self._attr_native_value = f"{len(analysis.get('good_points', []))} Trends"
+        self._attr_extra_state_attributes = {
+            "insights": analysis.get("good_points", []),
+            "suggestions": analysis.get("suggestions", [])
+        }
 
 
 class HAGenieAlertsSensor(HAGenieBaseSensor):
     """Sensor for alerts/issues."""
     
-    _attr_name = "Genie Alerts"
-    _attr_unique_id = "ha_genie_alerts"
+    _attr_name = "Alerts"
+    _key = "alerts"
     _attr_icon = "mdi:alert-circle-outline"
 
-    @property
-    def native_value(self):
-        if self.coordinator.data:
-            count = len(self.coordinator.data["analysis"].get("bad_points", []))
-            return f"{count} Alerts"
-        return "0 Alerts"
+    def _update_from_data(self, data):
+        if not data:
+            self._attr_native_value = "0 Alerts"
+            self._attr_extra_state_attributes = {}
+            return
+        
+        analysis = data["analysis"]
+        self._attr_native_value = f"{len(analysis.get('bad_points', []))} Alerts"
+        self._attr_extra_state_attributes = {
+            "alerts": analysis.get("bad_points", [])
+        }
+
+
+class HAGenieTokenUsageSensor(HAGenieBaseSensor):
+    """Diagnostic sensor with the tokens used by the last report."""
+    
+    _attr_name = "Token Usage"
+    _key = "token_usage"
+    _attr_icon = "mdi:counter"
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = "tokens"
+
+    def _update_from_data(self, data):
+        if not data:
+            self._attr_native_value = None
+            self._attr_extra_state_attributes = {}
+            return
+        
+        # Actual usage metadata returned by the backend for each call
+        totals = usage_totals(data.get("llm_calls", []))
+        budget = data.get("token_budget", {})
+        self._attr_native_value = totals["total_tokens"]
+        self._attr_extra_state_attributes = {
+            "prompt_tokens": totals["prompt_tokens"],
+            "output_tokens": totals["output_tokens"],
+            "calls": len(data.get("llm_calls", [])),
+            # Pre-send count (API count or local estimate) after any degradation
+            "counted_prompt_tokens": budget.get("prompt_tokens"),
+            "count_source": budget.get("count_source"),
+            "max_prompt_tokens": budget.get("max_prompt_tokens"),
+            "original_prompt_tokens": budget.get("original_prompt_tokens"),
+            "degraded_categories": budget.get("degraded_categories", {}),
+        }
+
+
+class HAGenieAggregateSensor(HAGenieBaseSensor):
+    """Numeric sensor exposing one computed aggregate from the last report."""
+    
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_icon = "mdi:chart-line"
+
+    def __init__(self, coordinator, category, source_entity_id):
+        self._category = category
+        self._source_entity_id = source_entity_id
+        label, unit, device_class = AGGREGATE_SENSORS[category]
+        
+        # Prefer the source entity's own name and unit (e.g. °F temperatures)
+        source = coordinator.hass.states.get(source_entity_id)
+        source_name = source.name if source else source_entity_id
+        if source and source.attributes.get("unit_of_measurement") and category != "contact_openings_count":
+            unit = source.attributes["unit_of_measurement"]
+        
+        self._attr_name = f"{source_name} {label}"
+        self._attr_unique_id = f"{coordinator.entry_id}_{category}_{source_entity_id}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_device_class = device_class
+        super().__init__(coordinator)
 
     @property
-    def extra_state_attributes(self):
-        if self.coordinator.data:
-            return {
-                "alerts": self.coordinator.data["analysis"].get("bad_points", [])
-            }
-        return {}
+    def available(self):
+        return super().available and self._attr_native_value is not None
+
+    def _update_from_data(self, data):
+        value = None
+        period = None
+        if data:
+            payload = data.get("data", {})
+            period = payload.get("averaging_period")
+            aggregate = payload.get("sensor_aggregates", {}).get(self._category, {}).get(self._source_entity_id)
+            if aggregate is not None:
+                # Binned aggregates are reduced to the whole report window
+                value = report_value(self._category, aggregate)
+        
+        self._attr_native_value = round(value, 2) if value is not None else None
+        self._attr_extra_state_attributes = {
+            "source_entity": self._source_entity_id,
+            "averaging_period": period,
+        }
@@ -0,0 +1,98 @@
+"""Incremental JSON parsing for streamed Gemini responses."""
+import json
+import logging
+from typing import Any, List, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StreamingJSONParser:
+    """Yield top-level fields of a JSON object as soon as each value is complete.
+
+    Text before the opening brace (e.g. a ```json fence) is ignored. Only
+    top-level keys are reported; nested values are returned whole once their
+    closing bracket arrives.
+    """
+
+    def __init__(self):
+        """Initialize."""
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """Add a chunk of text and return the fields completed by it."""
+        self.buffer += text
+        completed = []
+        buf = self.buffer
+
+        while self._pos < len(buf):
+            i = self._pos
+            ch = buf[i]
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._value_start is None:
+                            # Closing quote of a top-level key
+                            self._key = json.loads(buf[self._key_start:i + 1])
+                        else:
+                            self._complete(buf[self._value_start:i + 1], completed)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None and self._key is None:
+                    self._key_start = i
+                elif self._depth == 1 and self._key is not None and self._value_start is None:
+                    self._value_start = i
+            elif ch == ":" and self._depth == 1:
+                pass
+            elif ch in "[{":
+                if self._depth == 1 and self._key is not None and self._value_start is None:
+                    self._value_start = i
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    self._complete(buf[self._value_start:i + 1], completed)
+                elif self._depth == 0:
+                    # End of the object: flush a trailing primitive value
+                    if self._value_start is not None:
+                        self._complete(buf[self._value_start:i], completed)
+                    self._started = False
+            elif ch == "," and self._depth == 1:
+                if self._value_start is not None:
+                    self._complete(buf[self._value_start:i], completed)
+            elif self._depth == 1 and self._key is not None and self._value_start is None and not ch.isspace():
+                # Start of a number, true, false or null
+                self._value_start = i
+
+        return completed
+
+    def _complete(self, raw: str, completed: List[Tuple[str, Any]]) -> None:
+        try:
+            completed.append((self._key, json.loads(raw)))
+        except ValueError:
+            _LOGGER.debug("Could not parse streamed value for %s: %s", self._key, raw)
+        self._key = None
+        self._key_start = None
+        self._value_start = None
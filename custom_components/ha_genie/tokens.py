@@ -0,0 +1,58 @@
+"""Prompt token accounting and size guardrails for HA Genie."""
+import json
+import math
+from typing import Any, Dict, Optional, Tuple
+
+from .const import DATA_AVERAGING_DAILY, DATA_AVERAGING_HOURLY, DATA_AVERAGING_WEEKLY
+
+# Rough average for English text and compact JSON, used when the backend can't count
+CHARS_PER_TOKEN = 4
+# Exact counts cost an API round-trip, so they are only made once the estimate
+# reaches this share of the ceiling. Number-heavy JSON can take twice the
+# estimated tokens, so prompts below it are safely within the limit.
+EXACT_COUNT_SHARE = 0.5
+
+# Each step coarsens a category's granularity by one level
+COARSER_PERIOD = {
+    DATA_AVERAGING_HOURLY: DATA_AVERAGING_DAILY,
+    DATA_AVERAGING_DAILY: DATA_AVERAGING_WEEKLY,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text locally."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def needs_exact_count(estimate: int, limit: int) -> bool:
+    """Return True if an estimated prompt size is close enough to the ceiling to count it exactly."""
+    return bool(limit) and estimate >= limit * EXACT_COUNT_SHARE
+
+
+def next_degradation(aggregates: Dict[str, Any], averaging_period: str, category_periods: Dict[str, str]) -> Optional[Tuple[str, str]]:
+    """Return (category, coarser period) for the noisiest category that can still be coarsened.
+
+    The noisiest category is the one taking up the most space in the prompt,
+    i.e. the one with the most entities and bins. Returns None when every
+    category is already at Weekly granularity.
+    """
+    candidates = []
+    for category, entities in aggregates.items():
+        coarser = COARSER_PERIOD.get(category_periods.get(category, averaging_period))
+        if coarser is None:
+            continue
+        size = len(json.dumps(entities, separators=(",", ":")))
+        candidates.append((size, category, coarser))
+    if not candidates:
+        return None
+    _size, category, coarser = max(candidates)
+    return category, coarser
+
+
+def usage_totals(llm_calls) -> Dict[str, Optional[int]]:
+    """Sum the token usage reported by the LLM calls of one refresh."""
+    totals = {}
+    for key in ("prompt_tokens", "output_tokens", "total_tokens"):
+        values = [call[key] for call in llm_calls if call.get(key) is not None]
+        totals[key] = sum(values) if values else None
+    return totals
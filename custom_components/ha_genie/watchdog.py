@@ -0,0 +1,410 @@
+"""Real-time threshold watchdog for HA Genie.
+
+Between reports the watchdog follows the configured radon, CO2, VOC,
+humidity, contact and climate entities through state change events, without
+recorder queries or LLM calls. Each numeric entity keeps a fixed-size ring
+buffer of its recent samples with a running time-weighted sum, so the
+sliding-window mean is updated in O(1) per state change. A sample counts for
+as long as it held, so a single spike after a quiet hour weighs little, and
+the newest one counts up to now. Windows with an incident or a value above
+the threshold are re-evaluated every minute, so a level that stays put after
+a change (sensors that only report changes) still opens or closes incidents.
+
+An incident starts when the window mean has been above the configured
+threshold over a whole window of samples, or when a door or window stays
+open while the heating is on. It fires one
+`ha_genie_alert` event and is kept (in `.storage`) until the next report,
+which includes it in its payload.
+"""
+import logging
+from datetime import timedelta
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later, async_track_state_change_event, async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .analyzer import get_thresholds
+from .const import (
+    DOMAIN,
+    CONF_ENTITIES_RADON,
+    CONF_ENTITIES_CO2,
+    CONF_ENTITIES_VOC,
+    CONF_ENTITIES_HUMIDITY,
+    CONF_ENTITIES_CONTACT,
+    CONF_ENTITIES_VALVES,
+    CONF_THRESHOLD_RADON,
+    CONF_THRESHOLD_CO2,
+    CONF_THRESHOLD_VOC,
+    CONF_THRESHOLD_HUMIDITY,
+    CONF_WATCHDOG_OPEN_MINUTES,
+    DEFAULT_WATCHDOG_OPEN_MINUTES,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+# category -> (entity option, threshold option, sliding window)
+WATCHED_CATEGORIES = {
+    # Radon sensors report about once an hour
+    "radon_avg_bq_m3": (CONF_ENTITIES_RADON, CONF_THRESHOLD_RADON, timedelta(hours=3)),
+    "co2_avg_ppm": (CONF_ENTITIES_CO2, CONF_THRESHOLD_CO2, timedelta(minutes=30)),
+    "voc_avg_ppb": (CONF_ENTITIES_VOC, CONF_THRESHOLD_VOC, timedelta(minutes=30)),
+    "humidity_avg": (CONF_ENTITIES_HUMIDITY, CONF_THRESHOLD_HUMIDITY, timedelta(hours=1)),
+}
+# Open-while-heating incidents are reported with the contact aggregates
+OPEN_CATEGORY = "contact_openings_count"
+
+INCIDENT_THRESHOLD = "threshold"
+INCIDENT_OPEN_WHILE_HEATING = "open_while_heating"
+
+RING_SIZE = 128 # Samples per entity, bounds memory for chatty sensors
+MAX_INCIDENTS = 50 # Finished incidents kept until the next report
+EVALUATE_INTERVAL = timedelta(minutes=1) # Re-evaluation of open and candidate windows between samples
+
+
+class RingWindow:
+    """Fixed-size ring buffer of samples with a running time-weighted sum over a time window.
+
+    Each sample holds its value until the next one, the newest one until the
+    evaluation time. `area` is the integral of the value over time from the
+    oldest kept sample to the newest, so the window mean is the area inside
+    the window divided by the time it covers.
+    """
+
+    def __init__(self, window: timedelta, size: int = RING_SIZE):
+        """Initialize."""
+        self.window = window.total_seconds()
+        self._times = [0.0] * size
+        self._values = [0.0] * size
+        self._start = 0
+        self._count = 0
+        self.area = 0.0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _index(self, i: int) -> int:
+        return (self._start + i) % len(self._values)
+
+    def add(self, ts: float, value: float) -> None:
+        """Add a sample and drop the ones that ended before the window (amortized O(1))."""
+        if self._count:
+            last = self._index(self._count - 1)
+            if ts <= self._times[last]:
+                # Same timestamp (or out of order): the newest value has no duration yet
+                if ts == self._times[last]:
+                    self._values[last] = value
+                return
+            self.area += self._values[last] * (ts - self._times[last])
+        if self._count == len(self._values):
+            self._merge_oldest()
+        end = self._index(self._count)
+        self._times[end] = ts
+        self._values[end] = value
+        self._count += 1
+        self.advance(ts)
+
+    def advance(self, ts: float) -> None:
+        """Drop the samples that ended before the window ending at `ts`.
+
+        The sample that held at the start of the window stays.
+        """
+        while self._count > 1 and self._times[self._index(1)] <= ts - self.window:
+            self._drop()
+
+    def _drop(self) -> None:
+        second = self._index(1)
+        self.area -= self._values[self._start] * (self._times[second] - self._times[self._start])
+        self._start = second
+        self._count -= 1
+
+    def _merge_oldest(self) -> None:
+        """Merge the two oldest samples into one with their time-weighted value, keeping the area."""
+        first, second, third = self._start, self._index(1), self._index(2)
+        span = self._times[third] - self._times[first]
+        self._values[second] = (
+            self._values[first] * (self._times[second] - self._times[first])
+            + self._values[second] * (self._times[third] - self._times[second])
+        ) / span
+        self._times[second] = self._times[first]
+        self._start = second
+        self._count -= 1
+
+    @property
+    def newest(self) -> Optional[float]:
+        """Return the newest sample value."""
+        return self._values[self._index(self._count - 1)] if self._count else None
+
+    def _end(self, now: Optional[float]) -> float:
+        newest = self._times[self._index(self._count - 1)]
+        return newest if now is None else max(now, newest)
+
+    def covered_at(self, now: Optional[float] = None) -> float:
+        """Return the seconds of the window ending at `now` (the newest sample if None) covered by samples."""
+        if not self._count:
+            return 0.0
+        end = self._end(now)
+        return end - max(self._times[self._start], end - self.window)
+
+    def mean_at(self, now: Optional[float] = None) -> Optional[float]:
+        """Return the time-weighted mean over the covered part of the window ending at `now`.
+
+        Call `advance(now)` first, so only the oldest sample can start before the window.
+        """
+        covered = self.covered_at(now)
+        if covered <= 0:
+            return None
+        end = self._end(now)
+        last = self._index(self._count - 1)
+        area = self.area + self._values[last] * (end - self._times[last])
+        before = max(end - self.window - self._times[self._start], 0.0)
+        return (area - self._values[self._start] * before) / covered
+
+    @property
+    def covered(self) -> float:
+        """Return the seconds of the window covered by samples, up to the newest one."""
+        return self.covered_at()
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Return the time-weighted mean up to the newest sample."""
+        return self.mean_at()
+
+    @property
+    def peak(self) -> Optional[float]:
+        """Return the highest sample in the window."""
+        if not self._count:
+            return None
+        return max(self._values[self._index(i)] for i in range(self._count))
+
+
+def is_heating(state) -> bool:
+    """Return True if a climate entity is heating (or in heat mode if it doesn't report its action)."""
+    action = state.attributes.get("hvac_action")
+    if action is not None:
+        return action == "heating"
+    return state.state == "heat"
+
+
+class Watchdog:
+    """Follows state changes of one entry's entities and records incidents."""
+
+    def __init__(self, hass, coordinator):
+        """Initialize."""
+        self.hass = hass
+        self.coordinator = coordinator
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{coordinator.entry_id or 'default'}.incidents")
+        # Finished incidents since the last report, oldest first
+        self.incidents: List[Dict[str, Any]] = []
+        # entity_id -> ongoing incident
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._windows: Dict[str, RingWindow] = {}
+        # Entities without an incident whose window may still breach as time passes
+        self._candidates = set()
+        self._categories: Dict[str, str] = {}
+        self._contacts = set()
+        self._climates = set()
+        # Open contacts and when they opened, and climate entities that are heating
+        self._open: Dict[str, Any] = {}
+        self._heating = set()
+        self._open_timers = {}
+        self._unsub = None
+        self._unsub_interval = None
+
+    async def async_start(self):
+        """Restore unreported incidents and subscribe to the configured entities."""
+        stored = await self._store.async_load()
+        if stored:
+            # Incidents still running at shutdown are reported with an unknown end
+            self.incidents = (stored.get("incidents", []) + stored.get("active", []))[-MAX_INCIDENTS:]
+        self.async_subscribe()
+
+    def async_stop(self):
+        """Unsubscribe and save the unreported incidents."""
+        if self._unsub:
+            self._unsub()
+            self._unsub = None
+        if self._unsub_interval:
+            self._unsub_interval()
+            self._unsub_interval = None
+        for cancel in self._open_timers.values():
+            cancel()
+        self._open_timers = {}
+        self._save()
+
+    def async_subscribe(self):
+        """(Re)subscribe to the configured entities, e.g. after the entity options changed."""
+        if self._unsub:
+            self._unsub()
+        config = self.coordinator.config
+        self._categories = {
+            entity_id: category
+            for category, (config_key, _threshold, _window) in WATCHED_CATEGORIES.items()
+            for entity_id in config.get(config_key) or []
+        }
+        self._contacts = set(config.get(CONF_ENTITIES_CONTACT) or [])
+        self._climates = set(config.get(CONF_ENTITIES_VALVES) or [])
+        watched = set(self._categories) | self._contacts | self._climates
+        # Forget removed entities
+        for entity_id in set(self._windows) - watched:
+            del self._windows[entity_id]
+        self._candidates &= watched
+        for entity_id in set(self._active) - watched:
+            self._end_incident(entity_id)
+        for entity_id in set(self._open) - watched:
+            self._set_closed(entity_id)
+        self._heating &= watched
+
+        # Seed from the current states so a level that is already high is caught
+        for entity_id in sorted(watched):
+            if (state := self.hass.states.get(entity_id)) is not None:
+                self.handle_state(entity_id, state)
+        self._unsub = async_track_state_change_event(self.hass, sorted(watched), self._async_state_changed)
+        if self._unsub_interval is None:
+            self._unsub_interval = async_track_time_interval(self.hass, self._async_reevaluate, EVALUATE_INTERVAL)
+
+    @callback
+    def _async_state_changed(self, event):
+        self.handle_state(event.data["entity_id"], event.data.get("new_state"))
+
+    @callback
+    def _async_reevaluate(self, now):
+        """Weigh the newest samples up to now, without waiting for the next state change."""
+        for entity_id in sorted((set(self._active) | self._candidates) & set(self._windows)):
+            self._evaluate(entity_id, now.timestamp())
+
+    def handle_state(self, entity_id: str, state) -> None:
+        """Evaluate one state change in O(1)."""
+        if state is None or state.state in ("unknown", "unavailable"):
+            return
+        if entity_id in self._categories:
+            try:
+                value = float(state.state)
+            except ValueError:
+                return
+            self._update_window(entity_id, state.last_updated.timestamp(), value)
+        elif entity_id in self._contacts:
+            if state.state in ("on", "open"):
+                self._open.setdefault(entity_id, state.last_updated)
+                self._schedule_open_check(entity_id)
+            else:
+                self._set_closed(entity_id)
+        elif entity_id in self._climates:
+            if is_heating(state):
+                if entity_id not in self._heating:
+                    self._heating.add(entity_id)
+                    for contact in self._open:
+                        self._schedule_open_check(contact)
+            else:
+                self._heating.discard(entity_id)
+                if not self._heating:
+                    for contact in list(self._open_timers):
+                        self._open_timers.pop(contact)()
+                    for contact in list(self._active):
+                        if contact in self._contacts:
+                            self._end_incident(contact)
+
+    def _update_window(self, entity_id, ts, value):
+        window_length = WATCHED_CATEGORIES[self._categories[entity_id]][2]
+        if (window := self._windows.get(entity_id)) is None:
+            window = self._windows[entity_id] = RingWindow(window_length)
+        window.add(ts, value)
+        if (incident := self._active.get(entity_id)) is not None:
+            incident["peak"] = round(max(incident["peak"], value), 2)
+        self._evaluate(entity_id, max(ts, dt_util.utcnow().timestamp()))
+
+    def _evaluate(self, entity_id, now):
+        """Open or close the entity's incident from its window mean up to `now`."""
+        category = self._categories[entity_id]
+        _config_key, threshold_key, window_length = WATCHED_CATEGORIES[category]
+        window = self._windows[entity_id]
+        window.advance(now)
+
+        # Thresholds are read live so option changes apply straight away
+        threshold = float(get_thresholds(self.coordinator.config)[threshold_key])
+        mean = window.mean_at(now)
+        if entity_id in self._active:
+            if mean is not None and mean <= threshold:
+                self._end_incident(entity_id)
+            return
+        if mean is None or (mean <= threshold and window.newest <= threshold):
+            self._candidates.discard(entity_id)
+            return
+        self._candidates.add(entity_id)
+        if mean > threshold and window.covered_at(now) >= window.window:
+            # Only a breach that held over a whole window opens an incident
+            minutes = round(window_length.total_seconds() / 60)
+            self._start_incident(
+                entity_id, INCIDENT_THRESHOLD, category, round(mean, 2), threshold,
+                f"{entity_id} averaged {round(mean, 1)} over {minutes} minutes, above the threshold of {threshold:g}",
+                peak=round(window.peak, 2),
+            )
+            self._candidates.discard(entity_id)
+
+    def _open_minutes(self) -> float:
+        return float(self.coordinator.config.get(CONF_WATCHDOG_OPEN_MINUTES, DEFAULT_WATCHDOG_OPEN_MINUTES))
+
+    def _schedule_open_check(self, entity_id):
+        if not self._heating or entity_id in self._open_timers or entity_id in self._active:
+            return
+        due = self._open[entity_id] + timedelta(minutes=self._open_minutes())
+        delay = max((due - dt_util.utcnow()).total_seconds(), 0)
+        self._open_timers[entity_id] = async_call_later(self.hass, delay, partial(self._async_open_check, entity_id))
+
+    @callback
+    def _async_open_check(self, entity_id, _now):
+        self._open_timers.pop(entity_id, None)
+        if entity_id in self._open and self._heating and entity_id not in self._active:
+            minutes = self._open_minutes()
+            self._start_incident(
+                entity_id, INCIDENT_OPEN_WHILE_HEATING, OPEN_CATEGORY, minutes, minutes,
+                f"{entity_id} has been open for {minutes:g} minutes while the heating is on",
+            )
+
+    def _set_closed(self, entity_id):
+        self._open.pop(entity_id, None)
+        if (cancel := self._open_timers.pop(entity_id, None)) is not None:
+            cancel()
+        if entity_id in self._active:
+            self._end_incident(entity_id)
+
+    def _start_incident(self, entity_id, incident_type, category, value, threshold, message, peak=None):
+        incident = {
+            "type": incident_type,
+            "category": category,
+            "entity_id": entity_id,
+            "started": dt_util.utcnow().isoformat(),
+            "ended": None,
+            "value": value,
+            "peak": value if peak is None else peak,
+            "threshold": threshold,
+            "message": message,
+        }
+        self._active[entity_id] = incident
+        _LOGGER.info("Alert: %s", message)
+        self.hass.bus.async_fire(f"{DOMAIN}_alert", dict(
+            incident, device_id=self.coordinator.device_id(), entry_id=self.coordinator.entry_id
+        ))
+        self._save()
+
+    def _end_incident(self, entity_id):
+        incident = self._active.pop(entity_id)
+        incident["ended"] = dt_util.utcnow().isoformat()
+        self.incidents = (self.incidents + [incident])[-MAX_INCIDENTS:]
+        self._save()
+
+    def async_take_incidents(self) -> List[Dict[str, Any]]:
+        """Return the incidents since the last report (ongoing ones included) and reset."""
+        incidents = self.incidents + [dict(incident) for incident in self._active.values()]
+        self.incidents = []
+        self._save()
+        return incidents
+
+    def _save(self):
+        self._store.async_delay_save(
+            lambda: {"incidents": self.incidents, "active": list(self._active.values())}, 10
+        )
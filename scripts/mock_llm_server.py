@@ -0,0 +1,134 @@
+"""Local stand-in LLM server for load testing HA Genie.
+
+Serves an OpenAI-compatible `POST /v1/chat/completions` endpoint (including
+`"stream": true` server-sent events) that returns a valid HA Genie analysis,
+with configurable latency, rate limiting and malformed output. A seeded RNG
+makes runs reproducible, so refresh throughput can be benchmarked
+deterministically.
+
+Point the integration at it with the `openai_compatible` LLM backend and base
+URL `http://<host>:8080/v1`.
+
+Usage:
+    python scripts/mock_llm_server.py --latency 2 --jitter 0.5 --rate-limit 1 --malformed 0.1 --seed 42
+
+`GET /stats` returns request counters.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+VALID_ANALYSIS = {
+    "status": "Fair",
+    "good_points": ["Electricity usage is in line with similar homes (mock)."],
+    "bad_points": ["Bathroom humidity peaked above 65% (mock)."],
+    "comparison": "Mock comparison text. Indicative only.",
+    "suggestions": ["Ventilate the bathroom after showers (mock)."],
+}
+
+# Ways a real model gets it wrong
+MALFORMED_OUTPUTS = [
+    json.dumps(VALID_ANALYSIS)[:60], # truncated JSON
+    "Sure! Here is your analysis:\n" + json.dumps(VALID_ANALYSIS), # prose before JSON
+    json.dumps({"status": "Excellent", "good_points": "none"}), # wrong schema
+]
+
+
+class MockLLM:
+    """Request handler state."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.tokens = float(args.rate_limit or 0)
+        self.last_refill = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "malformed": 0}
+
+    def _allow(self):
+        """Token bucket: `rate_limit` requests per second, burst of the same size."""
+        if not self.args.rate_limit:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.args.rate_limit, self.tokens + (now - self.last_refill) * self.args.rate_limit)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def _content(self):
+        if self.rng.random() < self.args.malformed:
+            self.stats["malformed"] += 1
+            return self.rng.choice(MALFORMED_OUTPUTS)
+        return json.dumps(VALID_ANALYSIS)
+
+    async def completions(self, request):
+        self.stats["requests"] += 1
+        if not self._allow():
+            self.stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit exceeded (mock)"}}, status=429, headers={"Retry-After": "1"}
+            )
+
+        body = await request.json()
+        prompt = " ".join(m.get("content", "") for m in body.get("messages", []))
+        # Decide everything up front so the RNG sequence doesn't depend on timing
+        delay = max(0.0, self.args.latency + self.rng.uniform(-self.args.jitter, self.args.jitter))
+        content = self._content()
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+        self.stats["ok"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return web.json_response({
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        size = self.args.chunk_size
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        for piece in pieces:
+            await asyncio.sleep(delay / max(len(pieces), 1))
+            event = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            await response.write(f"data: {json.dumps(event)}\n\n".encode())
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def stats_handler(self, request):
+        return web.json_response(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- uniform latency jitter in seconds")
+    parser.add_argument("--rate-limit", type=float, default=0, help="requests per second before 429 (0 = unlimited)")
+    parser.add_argument("--malformed", type=float, default=0.0, help="fraction of responses with malformed output")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters per streamed chunk")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockLLM(args)
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", mock.completions)
+    app.router.add_get("/stats", mock.stats_handler)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
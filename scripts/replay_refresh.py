@@ -0,0 +1,121 @@
+"""Replay captured HA Genie refreshes and report per-stage timings.
+
+A capture is written by the `ha_genie.capture_refresh` service to
+`<config>/ha_genie_captures/`. It holds one refresh's recorder output and LLM
+responses. This runner drives the coordinator pipeline from it with a
+throwaway Home Assistant instance: the recorder query is answered from the
+capture, the LLM backend replays the recorded responses, and the clock is
+frozen at the capture time so the bins line up as they did live. Nothing
+touches a database or the network, and no API key is needed: the configured
+backend is never created.
+
+The first run starts cold. Later runs reuse the coordinator and show the
+memoized aggregation path. The timings recorded live are printed alongside
+for comparison. Run it from the repository root with Home Assistant
+installed:
+
+Usage:
+    python scripts/replay_refresh.py ha_genie_captures/<entry>-<time>.json.gz --runs 5
+    python scripts/replay_refresh.py a.json.gz b.json.gz --json > timings.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+from datetime import datetime
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+from homeassistant.util import dt as dt_util  # noqa: E402
+
+from custom_components.ha_genie.const import CONF_ARCHIVE_ENABLED, CONF_SCHEDULE_TIME  # noqa: E402
+from custom_components.ha_genie.coordinator import HAGenieCoordinator  # noqa: E402
+from custom_components.ha_genie.replay import ReplayBackend, read_capture, replay_history  # noqa: E402
+
+
+async def replay(path, runs):
+    """Replay one capture `runs` times and return its timings."""
+    capture = read_capture(path)
+    captured_at = datetime.fromisoformat(capture["captured_at"])
+    history_data = replay_history(capture)
+    # No archive writes or aligned scheduling in a throwaway instance
+    config = dict(capture["config"], **{CONF_ARCHIVE_ENABLED: False, CONF_SCHEDULE_TIME: None})
+
+    async def _get_history_data(hass, entity_ids, duration=None):
+        return {entity_id: history_data[entity_id] for entity_id in entity_ids if entity_id in history_data}
+
+    def _create_backend(hass, config, api_key):
+        # The real backend would need an API key; every run gets a fresh replay below
+        return ReplayBackend(hass, [])
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        try:
+            with patch.object(dt_util, "utcnow", return_value=captured_at), \
+                    patch.object(dt_util, "now", return_value=dt_util.as_local(captured_at)), \
+                    patch("custom_components.ha_genie.coordinator.get_history_data", _get_history_data), \
+                    patch("custom_components.ha_genie.coordinator.create_backend", _create_backend):
+                coordinator = HAGenieCoordinator(hass, config, "", entry_id="replay")
+                results = []
+                misses = 0
+                for _run in range(runs):
+                    coordinator.backend = ReplayBackend(hass, capture["llm_calls"], capture.get("token_counts"))
+                    await coordinator._async_update_data()
+                    results.append(coordinator.stage_timings)
+                    misses += coordinator.backend.misses
+        finally:
+            await hass.async_stop(force=True)
+
+    return {
+        "capture": path,
+        "entities": len(history_data),
+        "states": sum(len(states) for states in history_data.values()),
+        "captured": capture.get("stage_timings", {}),
+        "runs": results,
+        "prompt_mismatches": misses,
+    }
+
+
+def print_report(report):
+    """Print a stage timing table for one capture."""
+    runs = report["runs"]
+    stages = list(dict.fromkeys(stage for run in runs for stage in run))
+    print(f"{report['capture']}: {report['entities']} entities, {report['states']} states")
+    if report["prompt_mismatches"]:
+        print(f"  {report['prompt_mismatches']} prompts differed from the capture")
+    print(f"  {'stage':<16}{'captured':>10}{'cold':>10}{'warm med':>10}")
+    for stage in stages:
+        captured = report["captured"].get(stage)
+        warm = [run[stage] for run in runs[1:] if stage in run]
+        print(
+            f"  {stage:<16}"
+            f"{'-' if captured is None else captured:>10}"
+            f"{runs[0].get(stage, '-'):>10}"
+            f"{round(statistics.median(warm), 1) if warm else '-':>10}"
+        )
+
+
+async def main_async(args):
+    reports = [await replay(path, args.runs) for path in args.captures]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    for report in reports:
+        print_report(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture files (.json.gz)")
+    parser.add_argument("--runs", type=int, default=3, help="replays per capture; the first one is cold")
+    parser.add_argument("--json", action="store_true", help="print raw timings as JSON")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,37 +9,104 @@ import json
 # but assuming we run this from the parent dir or use relative imports carefully.
 # For simplicity in this environment, I will mock the HA imports heavily.
 
+import importlib.abc
+import importlib.machinery
+import importlib.util
 import sys
 import os
+import tempfile
+from datetime import time, timezone
+from zoneinfo import ZoneInfo
+
+# Mock HA modules before importing local modules. Every submodule of the
+# mocked packages (homeassistant.helpers.storage etc.) resolves to a MagicMock.
+class MockModuleFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    PACKAGES = ("homeassistant", "google", "voluptuous")
+
+    def find_spec(self, name, path, target=None):
+        if name.split(".")[0] in self.PACKAGES:
+            return importlib.machinery.ModuleSpec(name, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        module = MagicMock()
+        module.__name__ = spec.name
+        module.__spec__ = spec
+        module.__path__ = []
+        return module
+
+    def exec_module(self, module):
+        pass
+
+for name in list(sys.modules):
+    if name.split(".")[0] in MockModuleFinder.PACKAGES:
+        del sys.modules[name]
+sys.meta_path.insert(0, MockModuleFinder())
+
+import homeassistant.core
+import homeassistant.components.sensor
+import homeassistant.helpers.update_coordinator
+import homeassistant.util.dt
 
-# Mock HA modules before importing local modules
-sys.modules['homeassistant'] = MagicMock()
-sys.modules['homeassistant.core'] = MagicMock()
-sys.modules['homeassistant.components.sensor'] = MagicMock()
-sys.modules['homeassistant.helpers.update_coordinator'] = MagicMock()
 # Ensure DataUpdateCoordinator is a class we can inherit from without weird MagicMock behavior
 class MockCoordinator:
     def __init__(self, hass, logger, name, update_interval):
         self.hass = hass
         self.last_update_success = True
         self.data = None
-sys.modules['homeassistant.helpers.update_coordinator'].DataUpdateCoordinator = MockCoordinator
-sys.modules['homeassistant.util'] = MagicMock()
-sys.modules['homeassistant.util.dt'] = MagicMock()
-sys.modules['google'] = MagicMock()
-sys.modules['google.genai'] = MagicMock()
-sys.modules['google.api_core'] = MagicMock()
-sys.modules['google.api_core.exceptions'] = MagicMock()
-sys.modules['voluptuous'] = MagicMock()
+
+    def async_update_listeners(self):
+        pass
+
+class MockCoordinatorEntity:
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+
+    def __class_getitem__(cls, item):
+        return cls
+
+homeassistant.core.callback = lambda func: func
+homeassistant.helpers.update_coordinator.DataUpdateCoordinator = MockCoordinator
+homeassistant.helpers.update_coordinator.CoordinatorEntity = MockCoordinatorEntity
+homeassistant.components.sensor.SensorEntity = type("SensorEntity", (), {})
+# Real clock helpers, local time is UTC unless a test patches DEFAULT_TIME_ZONE
+homeassistant.util.dt.DEFAULT_TIME_ZONE = timezone.utc
+homeassistant.util.dt.utcnow = lambda: datetime.now(timezone.utc)
+homeassistant.util.dt.now = lambda: datetime.now(homeassistant.util.dt.DEFAULT_TIME_ZONE)
+homeassistant.util.dt.as_local = lambda value: value.astimezone(homeassistant.util.dt.DEFAULT_TIME_ZONE)
+homeassistant.util.dt.as_utc = lambda value: value.astimezone(timezone.utc)
+homeassistant.util.dt.start_of_local_day = lambda value: datetime.combine(
+    value.date() if isinstance(value, datetime) else value, time(), tzinfo=homeassistant.util.dt.DEFAULT_TIME_ZONE
+)
 
 # Now import the local modules
 # We need to set up the path to find custom_components
 sys.path.append(os.getcwd())
 
-from custom_components.ha_genie.data import aggregate_data
-from custom_components.ha_genie.sensor import HAGenieCoordinator
+from custom_components.ha_genie.data import AggregationGraph, aggregate_data, build_raw_sample_debug, history_start
+from custom_components.ha_genie.analyzer import analyze_locally, get_thresholds, merge_analyses, validate_analysis
+from custom_components.ha_genie.archive import ARCHIVE_DIR, AggregateArchive
+from custom_components.ha_genie.backfill import complete_weeks
+from custom_components.ha_genie.backfill_worker import reduce_partition
+from custom_components.ha_genie.watchdog import RingWindow, Watchdog
+from custom_components.ha_genie.replay import RecordingBackend, ReplayBackend, build_capture, read_capture, replay_history, write_capture
+from custom_components.ha_genie.baselines import BaselineTracker, archive_baselines
+from custom_components.ha_genie.streaming import StreamingJSONParser
+from custom_components.ha_genie.sketches import KLLSketch
+from custom_components.ha_genie.scheduler import entry_jitter, next_run, previous_run
+from custom_components.ha_genie.sensor import HAGenieSummarySensor, HAGenieTokenUsageSensor, migrate_unique_id
+from custom_components.ha_genie.discovery import EVENT_STATE_CHANGED, EntityIndex, async_get_entity_index
+from custom_components.ha_genie.backends import LLMBackend, LLMResponse
+from custom_components.ha_genie.batch import BatchManager
+from custom_components.ha_genie.options import CHANGE_ENTITIES, CHANGE_HOUSE, CHANGE_NEXT_CALL, CHANGE_RELOAD, classify_changes
+from custom_components.ha_genie.tokens import estimate_tokens, needs_exact_count, next_degradation, usage_totals
+from custom_components.ha_genie.coordinator import HAGenieCoordinator
 from custom_components.ha_genie.const import *
 
+class MockBackend(LLMBackend):
+    async def async_generate(self, model, prompt):
+        return LLMResponse(f"re: {prompt}")
+
 class MockState:
     def __init__(self, state, last_updated=None, attributes=None):
         self.state = state
@@ -82,14 +149,645 @@ class TestHAGenie(unittest.TestCase):
         self.assertAlmostEqual(summary["sensor_aggregates"]["electricity_usage_kwh"]["sensor.energy"], 50.0)
         self.assertEqual(summary["sensor_aggregates"]["contact_openings_count"]["binary_sensor.door"], 2)
         
-        # Check Debug Field Exists (It should be in aggregate_data output, but removed before API call)
-        self.assertIn("raw_sample_debug", summary)
+        # Debug samples are built on demand only, never as part of the payload
+        self.assertNotIn("raw_sample_debug", summary)
+        debug = build_raw_sample_debug(history_data)
+        self.assertEqual([s["state"] for s in debug["binary_sensor.door"]], ["off", "on", "off", "on"])
+
+    def test_aggregation_graph_recomputes_dirty_categories(self):
+        """Test that only categories with new samples or changed entities are recomputed."""
+        hass = MagicMock()
+        config = {CONF_ENTITIES_TEMP: ["sensor.temp"], CONF_ENTITIES_CONTACT: ["binary_sensor.door"]}
+        history_data = {
+            "sensor.temp": [MockState("18"), MockState("22")],
+            "binary_sensor.door": [MockState("on")],
+        }
+        graph = AggregationGraph()
+
+        aggregate_data(hass, config, history_data, graph=graph)
+        self.assertEqual(graph.recomputed, ["temperature_avg", "contact_openings_count"])
+        aggregate_data(hass, config, history_data, graph=graph)
+        self.assertEqual(graph.recomputed, [])
+
+        history_data["sensor.temp"] = history_data["sensor.temp"] + [MockState("23")]
+        summary = aggregate_data(hass, config, history_data, graph=graph)
+        self.assertEqual(graph.recomputed, ["temperature_avg"])
+        self.assertAlmostEqual(summary["sensor_aggregates"]["temperature_avg"]["sensor.temp"], 21.0)
+        self.assertEqual(summary["sensor_aggregates"]["contact_openings_count"]["binary_sensor.door"], 1)
+
+        config[CONF_ENTITIES_CONTACT] = []
+        summary = aggregate_data(hass, config, history_data, graph=graph)
+        self.assertEqual(graph.recomputed, [])
+        self.assertNotIn("contact_openings_count", summary["sensor_aggregates"])
+
+    def test_usage_bins_cover_full_window(self):
+        """Test that the daily and hourly usage bins add up over the whole 7 day window."""
+        now = datetime(2025, 1, 8, 13, 30, tzinfo=timezone.utc)
+        start = history_start(now, DATA_AVERAGING_DAILY)
+        self.assertEqual(start, datetime(2025, 1, 1, tzinfo=timezone.utc))
+        # Meter rising 1 kWh per hour, read every hour since the day before the window
+        history_data = {"sensor.energy": [
+            MockState(str(hour), start + timedelta(hours=hour)) for hour in range(-24, 181)
+        ]}
+        config = {CONF_ENTITIES_ENERGY: ["sensor.energy"]}
+
+        with patch("custom_components.ha_genie.data.dt_util.utcnow", return_value=now):
+            daily = aggregate_data(MagicMock(), config, history_data, averaging_period=DATA_AVERAGING_DAILY)
+            hourly = aggregate_data(MagicMock(), config, history_data, averaging_period=DATA_AVERAGING_HOURLY)
+
+        days = daily["sensor_aggregates"]["electricity_usage_kwh"]["sensor.energy"]
+        # Seven complete days and the day in progress, flagged as partial
+        self.assertEqual([b["start"][:10] for b in days], [f"2025-01-0{d}" for d in range(1, 9)])
+        self.assertEqual([b["value"] for b in days], [24.0] * 7 + [13.0])
+        self.assertEqual([b.get("partial", False) for b in days], [False] * 7 + [True])
+        hours = hourly["sensor_aggregates"]["electricity_usage_kwh"]["sensor.energy"]
+        self.assertEqual(len(hours), 169)
+        self.assertEqual(hours[-2]["start"], "2025-01-08T12:00:00+00:00")
+        self.assertEqual(hours[-1], {"start": "2025-01-08T13:00:00+00:00", "value": 0.0, "partial": True})
+        self.assertEqual(sum(b["value"] for b in hours), 168.0)
+
+class TestDistributions(unittest.TestCase):
+
+    def test_sketch_merge_matches_single_sketch(self):
+        """Test that merged hourly sketches give the same quantiles as one sketch, in fixed memory."""
+        values = [(i * 7919) % 10000 for i in range(50000)]
+        single = KLLSketch()
+        single.extend(values)
+        merged = KLLSketch()
+        for hour in range(168):
+            part = KLLSketch()
+            part.extend(values[hour::168])
+            merged.merge(part)
+
+        self.assertEqual(len(merged), 50000)
+        self.assertEqual((merged.min, merged.max), (0, 9999))
+        self.assertLess(sum(len(c) for c in merged.compactors), 1000)
+        for sketch in (single, merged):
+            self.assertAlmostEqual(sketch.quantile(0.5), 5000, delta=300)
+            self.assertAlmostEqual(sketch.quantile(0.95), 9500, delta=300)
+
+    def test_time_above_threshold_per_bin(self):
+        """Test that an hour of high CO2 is reported in the right hourly, daily and weekly bins."""
+        now = datetime(2025, 1, 8, 10, 30, tzinfo=timezone.utc)
+        history_data = {"sensor.co2": [
+            MockState("800", now - timedelta(days=7)),
+            MockState("1500", datetime(2025, 1, 7, 9, tzinfo=timezone.utc)),
+            MockState("800", datetime(2025, 1, 7, 10, tzinfo=timezone.utc)),
+        ]}
+        config = {CONF_ENTITIES_CO2: ["sensor.co2"], CONF_DISTRIBUTION_STATS: True}
+
+        # Bins follow the local day and hour: 09:00 UTC is 04:00 on 7 January in New York
+        for time_zone, day_start, hour_start in (
+            (timezone.utc, "2025-01-07T00:00:00+00:00", "2025-01-07T09:00:00+00:00"),
+            (ZoneInfo("America/New_York"), "2025-01-07T00:00:00-05:00", "2025-01-07T04:00:00-05:00"),
+        ):
+            with self.subTest(time_zone=str(time_zone)):
+                graph = AggregationGraph()
+                with patch("custom_components.ha_genie.data.dt_util.utcnow", return_value=now), \
+                        patch.object(homeassistant.util.dt, "DEFAULT_TIME_ZONE", time_zone):
+                    weekly = aggregate_data(MagicMock(), config, history_data, graph=graph)
+                    daily = aggregate_data(MagicMock(), config, history_data, averaging_period=DATA_AVERAGING_DAILY, graph=graph)
+                    hourly = aggregate_data(MagicMock(), config, history_data, averaging_period=DATA_AVERAGING_HOURLY, graph=graph)
+
+                self.assertEqual(weekly["sensor_distributions"]["co2_avg_ppm"]["sensor.co2"], {"min": 800.0, "max": 1500.0, "p50": 800.0, "p95": 800.0, "hours_above": 1.0})
+                days = daily["sensor_distributions"]["co2_avg_ppm"]["sensor.co2"]
+                self.assertEqual([b["start"] for b in days if b["hours_above"]], [day_start])
+                self.assertTrue(days[-1]["partial"])
+                high = [b for b in hourly["sensor_distributions"]["co2_avg_ppm"]["sensor.co2"] if b["hours_above"]]
+                self.assertEqual([(b["start"], b["p95"]) for b in high], [(hour_start, 1500.0)])
+
+class TestLocalAnalyzer(unittest.TestCase):
+
+    def test_thresholds(self):
+        """Test that the local analyzer flags values above configured thresholds."""
+        aggregates = {
+            "humidity_avg": {"sensor.bathroom": 72.0, "sensor.bedroom": 50.0},
+            "co2_avg_ppm": {"sensor.office": [{"start": "a", "value": 800}, {"start": "b", "value": 1600}]},
+            "temperature_avg": {"sensor.lounge": 20.5},
+        }
+
+        analysis = analyze_locally(aggregates, get_thresholds({}))
+
+        # Same schema as the Gemini response
+        for key in ("status", "good_points", "bad_points", "comparison", "suggestions"):
+            self.assertIn(key, analysis)
+        self.assertEqual(analysis["source"], "local")
+        # CO2 peak over 1400 ppm is critical
+        self.assertEqual(analysis["status"], "Needs Attention")
+        self.assertEqual(len(analysis["bad_points"]), 2)
+
+        relaxed = analyze_locally(aggregates, get_thresholds({CONF_THRESHOLD_HUMIDITY: 80, CONF_THRESHOLD_CO2: 2000}))
+        self.assertEqual(relaxed["status"], "Good")
+        self.assertEqual(relaxed["bad_points"], [])
+
+    def test_schema_validation(self):
+        """Test that malformed model output is rejected (and would trigger escalation)."""
+        self.assertEqual(validate_analysis(analyze_locally({}, get_thresholds({}))), [])
+        self.assertTrue(validate_analysis({"status": "Great", "good_points": "all fine"}))
+        self.assertTrue(validate_analysis(["not", "a", "dict"]))
+
+    def test_merge_domains(self):
+        """Test that per-domain results merge in a fixed order with the worst status."""
+        results = {
+            "heating": {"status": "Fair", "good_points": [], "bad_points": ["Cold lounge"], "comparison": "Cool.", "suggestions": ["Heat"]},
+            "energy": {"status": "Good", "good_points": ["Low usage"], "bad_points": [], "comparison": "Low.", "suggestions": ["Heat"]},
+            "air_quality": {"status": "Error", "good_points": [], "bad_points": ["API Error: timeout"], "comparison": "Analysis failed.", "suggestions": []},
+        }
+
+        merged = merge_analyses(results)
+
+        self.assertEqual(merged["status"], "Fair")
+        self.assertTrue(merged["comparison"].startswith("Energy and gas: Low."))
+        self.assertEqual(merged["suggestions"], ["Heat"])
+        self.assertEqual(merged["llm_error"], ["Indoor air quality: API Error: timeout"])
+        self.assertEqual(merge_analyses({"energy": results["air_quality"]})["status"], "Error")
+
+class TestArchive(unittest.TestCase):
+
+    def test_append_read_and_compact(self):
+        """Test that the archive de-duplicates overlapping runs and range-reads via mmap."""
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        hours = [
+            {"start": (start + timedelta(hours=i)).isoformat(), "value": float(i)}
+            for i in range(48)
+        ]
+
+        with tempfile.TemporaryDirectory() as path:
+            archive = AggregateArchive(path, retention_days=365, compact_after_days=30)
+            # The bin in progress isn't archived yet
+            partial = dict(hours[24], partial=True)
+            self.assertEqual(archive.append("Hourly", start, {"co2_avg_ppm": {"sensor.co2": hours[:24] + [partial]}}), 24)
+            # Overlapping window only appends the new bins and rewrites the last archived one
+            self.assertEqual(archive.append("Hourly", start, {"co2_avg_ppm": {"sensor.co2": hours}}), 25)
+
+            records = archive.read("Hourly", "co2_avg_ppm", "sensor.co2", start + timedelta(hours=10), start + timedelta(hours=12))
+            self.assertEqual([v for _, v in records], [10.0, 11.0])
+            self.assertEqual(archive.read("Hourly", "co2_avg_ppm", "sensor.missing", start, start + timedelta(days=1)), [])
+
+            # Two months later everything is old enough to compact into daily means
+            archive.compact(start + timedelta(days=60), force=True)
+            records = archive.read("Hourly", "co2_avg_ppm", "sensor.co2", start, start + timedelta(days=2))
+            self.assertEqual([v for _, v in records], [11.5, 35.5])
+
+    def test_append_across_runs_replaces_last_bin(self):
+        """Test that a bin re-sent by the next report replaces its record instead of being dropped or duplicated."""
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+        def days(*values):
+            return {"gas_usage_kwh": {"sensor.gas": [
+                {"start": (start + timedelta(days=i)).isoformat(), "value": v} for i, v in values
+            ]}}
+
+        with tempfile.TemporaryDirectory() as path:
+            archive = AggregateArchive(path, retention_days=365, compact_after_days=30)
+            self.assertEqual(archive.append("Daily", start, days((0, 10.0), (1, 4.0))), 2)
+            # The next run has the complete second day and a new third one
+            self.assertEqual(archive.append("Daily", start, days((0, 10.0), (1, 12.0), (2, 11.0))), 2)
+            # Older bins are skipped, the last one is replaced
+            self.assertEqual(archive.append("Daily", start, days((1, 99.0))), 0)
+            self.assertEqual(archive.append("Daily", start, days((2, 13.0))), 1)
+
+            records = archive.read("Daily", "gas_usage_kwh", "sensor.gas", start, start + timedelta(days=7))
+            self.assertEqual([v for _, v in records], [10.0, 12.0, 13.0])
+            # Compacted into one bucket per day, nothing is counted twice
+            archive.compact(start + timedelta(days=60), force=True)
+            records = archive.read("Daily", "gas_usage_kwh", "sensor.gas", start, start + timedelta(days=7))
+            self.assertEqual(sum(v for _, v in records), 35.0)
+
+class TestBackfill(unittest.TestCase):
+
+    def test_reduce_partition_and_merge_into_archive(self):
+        """Test that a backfilled day is binned like a report and never overwrites archived days."""
+        day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        # Meter rising 1 kWh per hour, read at :15 and :45, after the state carried in at midnight
+        samples = {"sensor.meter": [(day.timestamp(), "99.75", None)] + [
+            (day.timestamp() + 900 + i * 1800, str(100.25 + i / 2), None) for i in range(48)
+        ]}
+        result = reduce_partition("electricity_usage_kwh", day.timestamp(), samples)["sensor.meter"]
+        self.assertEqual(len(result["hourly"]), 24)
+        self.assertEqual(set(result["hourly"]), {(day.timestamp() + h * 3600, 1.0) for h in range(24)})
+        self.assertEqual(result["daily"], 24.0)
+
+        with tempfile.TemporaryDirectory() as path:
+            archive = AggregateArchive(path, retention_days=365, compact_after_days=30)
+            archive.append("Hourly", day, {"electricity_usage_kwh": {"sensor.meter": [{"start": (day + timedelta(days=1)).isoformat(), "value": 9.0}]}})
+            backfilled = result["hourly"] + [(day.timestamp() + 86400 + 3600, 1.0)]
+            self.assertEqual(archive.insert("Hourly", {"electricity_usage_kwh": {"sensor.meter": backfilled}}), 24)
+            records = archive.read("Hourly", "electricity_usage_kwh", "sensor.meter", day, day + timedelta(days=2))
+            self.assertEqual(len(records), 25)
+            self.assertEqual(records[-1][1], 9.0)
+
+        daily = {"gas_usage_kwh|sensor.gas": {(day + timedelta(days=i)).date().isoformat(): 2.0 for i in range(14)}}
+        weeks = list(complete_weeks(daily, day, day + timedelta(days=14)))
+        # 2025-01-01 is a Wednesday, so only the week from Monday 6th is complete
+        self.assertEqual(len(weeks), 1)
+        self.assertEqual(len(weeks[0][1]["gas_usage_kwh"]["sensor.gas"]), 7)
+
+        # A backfilled week never replaces one the baselines got from a report
+        tracker = BaselineTracker()
+        tracker.update({"gas_usage_kwh": {"sensor.gas": 30.0}}, weeks[0][0])
+        tracker.update(weeks[0][1], weeks[0][0], replace=False)
+        record = tracker.data["entities"]["gas_usage_kwh|sensor.gas"]
+        self.assertEqual(list(record["weeks"].values()), [30.0])
+        self.assertEqual([list(m.values()) for m in record["months"].values()], [[30.0]])
+
+class TestBaselines(unittest.TestCase):
+
+    def test_rolling_and_seasonal(self):
+        """Test that baselines use prior weeks and the same month last year."""
+        tracker = BaselineTracker()
+        start = datetime(2024, 1, 1)
+
+        for week, usage in enumerate([10, 12, 14, 16, 18]):
+            tracker.update({"gas_usage_kwh": {"sensor.gas": usage}}, start + timedelta(weeks=week))
+
+        # Only the last 4 weeks (plus the current one) are kept
+        record = tracker.data["entities"]["gas_usage_kwh|sensor.gas"]
+        self.assertEqual(len(record["weeks"]), 5)
+
+        now = datetime(2025, 1, 20)
+        tracker.update({"gas_usage_kwh": {"sensor.gas": 20}}, now - timedelta(weeks=1))
+        # The day in progress doesn't count towards the week's total
+        bins = [{"start": "a", "value": 11}, {"start": "b", "value": 11}, {"start": "c", "value": 4, "partial": True}]
+        baselines = tracker.compute({"gas_usage_kwh": {"sensor.gas": bins}}, now)
+
+        result = baselines["gas_usage_kwh"]["sensor.gas"]
+        self.assertEqual(result["now"], 22)
+        self.assertEqual(result["4w"], 17.0)
+        # January 2024 saw 10, 12, 14, 16 and 18 kWh weeks
+        self.assertEqual(result["ly"], 14.0)
+        self.assertAlmostEqual(result["ly_pct"], 57.1)
+
+    def test_rolling_and_seasonal_from_archive(self):
+        """Test that baselines are derived from complete weeks of archived bins."""
+        now = datetime(2025, 1, 20, tzinfo=timezone.utc)
+        window_start = datetime(2025, 1, 13, tzinfo=timezone.utc)
+        last_year = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        days = [
+            {"start": (last_year + timedelta(days=i)).isoformat(), "value": 2.0}
+            for i in range(31) if i != 10
+        ] + [
+            {"start": (window_start - timedelta(days=28 - i)).isoformat(), "value": 3.0}
+            for i in range(28)
+        ]
+        current = {"gas_usage_kwh": {"sensor.gas": [{"start": "a", "value": 28.0}], "sensor.new": 5.0}}
+
+        with tempfile.TemporaryDirectory() as path:
+            archive = AggregateArchive(path, retention_days=730, compact_after_days=30)
+            archive.append("Daily", last_year, {"gas_usage_kwh": {"sensor.gas": days}})
+            # Compacted or not, the bins of a day count the same
+            archive.compact(now, force=True)
+            baselines = archive_baselines(archive, "Daily", current, window_start, now)
+
+        # The week with a missing day is left out, the other three had 14 kWh
+        self.assertEqual(baselines, {"gas_usage_kwh": {"sensor.gas": {
+            "now": 28.0, "4w": 21.0, "4w_pct": 33.3, "ly": 14.0, "ly_pct": 100.0,
+        }}})
+
+class TestStreamingParser(unittest.TestCase):
+
+    def test_fields_complete_in_order(self):
+        """Test that top-level fields are reported as soon as their value closes."""
+        response = '```json\n{"status": "Fair", "good_points": ["Warm [enough]", "Dry"], "comparison": "Uses \\"x\\"", "n": 3}\n```'
+        parser = StreamingJSONParser()
+
+        fields = []
+        for i in range(0, len(response), 4):
+            chunk = parser.feed(response[i:i + 4])
+            fields.extend(chunk)
+            if chunk and chunk[0][0] == "status":
+                # Status is available before the rest of the response arrives
+                self.assertLess(i, len(response) // 2)
+
+        self.assertEqual(fields, [
+            ("status", "Fair"),
+            ("good_points", ["Warm [enough]", "Dry"]),
+            ("comparison", 'Uses "x"'),
+            ("n", 3),
+        ])
+
+class TestScheduler(unittest.TestCase):
+
+    def test_aligned_runs(self):
+        """Test that runs align to the configured weekday/time with a stable jitter."""
+        wednesday = datetime(2025, 3, 26, 10, 0, tzinfo=timezone.utc)
+
+        self.assertEqual(next_run(wednesday, FREQUENCY_WEEKLY, time(3, 0), "Monday", timedelta()), datetime(2025, 3, 31, 3, 0, tzinfo=timezone.utc))
+        self.assertEqual(next_run(wednesday, FREQUENCY_WEEKLY, time(11, 0), "Wednesday", timedelta()), datetime(2025, 3, 26, 11, 0, tzinfo=timezone.utc))
+        self.assertEqual(next_run(wednesday, FREQUENCY_DAILY, time(9, 0), "Monday", timedelta(minutes=5)), datetime(2025, 3, 27, 9, 5, tzinfo=timezone.utc))
+
+        jitter = entry_jitter("entry_a", 15)
+        self.assertEqual(jitter, entry_jitter("entry_a", 15))
+        self.assertLess(jitter, timedelta(minutes=15))
+        self.assertEqual(entry_jitter("entry_a", 0), timedelta())
+
+        self.assertEqual(previous_run(wednesday, FREQUENCY_WEEKLY, time(3, 0), "Monday", timedelta()), datetime(2025, 3, 24, 3, 0, tzinfo=timezone.utc))
+        self.assertEqual(previous_run(wednesday, FREQUENCY_DAILY, time(9, 0), "Monday", timedelta(minutes=5)), datetime(2025, 3, 26, 9, 5, tzinfo=timezone.utc))
+
+    def test_missed_run_after_downtime(self):
+        """Test that a restored report older than the last scheduled run asks for a catch-up run."""
+        with patch('custom_components.ha_genie.backends.genai'), \
+             patch('custom_components.ha_genie.coordinator.Store'):
+            coordinator = HAGenieCoordinator(MagicMock(), {CONF_UPDATE_FREQUENCY: FREQUENCY_WEEKLY, CONF_SCHEDULE_WEEKDAY: "Monday"}, "fake_key")
+        coordinator.schedule_time = time(3, 0)
+        wednesday = datetime(2025, 3, 26, 10, 0, tzinfo=timezone.utc)
+
+        with patch("custom_components.ha_genie.coordinator.dt_util.now", return_value=wednesday):
+            # Monday's 03:00 report ran
+            coordinator.data = {"generated_at": "2025-03-24T03:01:00+00:00"}
+            self.assertFalse(coordinator.missed_run())
+            # HA was down on Monday morning, the report is from the week before
+            coordinator.data = {"generated_at": "2025-03-17T03:01:00+00:00"}
+            self.assertTrue(coordinator.missed_run())
+
+class TestTokenBudget(unittest.TestCase):
+
+    def test_noisiest_category_degrades_first(self):
+        """Test that the largest category is coarsened one step at a time."""
+        hourly = [{"start": f"2025-01-01T{h:02d}:00:00", "value": 20.5} for h in range(24)]
+        aggregates = {
+            "temperature_avg": {"sensor.a": hourly, "sensor.b": hourly},
+            "co2_avg_ppm": {"sensor.c": hourly[:2]},
+        }
+
+        self.assertEqual(next_degradation(aggregates, DATA_AVERAGING_HOURLY, {}), ("temperature_avg", DATA_AVERAGING_DAILY))
+        self.assertEqual(
+            next_degradation(aggregates, DATA_AVERAGING_HOURLY, {"temperature_avg": DATA_AVERAGING_WEEKLY}),
+            ("co2_avg_ppm", DATA_AVERAGING_DAILY)
+        )
+        self.assertIsNone(next_degradation(aggregates, DATA_AVERAGING_WEEKLY, {}))
+
+        self.assertEqual(estimate_tokens("x" * 10), 3)
+        # Only prompts near the ceiling are worth an exact count
+        self.assertFalse(needs_exact_count(5000, 30000))
+        self.assertTrue(needs_exact_count(20000, 30000))
+        self.assertFalse(needs_exact_count(20000, 0))
+        self.assertEqual(
+            usage_totals([{"prompt_tokens": 10, "output_tokens": 5, "total_tokens": 15}, {"prompt_tokens": None}]),
+            {"prompt_tokens": 10, "output_tokens": 5, "total_tokens": 15}
+        )
+
+class TestOptionChanges(unittest.TestCase):
+
+    def test_classify_changes(self):
+        """Test that option changes are grouped by how they can be applied."""
+        old = {CONF_GEMINI_MODEL: "a", CONF_HOUSE_BEDROOMS: 3, CONF_DATA_AVERAGING: DATA_AVERAGING_DAILY}
+        new = dict(old, **{CONF_GEMINI_MODEL: "b", CONF_ENTITIES_CO2: ["sensor.co2"], CONF_ENTITIES_VOC: []})
+        self.assertEqual(classify_changes(old, new), {CHANGE_NEXT_CALL: [CONF_GEMINI_MODEL], CHANGE_ENTITIES: [CONF_ENTITIES_CO2]})
+
+        new = dict(old, **{CONF_HOUSE_BEDROOMS: 4, CONF_DATA_AVERAGING: DATA_AVERAGING_HOURLY})
+        self.assertEqual(classify_changes(old, new), {CHANGE_HOUSE: [CONF_HOUSE_BEDROOMS], CHANGE_RELOAD: [CONF_DATA_AVERAGING]})
+        # Options the entry didn't store yet are saved with their defaults
+        new = dict(old, **{CONF_STREAMING: DEFAULT_STREAMING, CONF_WATCHDOG: DEFAULT_WATCHDOG, CONF_THRESHOLD_CO2: DEFAULT_THRESHOLD_CO2})
+        self.assertEqual(classify_changes(old, new), {})
+        new[CONF_WATCHDOG] = not DEFAULT_WATCHDOG
+        self.assertEqual(classify_changes(old, new), {CHANGE_RELOAD: [CONF_WATCHDOG]})
+
+class TestDiscovery(unittest.TestCase):
+
+    def test_index_proposals_and_incremental_updates(self):
+        """Test that the index proposes matching entities and tracks single-entity updates."""
+        index = EntityIndex()
+        index.add("sensor.lounge_temp", {"domain": "sensor", "device_class": "temperature", "unit": "°C"})
+        index.add("sensor.radon", {"domain": "sensor", "unit": "Bq/m³"})
+        index.add("sensor.grid_power", {"domain": "sensor", "device_class": "energy", "unit": "kWh", "state_class": "measurement"})
+        index.add("sensor.grid_energy", {"domain": "sensor", "device_class": "energy", "unit": "kWh", "state_class": "total_increasing"})
+        index.add("binary_sensor.front_door", {"domain": "binary_sensor", "device_class": "door"})
+        index.add("climate.hall", {"domain": "climate"})
+
+        proposals = index.propose()
+        self.assertEqual(proposals[CONF_ENTITIES_TEMP], ["sensor.lounge_temp"])
+        self.assertEqual(proposals[CONF_ENTITIES_RADON], ["sensor.radon"])
+        self.assertEqual(proposals[CONF_ENTITIES_ENERGY], ["sensor.grid_energy"])
+        self.assertEqual(proposals[CONF_ENTITIES_CONTACT], ["binary_sensor.front_door"])
+        self.assertEqual(proposals[CONF_ENTITIES_VALVES], ["climate.hall"])
+        self.assertEqual(proposals[CONF_ENTITIES_CO2], [])
+
+        index.add("sensor.lounge_temp", {"domain": "sensor", "device_class": "humidity", "unit": "%"})
+        index.remove("climate.hall")
+        proposals = index.propose()
+        self.assertEqual(proposals[CONF_ENTITIES_TEMP], [])
+        self.assertEqual(proposals[CONF_ENTITIES_HUMIDITY], ["sensor.lounge_temp"])
+        self.assertEqual(proposals[CONF_ENTITIES_VALVES], [])
+
+    def test_state_attribute_changes_refresh_the_index(self):
+        """Test that an entity is re-indexed when its attributes change without a registry update."""
+        state = MockState("400", attributes={"unit_of_measurement": "ppm"})
+        state.entity_id, state.domain = "sensor.co2", "sensor"
+        hass = MagicMock(data={})
+        hass.states.async_all.return_value = [state]
+        registry = MagicMock(entities={})
+        registry.async_get.return_value = None
+        with patch("custom_components.ha_genie.discovery.er.async_get", return_value=registry):
+            index = async_get_entity_index(hass)
+        listeners = {c[0][0]: c[0][1] for c in hass.bus.async_listen.call_args_list}
+        self.assertEqual(index.propose()[CONF_ENTITIES_CO2], [])
+
+        # The integration sets the device class later, without touching the registry
+        new_state = MockState("410", attributes={"unit_of_measurement": "ppm", "device_class": "carbon_dioxide"})
+        new_state.entity_id, new_state.domain = "sensor.co2", "sensor"
+        listeners[EVENT_STATE_CHANGED](MagicMock(data={"entity_id": "sensor.co2", "old_state": state, "new_state": new_state}))
+        self.assertEqual(index.propose()[CONF_ENTITIES_CO2], ["sensor.co2"])
+
+        listeners[EVENT_STATE_CHANGED](MagicMock(data={"entity_id": "sensor.co2", "old_state": new_state, "new_state": None}))
+        self.assertEqual(index.propose()[CONF_ENTITIES_CO2], [])
+
+class TestSensors(unittest.TestCase):
+
+    def test_unique_ids_are_scoped_to_the_entry(self):
+        """Test that two entries get distinct unique IDs and legacy ones are migrated."""
+        first, second = MagicMock(entry_id="first", data=None), MagicMock(entry_id="second", data=None)
+        self.assertEqual(HAGenieSummarySensor(first)._attr_unique_id, "first_summary")
+        self.assertEqual(HAGenieSummarySensor(second)._attr_unique_id, "second_summary")
+        self.assertEqual(HAGenieTokenUsageSensor(first)._attr_unique_id, "first_token_usage")
+
+        self.assertEqual(migrate_unique_id("first", MagicMock(unique_id="ha_genie_alerts")), {"new_unique_id": "first_alerts"})
+        self.assertIsNone(migrate_unique_id("first", MagicMock(unique_id="first_alerts")))
+
+class TestBatch(unittest.IsolatedAsyncioTestCase):
+
+    async def test_queue_submit_and_fan_out(self):
+        """Test that queued prompts go out as one job and results return to the right entries."""
+        hass = MagicMock()
+        hass.async_create_background_task = lambda coro, name: asyncio.ensure_future(coro)
+        backend = MockBackend(hass)
+        backend.async_generate = AsyncMock(wraps=backend.async_generate)
+
+        with patch("custom_components.ha_genie.batch.Store"), \
+                patch("custom_components.ha_genie.batch.async_call_later"):
+            manager = BatchManager(hass)
+            coordinators = {}
+            for entry_id in ("a", "b"):
+                coordinators[entry_id] = MagicMock(backend=backend, api_key="key")
+                manager.async_register(entry_id, coordinators[entry_id])
+                await manager.async_enqueue(entry_id, "model", f"prompt {entry_id}")
+
+            await manager._async_flush(None)
+            self.assertEqual(manager._state["queue"], {})
+            self.assertEqual([job["entries"] for job in manager._state["jobs"].values()], [["a", "b"]])
+            await asyncio.sleep(0)
+            await manager._async_poll(None)
+
+        self.assertEqual(manager._state["jobs"], {})
+        self.assertEqual(backend.async_generate.await_count, 2)
+        for entry_id, coordinator in coordinators.items():
+            result = coordinator.async_apply_batch_result.call_args[0][0]
+            self.assertEqual(result["text"], f"re: prompt {entry_id}")
+
+class TestReplay(unittest.IsolatedAsyncioTestCase):
+
+    async def test_capture_round_trip_and_replay(self):
+        """Test that a capture restores the history and replays responses by prompt."""
+        backend = MockBackend(MagicMock())
+        recording = RecordingBackend(backend)
+        await recording.async_generate("m", "first")
+        await recording.async_generate("m", "second")
+
+        captured_at = datetime(2025, 1, 8, tzinfo=timezone.utc)
+        history_data = {"sensor.co2": [MockState("800", captured_at - timedelta(hours=2)), MockState("900", captured_at - timedelta(hours=1))]}
+        config = {CONF_GEMINI_API_KEY: "secret", CONF_ENTITIES_CO2: ["sensor.co2"]}
+        with tempfile.TemporaryDirectory() as path:
+            file_path = os.path.join(path, "captures", "entry.json.gz")
+            write_capture(file_path, build_capture(captured_at, config, history_data, recording, {"total": 1.0}))
+            capture = read_capture(file_path)
+
+        self.assertNotIn(CONF_GEMINI_API_KEY, capture["config"])
+        states = replay_history(capture)["sensor.co2"]
+        self.assertEqual([s.state for s in states], ["800", "900"])
+        self.assertEqual(states[0].last_updated, captured_at - timedelta(hours=2))
+
+        replay = ReplayBackend(MagicMock(), capture["llm_calls"])
+        self.assertEqual((await replay.async_generate("m", "second")).text, "re: second")
+        # A changed prompt gets the next unused response
+        self.assertEqual((await replay.async_generate("m", "changed")).text, "re: first")
+        self.assertEqual(replay.misses, 1)
+
+    async def test_replay_script_runs_offline(self):
+        """Test that the replay script drives a refresh from a capture without an API key."""
+        spec = importlib.util.spec_from_file_location(
+            "replay_refresh", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "replay_refresh.py")
+        )
+        replay_refresh = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(replay_refresh)
+
+        recording = RecordingBackend(MockBackend(MagicMock()))
+        recording.calls.append({"model": "m", "prompt": "p", "text": json.dumps({"status": "Good"}), "usage": None})
+        captured_at = datetime(2025, 1, 8, tzinfo=timezone.utc)
+        history_data = {"sensor.co2": [MockState("800", captured_at - timedelta(hours=2))]}
+        config = {CONF_GEMINI_API_KEY: "secret", CONF_ENTITIES_CO2: ["sensor.co2"]}
+
+        async def fake_executor_job(target, *args):
+            return target(*args)
+
+        hass = MagicMock(async_add_executor_job=fake_executor_job, async_stop=AsyncMock())
+        with tempfile.TemporaryDirectory() as path, \
+             patch.object(replay_refresh, "HomeAssistant", return_value=hass), \
+             patch("custom_components.ha_genie.backends.genai.Client", side_effect=ValueError("No API key")), \
+             patch("custom_components.ha_genie.coordinator.Store") as MockStore:
+            MockStore.return_value.async_load = AsyncMock(return_value=None)
+            MockStore.return_value.async_save = AsyncMock()
+            file_path = os.path.join(path, "entry.json.gz")
+            write_capture(file_path, build_capture(captured_at, config, history_data, recording, {"total": 1.0}))
+            report = await replay_refresh.replay(file_path, 1)
+
+        self.assertEqual(report["entities"], 1)
+        self.assertEqual(len(report["runs"]), 1)
+        self.assertIn("total", report["runs"][0])
+        hass.async_stop.assert_awaited_once()
+
+class TestWatchdog(unittest.TestCase):
+
+    def test_ring_window(self):
+        """Test that the ring buffer keeps a time-weighted mean over the time window in fixed memory."""
+        window = RingWindow(timedelta(seconds=10), size=4)
+        for i in range(10):
+            window.add(i, float(i))
+        self.assertEqual(len(window), 4)
+        # Merging the oldest samples keeps the area, each value held for one second
+        self.assertEqual((window.covered, window.mean), (9.0, 4.0))
+        # A sample after a long gap has no duration yet, the previous value held meanwhile
+        window.add(100, 50.0)
+        self.assertEqual((window.covered, window.mean), (10.0, 9.0))
+        window.add(105, 9.0)
+        self.assertEqual(window.mean, 29.5)
+
+    def _run_watchdog(self, samples, ticks=()):
+        """Feed (minute, CO2) samples and then re-evaluation ticks (minutes) to a watchdog.
+
+        Returns the watchdog and the fired events.
+        """
+        start = datetime(2025, 1, 8, 10, tzinfo=timezone.utc)
+        hass = MagicMock()
+        hass.states.get.return_value = None
+        coordinator = MagicMock(entry_id="entry", config={CONF_ENTITIES_CO2: ["sensor.co2"]})
+        with patch("custom_components.ha_genie.watchdog.Store"), \
+                patch("custom_components.ha_genie.watchdog.async_track_state_change_event"), \
+                patch("custom_components.ha_genie.watchdog.async_track_time_interval") as track_interval, \
+                patch("custom_components.ha_genie.watchdog.dt_util.utcnow", return_value=start):
+            watchdog = Watchdog(hass, coordinator)
+            watchdog.async_subscribe()
+            for minute, value in samples:
+                watchdog.handle_state("sensor.co2", MockState(str(value), start + timedelta(minutes=minute)))
+            reevaluate = track_interval.call_args[0][1]
+            for minute in ticks:
+                reevaluate(start + timedelta(minutes=minute))
+        return watchdog, [c[0] for c in hass.bus.async_fire.call_args_list]
+
+    def test_single_spike_after_gap(self):
+        """Test that one high sample after a quiet gap doesn't open an incident."""
+        _watchdog, events = self._run_watchdog([(0, 800), (120, 3000), (121, 800), (125, 800)])
+        self.assertEqual(events, [])
+
+    def test_irregular_sample_spacing(self):
+        """Test that samples are weighted by how long they held, not by how many arrived."""
+        # A burst of high readings after a long low one stays below the 1400 ppm threshold
+        burst = [(40 + i / 6, 2000) for i in range(12)]
+        _watchdog, events = self._run_watchdog([(0, 800)] + burst + [(42, 800)])
+        self.assertEqual(events, [])
+        # A high reading that held for most of the window isn't outvoted by a burst of low ones
+        burst = [(29 + i / 10, 1000) for i in range(10)]
+        _watchdog, events = self._run_watchdog([(0, 1600)] + burst + [(31, 1000)])
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][1]["value"], 1560.0)
+
+    def test_step_change_without_further_samples(self):
+        """Test that a level that jumps and then stays put opens, and later closes, an incident."""
+        # A change-only sensor reports 2000 ppm once and nothing after it
+        watchdog, events = self._run_watchdog([(0, 800), (10, 2000)], ticks=range(11, 60))
+        # Opened at minute 30, when 20 minutes at 2000 ppm lifted the window mean to 1600
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][1]["value"], 1600.0)
+        self.assertEqual(watchdog.async_take_incidents()[0]["ended"], None)
+
+        watchdog, events = self._run_watchdog([(0, 800), (10, 2000), (50, 700)], ticks=range(51, 100))
+        self.assertEqual(len(events), 1)
+        # The mean fell below the threshold without another sample, so the incident ended
+        incidents = watchdog.async_take_incidents()
+        self.assertIsNotNone(incidents[0]["ended"])
+        self.assertEqual(watchdog._candidates, set())
+
+    def test_sustained_breach_raises_one_alert(self):
+        """Test that a CO2 breach fires one alert and is handed to the next report when it ends."""
+        values = [900, 1500, 1600, 1700, 1800, 1600, 1500, 1500, 900, 800, 700, 700, 700, 700]
+        watchdog, events = self._run_watchdog([(5 * i, value) for i, value in enumerate(values)])
+
+        # The first 30 minute window averaged 1516 ppm
+        self.assertEqual(len(events), 1)
+        event_type, event_data = events[0]
+        self.assertEqual(event_type, f"{DOMAIN}_alert")
+        self.assertEqual(event_data["entity_id"], "sensor.co2")
+        incidents = watchdog.async_take_incidents()
+        self.assertEqual([(i["category"], i["peak"]) for i in incidents], [("co2_avg_ppm", 1800.0)])
+        self.assertEqual(watchdog.async_take_incidents(), [])
 
 class TestCoordinator(unittest.IsolatedAsyncioTestCase):
     
     async def test_api_call_structure_and_privacy(self):
         """Test that the coordinator removes debug data and calls API correctly."""
+        config_dir = self.enterContext(tempfile.TemporaryDirectory())
         hass = MagicMock()
+        hass.config.config_dir = config_dir
+        hass.config.path = lambda *parts: os.path.join(config_dir, *parts)
         config = {
             CONF_GEMINI_API_KEY: "fake_key",
             CONF_ENTITIES_TEMP: ["sensor.temp"]
@@ -102,8 +800,13 @@ class TestCoordinator(unittest.IsolatedAsyncioTestCase):
         # Easier to patch 'custom_components.ha_genie.sensor.get_history_data'
         
         # Use AsyncMock for the history function since it is awaited
-        with patch('custom_components.ha_genie.sensor.get_history_data', new_callable=AsyncMock) as mock_history, \
-             patch('custom_components.ha_genie.sensor.genai') as MockGenaiModule:
+        with patch('custom_components.ha_genie.coordinator.get_history_data', new_callable=AsyncMock) as mock_history, \
+             patch('custom_components.ha_genie.backends.genai') as MockGenaiModule, \
+             patch('custom_components.ha_genie.coordinator.Store') as MockStore:
+             
+            # Nothing stored yet in .storage
+            MockStore.return_value.async_load = AsyncMock(return_value=None)
+            MockStore.return_value.async_save = AsyncMock()
              
             MockClient = MockGenaiModule.Client
             
@@ -159,6 +862,8 @@ class TestCoordinator(unittest.IsolatedAsyncioTestCase):
             
             # We need the client mock to return our response when generate_content is called
             mock_client_instance.models.generate_content.return_value = mock_response
+            mock_client_instance.models.count_tokens.return_value.total_tokens = 500
+            mock_response.usage_metadata = None
 
             # Run Update
             result = await coordinator._async_update_data()
@@ -175,6 +880,34 @@ class TestCoordinator(unittest.IsolatedAsyncioTestCase):
             # VERIFY RESULT
             self.assertEqual(result["analysis"]["status"], "Good")
             self.assertEqual(result["analysis"]["good_points"], ["Nice temp"])
+            # A small prompt is estimated locally, without a count_tokens round-trip
+            mock_client_instance.models.count_tokens.assert_not_called()
+            self.assertEqual(coordinator.token_budget["count_source"], "estimate")
+            # The archive is written under the config directory only
+            self.assertTrue(os.path.isdir(os.path.join(config_dir, ARCHIVE_DIR)))
+
+    async def test_stream_starts_from_empty_analysis(self):
+        """Test that streamed fields are never mixed with the previous report's fields."""
+        hass = MagicMock()
+        with patch('custom_components.ha_genie.backends.genai'), \
+             patch('custom_components.ha_genie.coordinator.Store'):
+            coordinator = HAGenieCoordinator(hass, {CONF_GEMINI_API_KEY: "fake_key"}, "fake_key")
+
+        coordinator.data = {"analysis": {"status": "Needs Attention", "bad_points": ["Old issue"], "suggestions": ["Old tip"]}}
+        coordinator.async_set_updated_data = MagicMock()
+        response = json.dumps({"status": "Good", "good_points": ["Dry"], "bad_points": [], "suggestions": []})
+
+        async def stream(model, prompt):
+            for i in range(0, len(response), 8):
+                yield LLMResponse(response[i:i + 8])
+
+        coordinator.backend = MagicMock(async_generate_stream=stream)
+        text, _usage = await coordinator._stream_gemini("model", "prompt", "primary")
+
+        self.assertEqual(text, response)
+        published = [c[0][0]["analysis"] for c in coordinator.async_set_updated_data.call_args_list]
+        self.assertEqual(published[0], {"status": "Good"})
+        self.assertEqual(published[-1], json.loads(response))
 
 if __name__ == '__main__':
     unittest.main()